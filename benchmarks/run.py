@@ -0,0 +1,405 @@
+"""
+benchmarks.run
+~~~~~~~~~~~~~~
+
+Times the hot paths of Switchboard and compares the results with the stored
+baselines (see baseline.json). Usage::
+
+    python benchmarks/run.py              # compare with the baselines
+    python benchmarks/run.py --save       # store new baselines
+    python benchmarks/run.py nested ip    # only benchmarks matching a name
+
+Exits with a non-zero status when a benchmark is slower than its baseline by
+more than the threshold. Timings depend on the machine, so baselines should
+only be compared with those stored on the same machine.
+
+:copyright: (c) 2015 Kyle Adams.
+:license: Apache License 2.0, see LICENSE for more details.
+"""
+
+from collections import OrderedDict
+import fnmatch
+import gc
+import json
+import optparse
+import os
+import pickle
+import sys
+import timeit
+
+# Benchmark the working tree rather than an installed Switchboard.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import datastore.core  # noqa: E402
+
+from switchboard import manager, serializer  # noqa: E402
+from switchboard.builtins import (  # noqa: E402
+    IPAddressConditionSet,
+    QueryStringConditionSet,
+)
+from switchboard.conditions import ConditionSet, String  # noqa: E402
+from switchboard.manager import SwitchManager  # noqa: E402
+from switchboard.models import (  # noqa: E402
+    Switch,
+    DISABLED, SELECTIVE, GLOBAL, INHERIT,
+    INCLUDE,
+)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'baseline.json')
+# How much slower than its baseline a benchmark may get, as a fraction.
+THRESHOLD = 0.3
+REPEAT = 5
+
+benchmarks = OrderedDict()
+
+
+def benchmark(number):
+    '''
+    Registers a benchmark. The decorated function sets up the data and
+    returns the function to time, which is called ``number`` times per
+    repetition.
+    '''
+    def register(setup):
+        benchmarks[setup.__name__] = (setup, number)
+        return setup
+    return register
+
+
+class FakeRedis(object):
+    '''
+    An in-memory stand-in for the parts of a Redis client that Switchboard
+    and the datastore use, so that the Redis code paths can be measured
+    without a Redis server.
+    '''
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+        return True
+
+    def delete(self, key):
+        return int(self.data.pop(key, None) is not None)
+
+    def exists(self, key):
+        return key in self.data
+
+    def setnx(self, key, value):
+        if key in self.data:
+            return False
+        self.data[key] = str(value)
+        return True
+
+    def incr(self, key):
+        value = int(self.data.get(key, 0)) + 1
+        self.data[key] = str(value)
+        return value
+
+    def mget(self, keys):
+        return [self.data.get(k) for k in keys]
+
+    def scan_iter(self, match=None, count=None):
+        keys = list(self.data)
+        return (k for k in keys if match is None or
+                fnmatch.fnmatchcase(k, match))
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline(object):
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def set(self, key, value):
+        self.commands.append((key, value))
+
+    def execute(self):
+        for key, value in self.commands:
+            self.redis.set(key, value)
+        self.commands = []
+
+
+class RawRedisDatastore(datastore.Datastore):
+    '''
+    Stores already serialized values in a Redis client, by key.
+    '''
+    def __init__(self, redis):
+        self._redis = redis
+
+    def get(self, key):
+        return self._redis.get(str(key))
+
+    def put(self, key, value):
+        self._redis.set(str(key), value)
+
+    def delete(self, key):
+        self._redis.delete(str(key))
+
+    def contains(self, key):
+        return self._redis.exists(str(key))
+
+    def query(self, query):
+        raise NotImplementedError
+
+
+class FakeRedisDatastore(datastore.ShimDatastore):
+    '''
+    Laid out like datastore.redis.RedisDatastore: a serializer shim over the
+    Redis client, exposed as ``_redis``.
+    '''
+    def __init__(self, redis, serializer):
+        self._redis = redis
+        child = datastore.serialize.shim(RawRedisDatastore(redis), serializer)
+        super(FakeRedisDatastore, self).__init__(child)
+
+
+class Request(object):
+    '''
+    Just enough of a request for the request condition sets.
+    '''
+    path = '/'
+    environ = {}
+    headers = {}
+    method = 'GET'
+
+    def __init__(self, remote_addr='10.0.0.1', query_string=''):
+        self.remote_addr = remote_addr
+        self.query_string = query_string
+
+
+def make_condition_set(namespace):
+    class NamespaceConditionSet(ConditionSet):
+        name = String()
+
+        def get_namespace(self):
+            return namespace
+
+        def can_execute(self, instance):
+            return isinstance(instance, Request)
+
+        def get_field_value(self, instance, field_name):
+            return instance.query_string
+
+    NamespaceConditionSet.__name__ = 'ConditionSet_%s' % namespace
+    return NamespaceConditionSet()
+
+
+def setup_manager(ds=None, condition_sets=()):
+    '''
+    Returns a manager over a fresh datastore, with ``condition_sets``
+    registered in place of the builtin ones.
+    '''
+    Switch.ds = ds if ds is not None else datastore.DictDatastore()
+    Switch.snapshot = None
+    Switch.feed = None
+    manager.registry.clear()
+    manager.registry_by_namespace.clear()
+    manager.compiled_switches.clear()
+    operator = SwitchManager(auto_create=False)
+    for condition_set in condition_sets:
+        operator.register(condition_set)
+    return operator
+
+
+def create_switches(count, **kwargs):
+    Switch.save_many(Switch(key='switch-%d' % i, **kwargs)
+                     for i in xrange(count))
+
+
+@benchmark(number=5000)
+def is_active_global():
+    operator = setup_manager()
+    Switch.create(key='global', status=GLOBAL)
+    return lambda: operator.is_active('global')
+
+
+@benchmark(number=5000)
+def is_active_disabled():
+    operator = setup_manager()
+    Switch.create(key='disabled', status=DISABLED)
+    return lambda: operator.is_active('disabled')
+
+
+@benchmark(number=2000)
+def is_active_selective_ip():
+    condition_set = IPAddressConditionSet()
+    operator = setup_manager(condition_sets=[condition_set])
+    value = {'ip': {
+        'ip_address': [[INCLUDE, '192.168.0.%d' % i] for i in xrange(20)],
+        'ip_network': [[INCLUDE, '172.16.%d.0/24' % i] for i in xrange(20)],
+        'percent': [[INCLUDE, '0-10']],
+    }}
+    Switch.create(key='ip', status=SELECTIVE, value=value)
+    request = Request(remote_addr='10.0.0.1')
+    return lambda: operator.is_active('ip', request)
+
+
+@benchmark(number=2000)
+def is_active_nested():
+    operator = setup_manager()
+    keys = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']
+    for i in xrange(1, len(keys) + 1):
+        key = ':'.join(keys[:i])
+        Switch.create(key=key, status=GLOBAL if i == 1 else INHERIT)
+    key = ':'.join(keys)
+    return lambda: operator.is_active(key)
+
+
+@benchmark(number=1000)
+def is_active_many_namespaces():
+    condition_sets = [make_condition_set('ns%d' % i) for i in xrange(30)]
+    operator = setup_manager(condition_sets=condition_sets)
+    value = dict((condition_set.get_namespace(),
+                  {'name': [[INCLUDE, 'value-%d' % i] for i in xrange(5)]})
+                 for condition_set in condition_sets)
+    Switch.create(key='namespaces', status=SELECTIVE, value=value)
+    request = Request(query_string='nothing')
+    return lambda: operator.is_active('namespaces', request)
+
+
+@benchmark(number=1000)
+def is_active_querystring_regex():
+    condition_set = QueryStringConditionSet()
+    operator = setup_manager(condition_sets=[condition_set])
+    value = {'querystring': {
+        'regex': [[INCLUDE, r'(^|&)param%d=[a-z]+\d*($|&)' % i]
+                  for i in xrange(50)],
+    }}
+    Switch.create(key='regex', status=SELECTIVE, value=value)
+    request = Request(query_string='page=2&sort=name&q=switchboard')
+    return lambda: operator.is_active('regex', request)
+
+
+@benchmark(number=200)
+def active_switches_200():
+    condition_set = IPAddressConditionSet()
+    operator = setup_manager(condition_sets=[condition_set])
+    value = {'ip': {'ip_address': [[INCLUDE, '192.168.0.1']]}}
+    create_switches(200, status=SELECTIVE, value=value)
+    request = Request(remote_addr='192.168.0.1')
+    return lambda: operator.active_switches(request)
+
+
+@benchmark(number=20)
+def model_all_dict_1000():
+    setup_manager()
+    create_switches(1000, status=GLOBAL)
+    return Switch.all
+
+
+@benchmark(number=20)
+def model_all_redis_pickle_1000():
+    setup_manager(FakeRedisDatastore(FakeRedis(), pickle))
+    create_switches(1000, status=GLOBAL)
+    return Switch.all
+
+
+@benchmark(number=20)
+def model_all_redis_serializer_1000():
+    setup_manager(FakeRedisDatastore(FakeRedis(), serializer))
+    create_switches(1000, status=GLOBAL)
+    return Switch.all
+
+
+def measure(func, number, repeat=REPEAT):
+    '''
+    Returns the best time of ``repeat`` runs per call of ``func``, in
+    seconds.
+    '''
+    timer = timeit.default_timer
+    best = None
+    # Like timeit, keep garbage collection from adding noise.
+    gc.disable()
+    try:
+        for _ in xrange(repeat):
+            start = timer()
+            for _ in xrange(number):
+                func()
+            elapsed = (timer() - start) / number
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        gc.enable()
+    return best
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(path, results):
+    with open(path, 'w') as f:
+        # Without separators, Python 2 leaves a space at the end of lines.
+        json.dump(results, f, indent=2, sort_keys=True,
+                  separators=(',', ': '))
+        f.write('\n')
+
+
+def run(names, baselines, threshold):
+    '''
+    Runs the benchmarks in ``names``, printing each result next to its
+    baseline. Returns the results, in microseconds per call, and the names of
+    those slower than their baseline by more than ``threshold``.
+    '''
+    original_ds = Switch.ds
+    results = OrderedDict()
+    regressions = []
+    print '%-36s %12s %12s %8s' % ('benchmark', 'usec/call', 'baseline',
+                                   'change')
+    try:
+        for name in names:
+            setup, number = benchmarks[name]
+            usec = measure(setup(), number) * 1000000
+            results[name] = round(usec, 3)
+            baseline = baselines.get(name)
+            if baseline:
+                change = (usec - baseline) / baseline
+                row = (name, usec, '%.3f' % baseline,
+                       '%+.1f%%' % (change * 100))
+                if change > threshold:
+                    regressions.append(name)
+            else:
+                row = (name, usec, '-', '')
+            print '%-36s %12.3f %12s %8s' % row
+    finally:
+        Switch.ds = original_ds
+    return results, regressions
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] [name ...]')
+    parser.add_option('--save', action='store_true',
+                      help='store the results as the new baselines')
+    parser.add_option('--baseline', default=BASELINE_PATH,
+                      help='baselines file [default: %default]')
+    parser.add_option('--threshold', type='float', default=THRESHOLD,
+                      help='allowed slowdown, as a fraction '
+                           '[default: %default]')
+    options, args = parser.parse_args(argv)
+    names = [name for name in benchmarks
+             if not args or any(arg in name for arg in args)]
+    baselines = load_baselines(options.baseline)
+    results, regressions = run(names, baselines, options.threshold)
+    if options.save:
+        baselines.update(results)
+        save_baselines(options.baseline, baselines)
+        print 'Saved baselines to %s' % options.baseline
+    elif regressions:
+        print 'Slower than baseline: %s' % ', '.join(regressions)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,18 @@
-import pickle
-
 from bottle import Bottle, redirect, run
 import datastore.core
 
-from switchboard import operator, configure
+from switchboard import operator, configure, serializer
 from switchboard.middleware import SwitchboardMiddleware
 from switchboard.admin import app as switchboard
 
 
-# Setup a file-based datastore with pickle serialization.
+# Setup a file-based datastore with Switchboard's serialization.
 import datastore.filesystem
 import os
 base_path = os.path.dirname(os.path.realpath(__file__))
 ds_file = os.path.join(base_path, '.switches')
 ds_child = datastore.filesystem.FileSystemDatastore(ds_file)
-ds = datastore.serialize.shim(ds_child, pickle)
+ds = datastore.serialize.shim(ds_child, serializer)
 
 # Configure Switchboard.
 configure(datastore=ds)
@@ -6,15 +6,25 @@ switchboard.admin
 :license: Apache License 2.0, see LICENSE for more details.
 """
 
+import copy
 from datetime import datetime
 import logging
-from operator import attrgetter
-
-from bottle import Bottle, request, mako_view as view
+import zlib
+
+from bottle import (
+    Bottle,
+    HTTPError,
+    HTTPResponse,
+    request,
+    response,
+    mako_view as view,
+)
 import datastore.core
 from webob.exc import HTTPNotFound
 
 from .. import operator, signals
+from ..conditions import Invalid
+from ..index import SortIndex
 from ..models import Switch
 from .utils import (
     json_api,
@@ -24,6 +34,9 @@ from .utils import (
 from ..settings import settings
 
 log = logging.getLogger(__name__)
+# How many switches the index page lists at once.
+PAGE_SIZE = 50
+sort_index = SortIndex(Switch, ('label', 'date_created', 'date_modified'))
 
 
 app = Bottle()
@@ -34,7 +47,40 @@ dir_name = os.path.dirname(os.path.realpath(__file__))
 bottle.TEMPLATE_PATH.append(dir_name)
 
 
+def listing_etag():
+    '''
+    Returns the ETag of the views listing switches, which only change when
+    the stored switches or the registered condition sets do. Unlike hash(),
+    crc32 gives the same digest in every process serving the admin.
+    '''
+    version = Switch.get_version() or 0
+    condition_sets = ','.join(e.id for e in operator.get_catalog())
+    return '"%s-%08x"' % (version, zlib.crc32(condition_sets) & 0xffffffff)
+
+
+def conditional(func):
+    '''
+    Decorator for the views listing switches: sets their ETag and, when the
+    client already has the current listing, responds with a 304 rather than
+    reading and rendering the switches.
+    '''
+    def wrapper(*args, **kwargs):
+        etag = listing_etag()
+        if_none_match = request.headers.get('If-None-Match', '')
+        tags = [t.strip() for t in if_none_match.split(',')]
+        if '*' in tags or etag in tags or 'W/' + etag in tags:
+            raise HTTPResponse(status=304, headers={'ETag': etag})
+        result = func(*args, **kwargs)
+        if isinstance(result, HTTPResponse):
+            result.set_header('ETag', etag)
+        else:
+            response.set_header('ETag', etag)
+        return result
+    return wrapper
+
+
 @app.get('/')
+@conditional
 @view('index')
 def index():
     by = request.query.by or '-date_modified'
@@ -44,8 +90,22 @@ def index():
     reverse = by.find('-') is 0
     sort_by = by.lstrip('-')
 
-    switches = Switch.all()
-    switches.sort(key=attrgetter(sort_by), reverse=reverse)
+    try:
+        page = int(request.query.page or 1)
+    except ValueError:
+        raise HTTPNotFound('Invalid page.')
+    if page < 1:
+        raise HTTPNotFound('Invalid page.')
+
+    keys, total = sort_index.page(sort_by, reverse=reverse,
+                                  offset=(page - 1) * PAGE_SIZE,
+                                  limit=PAGE_SIZE)
+    pages = max((total + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+    if page > pages:
+        raise HTTPNotFound('Invalid page.')
+    found = Switch.get_many(keys)
+    # Switches removed since the index was read are left out.
+    switches = [found[key] for key in keys if key in found]
 
     messages = []
     if isinstance(Switch.ds, datastore.DictDatastore):
@@ -58,11 +118,24 @@ def index():
         switches=[s.to_dict(operator) for s in switches],
         all_conditions=list(operator.get_all_conditions()),
         sorted_by=by,
+        page=page,
+        pages=pages,
         messages=messages,
         settings=settings,
     )
 
 
+@app.get('/switches')
+@conditional
+@json_api
+def switches():
+    '''
+    Lists all switches, sorted by key, as JSON.
+    '''
+    switches = sorted(Switch.iterall(), key=lambda s: s.key)
+    return [s.to_dict(operator) for s in switches]
+
+
 @app.post('/add')
 @json_api
 def add():
@@ -70,16 +143,7 @@ def add():
     label = request.forms.get('label', '')
     description = request.forms.get('description')
 
-    if not key:
-        raise SwitchboardException("Key cannot be empty")
-
-    if len(key) > 32:
-        raise SwitchboardException("Key must be less than or equal to 32"
-                                   + " characters in length")
-
-    if len(label) > 32:
-        raise SwitchboardException("Name must be less than or equal to 32"
-                                   + " characters in length")
+    validate_switch(key, label)
 
     if Switch.get(key):
         raise SwitchboardException("Switch with key %s already exists"
@@ -232,3 +296,215 @@ def remove_condition():
     signals.switch_condition_removed.send(switch)
 
     return switch.to_dict(operator)
+
+
+# The signal sent for each kind of batch operation; see batch.
+BATCH_SIGNALS = (
+    ('add', signals.switch_added),
+    ('update', signals.switch_updated),
+    ('status', signals.switch_status_updated),
+    ('add_condition', signals.switch_condition_added),
+    ('remove_condition', signals.switch_condition_removed),
+)
+
+
+@app.post('/batch')
+@json_api
+def batch():
+    """
+    Applies a list of operations, sent as a JSON body, all at once. Each
+    operation is a dictionary with an ``op`` and the same parameters as the
+    endpoint of the same name takes, e.g.::
+
+        [{"op": "add", "key": "foo", "label": "Foo"},
+         {"op": "status", "key": "foo", "status": 3},
+         {"op": "add_condition", "key": "foo",
+          "id": "switchboard.builtins.IPAddressConditionSet",
+          "field": "ip_address", "ip_address": "10.0.0.1"},
+         {"op": "remove_condition", "key": "bar",
+          "id": "switchboard.builtins.IPAddressConditionSet",
+          "field": "ip_address", "value": "10.0.0.2"},
+         {"op": "update", "curkey": "bar", "key": "baz", "label": "Baz"},
+         {"op": "delete", "key": "qux"}]
+
+    Nothing is saved unless every operation is valid. The switches changed
+    are saved together, those deleted or renamed are then removed together,
+    and each signal is sent once per switch. Returns the keys and statuses of
+    the switches saved.
+    """
+    try:
+        operations = request.json
+    except (ValueError, HTTPError):
+        # Depending on its version, bottle raises either on invalid JSON.
+        raise SwitchboardException("Operations must be valid JSON")
+    if not isinstance(operations, list):
+        raise SwitchboardException("Operations must be a JSON list")
+    for i, operation in enumerate(operations):
+        if not isinstance(operation, dict) or not operation.get('key'):
+            raise SwitchboardException("Operation %d: Key cannot be empty"
+                                       % i)
+        for name in ('key', 'curkey', 'label'):
+            if not isinstance(operation.get(name) or '', basestring):
+                raise SwitchboardException("Operation %d: %s must be a string"
+                                           % (i, name.capitalize()))
+
+    keys = set(op['key'] for op in operations)
+    keys.update(op['curkey'] for op in operations if op.get('curkey'))
+    switches = Switch.get_many(keys)
+    for switch in switches.itervalues():
+        # Some datastores hand out the stored conditions themselves, which
+        # the operations below would change in place.
+        switch.value = copy.deepcopy(switch.value)
+    stored = set(switches)
+    now = datetime.utcnow()
+    # The switches changed, in order, along with the kinds of changes.
+    changed = []
+    kinds = {}
+    for i, operation in enumerate(operations):
+        try:
+            kind, switch = apply_operation(operation, switches, now)
+        except (SwitchboardException, Invalid), e:
+            raise SwitchboardException("Operation %d: %s" % (i, e.message))
+        if kind is not None:
+            if id(switch) not in kinds:
+                changed.append(switch)
+                kinds[id(switch)] = set()
+            kinds[id(switch)].add(kind)
+
+    saved = [switch for switch in changed
+             if switches.get(switch.key) is switch]
+    Switch.save_many(saved)
+    Switch.remove_many(key for key in stored if key not in switches)
+    for switch in changed:
+        switch_kinds = kinds[id(switch)]
+        if switches.get(switch.key) is not switch:
+            # Switches added and deleted within the batch never existed.
+            if 'add' not in switch_kinds:
+                log.info('Switch %r removed in batch', switch.key)
+                signals.switch_deleted.send(switch)
+            continue
+        log.info('Switch %r updated in batch (%s)', switch.key,
+                 ', '.join(sorted(switch_kinds)))
+        for kind, signal in BATCH_SIGNALS:
+            if kind in switch_kinds:
+                signal.send(switch)
+    return [dict(key=switch.key, status=switch.status) for switch in saved]
+
+
+def apply_operation(operation, switches, now):
+    """
+    Applies a batch operation to the switches in ``switches`` by key, without
+    saving anything; switches deleted or renamed are taken out of
+    ``switches``. Returns the kind of change made, or ``None``, and the
+    switch.
+    """
+    kind = operation.get('op')
+    key = operation['key']
+    switch = switches.get(key)
+    if kind == 'add':
+        label = operation.get('label') or ''
+        validate_switch(key, label)
+        if switch is not None:
+            raise SwitchboardException("Switch with key %s already exists"
+                                       % key)
+        switch = switches[key] = Switch(
+            key=key, label=label or None,
+            description=operation.get('description'))
+        return kind, switch
+    curkey = key
+    if kind == 'update':
+        curkey = operation.get('curkey') or key
+        switch = switches.get(curkey)
+    elif kind not in ('delete', 'status', 'add_condition',
+                      'remove_condition'):
+        raise SwitchboardException("Unknown operation: %s" % kind)
+    if switch is None:
+        raise SwitchboardException("Switch with key %s does not exist"
+                                   % curkey)
+
+    if kind == 'delete':
+        del switches[key]
+        return kind, switch
+    elif kind == 'update':
+        label = operation.get('label') or ''
+        validate_switch(key, label)
+        description = operation.get('description')
+        if (switch.key, switch.label or '', switch.description) == (
+                key, label, description):
+            return None, switch
+        if key != curkey:
+            if key in switches:
+                raise SwitchboardException("Switch with key %s already "
+                                           "exists" % key)
+            del switches[curkey]
+            switch.key = key
+            switches[key] = switch
+        switch.label = label
+        switch.description = description
+    elif kind == 'status':
+        try:
+            status = int(operation.get('status'))
+        except (TypeError, ValueError):
+            raise SwitchboardException("Status must be integer")
+        if status not in Switch.STATUS_CHOICES:
+            raise SwitchboardException("Unknown status: %s" % status)
+        if switch.status == status:
+            return None, switch
+        switch.status = status
+    else:
+        condition_set_id = operation.get('id')
+        field_name = operation.get('field')
+        try:
+            condition_set = operator.get_condition_set_by_id(condition_set_id)
+            field = condition_set.fields[field_name]
+        except (KeyError, TypeError):
+            raise SwitchboardException("Unknown condition: %s %s"
+                                       % (condition_set_id, field_name))
+        if kind == 'add_condition':
+            value = field.validate(field_params(operation, field_name))
+            if not value:
+                raise SwitchboardException("Fields cannot be empty")
+            try:
+                exclude = int(operation.get('exclude') or 0)
+            except (TypeError, ValueError):
+                raise SwitchboardException("Exclude must be integer")
+            switch.add_condition(operator, condition_set_id, field_name,
+                                 value, exclude=exclude, commit=False)
+        else:
+            value = operation.get('value')
+            if not value:
+                raise SwitchboardException("Fields cannot be empty")
+            switch.remove_condition(operator, condition_set_id, field_name,
+                                    value, commit=False)
+    switch.date_modified = now
+    return kind, switch
+
+
+def field_params(operation, field_name):
+    """
+    Returns the parameters of a batch operation for the field ``field_name``,
+    e.g. ``percent[min]``, as strings, the way the form would have sent them.
+    """
+    params = {}
+    for name, value in operation.iteritems():
+        if not name.startswith(field_name) or value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(
+                value, (basestring, int, long, float)):
+            raise SwitchboardException("%s must be a string or a number"
+                                       % name)
+        params[name] = value if isinstance(value, basestring) else str(value)
+    return params
+
+
+def validate_switch(key, label):
+    if not key:
+        raise SwitchboardException("Key cannot be empty")
+
+    if len(key) > 32:
+        raise SwitchboardException("Key must be less than or equal to 32"
+                                   + " characters in length")
+
+    if len(label) > 32:
+        raise SwitchboardException("Name must be less than or equal to 32"
+                                   + " characters in length")
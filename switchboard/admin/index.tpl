@@ -188,6 +188,7 @@
       .switchboard .switches .actions { visibility: hidden; }
       .switchboard .switches .switch:hover .actions { visibility: visible; margin: 0 0 0 1em; }
       .switchboard .switches .actions .btn-link { padding: 0; border: 0; margin-left: 0.5em; }
+      .switchboard .pagination { text-align: center; margin-bottom: 1.65rem; }
       /* drawer */
       .switchboard .drawer { display: none; margin-bottom: 1em; position: absolute; background-color: #efefef; z-index: 1; opacity: 0.9; padding: 1rem; left: 20%; width: 60%; border: 1px solid #ccc; border-bottom-left-radius: 4px; border-bottom-right-radius: 4px; }
       .switchboard .drawer.header { position: fixed; z-index: 2; }
@@ -329,6 +330,18 @@
           % endfor
         </div>
 
+        % if pages > 1:
+        <div class="pagination micro">
+          % if page > 1:
+          <a href="?by=${sorted_by}&amp;page=${page - 1}">&laquo; Previous</a>
+          % endif
+          Page ${page} of ${pages}
+          % if page < pages:
+          <a href="?by=${sorted_by}&amp;page=${page + 1}">Next &raquo;</a>
+          % endif
+        </div>
+        % endif
+
         <div class="drawer"></div>
 
         <div class="no-switches" style="${'display: none' if switches else ''}">
@@ -6,7 +6,12 @@ switchboard.admin.utils
 :license: Apache License 2.0, see LICENSE for more details.
 """
 
-import json
+try:
+    import simplejson as json
+except ImportError:  # pragma: nocover
+    import json
+
+from bottle import HTTPResponse
 
 from switchboard.conditions import Invalid
 from switchboard.settings import settings
@@ -16,6 +21,24 @@ class SwitchboardException(Exception):  # pragma: nocover
     pass
 
 
+def json_default(obj):
+    '''
+    Encodes values that JSON has no type for, like datetime or ObjectId.
+    '''
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    else:
+        return str(obj)
+
+
+def json_response(data):
+    '''
+    Returns a response with ``data`` encoded as JSON, in a single pass.
+    '''
+    body = json.dumps(data, default=json_default, separators=(',', ':'))
+    return HTTPResponse(body, headers={'Content-Type': 'application/json'})
+
+
 def json_api(func):
     def wrapper(*args, **kwargs):
         "Decorator to make JSON views simpler"
@@ -44,15 +67,7 @@ def json_api(func):
                 import traceback
                 traceback.print_exc()
             raise
-
-        # Sanitize any non-JSON-safe fields like datetime or ObjectId.
-        def handler(obj):
-            if hasattr(obj, 'isoformat'):
-                return obj.isoformat()
-            else:
-                return str(obj)
-        santized_response = json.loads(json.dumps(response, default=handler))
-        return santized_response
+        return json_response(response)
     return wrapper
 
 
@@ -6,10 +6,8 @@ switchboard.base
 :license: Apache License 2.0, see LICENSE for more details.
 """
 
-import threading
 
-
-class ModelDict(threading.local):
+class ModelDict(object):
     """
     Dictionary-style access to :func:`~switchboard.model.Model` data.
 
@@ -32,8 +30,7 @@ class ModelDict(threading.local):
         mydict['1234567890']
         >>> Model({ 'key': '000-abc', 'name': 'Jim', 'phone': '1234567890' }) #doctest: +SKIP
 
-    The ModelDict needs to be thread local so that information is not shared
-    across threads, e.g., requests.
+    A ModelDict holds no per-thread state and may be shared by all threads.
     """
     def __init__(self, model, key='key', auto_create=False, *args, **kwargs):
         self._key = key
@@ -70,16 +67,16 @@ class ModelDict(threading.local):
         return "<%s>" % (self.__class__.__name__)
 
     def iteritems(self):
-        def make_item(model):
-            return (getattr(model, self._key), model)
-        items = [make_item(model) for model in self._model.all()]
-        return iter(items)
+        return ((getattr(model, self._key), model)
+                for model in self._model.iterall())
 
     def itervalues(self):
-        return iter(self._model.all())
+        return self._model.iterall()
 
     def iterkeys(self):
-        return iter([getattr(model, self._key) for model in self._model.all()])
+        if self._key == 'key':
+            return self._model.iterkeys()
+        return (getattr(model, self._key) for model in self._model.iterall())
 
     def keys(self):  # pragma: nocover
         return list(self.iterkeys())
@@ -5,12 +5,16 @@ switchboard.builtins
 :copyright: (c) 2015 Kyle Adams.
 :license: Apache License 2.0, see LICENSE for more details.
 """
+import logging
 import socket
 
+import ipaddress
+
 from . import operator
 from .conditions import (
     RequestConditionSet,
     Percent,
+    HashedPercent,
     String,
     Boolean,
     Regex,
@@ -19,25 +23,139 @@ from .conditions import (
 )
 from .settings import settings
 
+log = logging.getLogger(__name__)
+
+
+def ip_network(value):
+    '''
+    Returns the IPv4 or IPv6 network for a CIDR string such as
+    ``'10.0.0.0/8'``; a plain address is a network of its own. Raises
+    ValueError if ``value`` is neither.
+    '''
+    # The third-party ipaddress lib (not the builtin Python 3 library)
+    # requires a unicode string.
+    return ipaddress.ip_network(unicode(value).strip(), strict=False)
+
+
+class PrefixTrie(object):
+    '''
+    A binary trie of IPv4 and IPv6 networks. Checking whether an address is
+    in any of the networks takes at most one step per bit of the address,
+    however many networks there are.
+
+        trie = PrefixTrie(['10.0.0.0/8', '2001:db8::/32'])
+        '10.1.2.3' in trie
+        >>> True #doctest: +SKIP
+    '''
+    def __init__(self, networks=()):
+        # A node is a [zero, one] list of children; True in place of a node
+        # marks the end of a network, which covers everything below it.
+        self._roots = {4: None, 6: None}
+        for network in networks:
+            self.add(network)
+
+    def add(self, network):
+        network = ip_network(network)
+        bits = int(network.network_address)
+        width = network.max_prefixlen
+        parent, index = self._roots, network.version
+        for i in xrange(network.prefixlen):
+            node = parent[index]
+            if node is True:
+                # Already covered by a wider network.
+                return
+            if node is None:
+                node = parent[index] = [None, None]
+            parent, index = node, (bits >> (width - 1 - i)) & 1
+        parent[index] = True
+
+    def __contains__(self, address):
+        try:
+            address = ipaddress.ip_address(unicode(address))
+        except ValueError:
+            return False
+        bits = int(address)
+        i = address.max_prefixlen - 1
+        node = self._roots[address.version]
+        while node is not None:
+            if node is True:
+                return True
+            node = node[(bits >> i) & 1]
+            i -= 1
+        return False
+
+
+# The SWITCHBOARD_INTERNAL_IPS setting last seen by internal_ips, and the trie
+# built from it.
+_internal_ips = (None, None)
+
+
+def internal_ips():
+    '''
+    Returns a :class:`PrefixTrie` of the SWITCHBOARD_INTERNAL_IPS setting,
+    which is a list of addresses and networks or a comma-separated string of
+    them. The trie is rebuilt only when the setting is replaced.
+    '''
+    global _internal_ips
+    value = getattr(settings, 'SWITCHBOARD_INTERNAL_IPS', ())
+    setting, trie = _internal_ips
+    if setting is not value:
+        networks = value.split(',') if isinstance(value, basestring) else value
+        trie = PrefixTrie()
+        for network in networks:
+            try:
+                trie.add(network)
+            except ValueError:
+                log.warning('Ignoring invalid internal IP "%s"', network)
+        _internal_ips = (value, trie)
+    return trie
+
 
 class IPAddress(String):
     def clean(self, value):
-        # Attempt to validate if the proper library is present.
         try:
-            import ipaddress
             # The third-party ipaddress lib (not the builtin Python 3 library)
             # requires a unicode string.
             ipaddress.ip_address(unicode(value))
-        except ImportError:  # pragma: nocover
-            pass
         except ValueError:
             raise Invalid
         return value
 
 
+class IPNetwork(String):
+    '''
+    Implements an IP network field, where the actual address must fall within
+    the network, given in CIDR notation (e.g. ``10.0.0.0/8``).
+    '''
+    default_help_text = 'Enter a network, e.g. 10.0.0.0/8 or 2001:db8::/32.'
+
+    def is_active(self, value, actual_value):
+        return actual_value in PrefixTrie([value])
+
+    def compile(self, value):
+        return self.compile_many([value])[0]
+
+    def compile_many(self, values, key=None):
+        '''
+        Puts all the networks into a single :class:`PrefixTrie`.
+        '''
+        if not values:
+            return []
+        trie = PrefixTrie(values)
+        return [trie.__contains__]
+
+    def clean(self, value):
+        try:
+            return str(ip_network(value))
+        except ValueError:
+            raise Invalid('You must enter a valid IP network.')
+
+
 class IPAddressConditionSet(RequestConditionSet):
     percent = Percent()
+    hashed_percent = HashedPercent(label='Hashed Percent')
     ip_address = IPAddress(label='IP Address')
+    ip_network = IPNetwork(label='IP Network')
     internal_ip = Boolean(label='Internal IPs')
 
     def get_namespace(self):
@@ -48,10 +166,10 @@ class IPAddressConditionSet(RequestConditionSet):
         # Ensure we map ``percent`` to the ``id`` column
         if field_name == 'percent':
             return sum([int(x) for x in instance.remote_addr.split('.')])
-        elif field_name == 'ip_address':
+        elif field_name in ('hashed_percent', 'ip_address', 'ip_network'):
             return instance.remote_addr
         elif field_name == 'internal_ip':
-            return instance.remote_addr in settings.SWITCHBOARD_INTERNAL_IPS
+            return instance.remote_addr in internal_ips()
         return super(IPAddressConditionSet, self).get_field_value(instance,
                                                                   field_name)
 
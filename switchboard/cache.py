@@ -0,0 +1,160 @@
+"""
+switchboard.cache
+~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2015 Kyle Adams.
+:license: Apache License 2.0, see LICENSE for more details.
+"""
+
+import logging
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+# The most results a ResultCache keeps by default.
+RESULT_CACHE_SIZE = 1000
+# The least max_age a Snapshot defaults to, so that short timeouts don't have
+# it read everything on (nearly) every lookup.
+MIN_MAX_AGE = 60
+
+
+class Snapshot(object):
+    '''
+    A process-local, read-through copy of every record of a
+    :class:`~switchboard.models.Model`.
+
+    Lookups are served from memory. At most once every ``timeout`` seconds the
+    datastore's version (see :meth:`~switchboard.models.Model.get_version`) is
+    read, and the copy is refreshed only if that version changed; ``timeout``
+    therefore bounds how stale a lookup can be. Once installed as the model's
+    ``snapshot``, saves and removals made by this process expire the copy right
+    away, as do those published by other processes on the model's ``feed``.
+
+    Only the records listed in the change log since the copy's version (see
+    :meth:`~switchboard.models.Model.get_changes`) are read again, unless the
+    log doesn't cover all of the versions since. Everything is read again
+    anyway once ``max_age`` seconds have passed since it last was, whether or
+    not the version changed, which bounds how long a change the log missed
+    can go unseen; it defaults to twice ``timeout``, but at least
+    MIN_MAX_AGE.
+
+        snapshot = Snapshot(Switch, timeout=5)
+        snapshot.get('my_switch')
+        >>> Switch({ 'key': 'my_switch', ... }) #doctest: +SKIP
+
+    The records handed out are shared and read-only; they are of the model's
+    ``frozen_class``, if it has one.
+    '''
+    def __init__(self, model, timeout, max_age=None):
+        self.model = model
+        self.timeout = timeout
+        if max_age is None:
+            max_age = max(2 * timeout, MIN_MAX_AGE)
+        self.max_age = max_age
+        # A (version, {key: record}) tuple; it is only ever replaced, never
+        # updated in place, so readers always see a consistent copy.
+        self._state = None
+        self._checked = 0
+        self._loaded = 0
+
+    def __repr__(self):  # pragma: nocover
+        return '<%s: %s>' % (self.__class__.__name__, self.model.__name__)
+
+    def expire(self):
+        '''
+        Forces the next lookup to check the datastore's version.
+        '''
+        self._checked = 0
+
+    def get(self, key, default=None):
+        return self.records().get(key, default)
+
+    def __contains__(self, key):
+        return key in self.records()
+
+    def records(self):
+        '''
+        Returns a dictionary of all records by key, reloading it first if it
+        may be stale and either the datastore's version changed or it is older
+        than ``max_age``.
+        '''
+        state = self._state
+        now = time.time()
+        if state is None or now - self._checked >= self.timeout:
+            self._checked = now
+            version = self.model.get_version()
+            if now - self._loaded >= self.max_age:
+                state = self._state = self._reload(version, now)
+            elif state is None or state[0] != version:
+                state = self._state = self._refresh(state, version, now)
+        return state[1]
+
+    def _refresh(self, state, version, now):
+        if state is not None:
+            keys = self.model.get_changes(state[0], version)
+            if keys is not None:
+                log.debug('Updating %r to version %s: %s', self, version,
+                          sorted(keys))
+                records = dict(state[1])
+                changed = self.model.get_many(list(keys), frozen=True)
+                for key in keys:
+                    if key in changed:
+                        records[key] = changed[key]
+                    else:
+                        records.pop(key, None)
+                return (version, records)
+        return self._reload(version, now)
+
+    def _reload(self, version, now):
+        log.debug('Reloading %r at version %s', self, version)
+        self._loaded = now
+        records = self.model.iterall(frozen=True)
+        return (version, dict((m.key, m) for m in records))
+
+
+class ResultCache(object):
+    '''
+    A dictionary-like store of ``is_active`` results, bounded to ``size``
+    entries by evicting the least recently used one. Hits and misses of
+    ``get`` are counted, which helps with sizing it.
+
+        operator.result_cache = ResultCache(size=100)
+    '''
+    def __init__(self, size=RESULT_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def __repr__(self):  # pragma: nocover
+        return '<%s: %s/%s, %s hits, %s misses>' % (
+            self.__class__.__name__, len(self), self.size, self.hits,
+            self.misses)
+
+    def __len__(self):
+        return len(self._results)
+
+    def __contains__(self, key):
+        return key in self._results
+
+    def get(self, key, default=None):
+        results = self._results
+        try:
+            value = results.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        # Move it to the most recently used end.
+        results[key] = value
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        results = self._results
+        results.pop(key, None)
+        results[key] = value
+        if len(results) > self.size:
+            results.popitem(last=False)
+
+    def clear(self):
+        self._results.clear()
@@ -8,12 +8,23 @@ switchboard.conditions
 
 # Credit to Haystack for abstraction concepts
 
+import copy
 import datetime
+from functools import partial
 import itertools
 import re
 
+import smhasher
+
 from .models import EXCLUDE
 
+# The most regular expressions kept by compile_regex.
+REGEX_CACHE_SIZE = 1000
+_regex_cache = {}
+# Constructs that make a regular expression depend on its own group numbers or
+# flags, so that it can't be combined with others into a single alternation.
+_UNCOMBINABLE = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?\(|\(\?[iLmsux]')
+
 
 class Invalid(Exception):  # pragma: nocover
     pass
@@ -23,6 +34,21 @@ def titlize(s):
     return s.title().replace('_', ' ')
 
 
+def compile_regex(pattern):
+    '''
+    Returns ``pattern`` compiled. Compiled patterns are kept in a cache of
+    their own, since the one of the ``re`` module is small and shared with the
+    rest of the process; when full, the cache is simply emptied.
+    '''
+    try:
+        return _regex_cache[pattern]
+    except KeyError:
+        if len(_regex_cache) >= REGEX_CACHE_SIZE:
+            _regex_cache.clear()
+        regex = _regex_cache[pattern] = re.compile(pattern)
+        return regex
+
+
 class Field(object):
     '''
     Field represents a user input on a parent :class:`ConditionSet`. The user
@@ -40,6 +66,8 @@ class Field(object):
     input types.
     '''
     default_help_text = None
+    # Whether is_active takes the key of the switch as a third argument.
+    uses_key = False
 
     def __init__(self, label=None, help_text=None):
         self.label = label
@@ -54,6 +82,24 @@ class Field(object):
     def is_active(self, value, actual_value):
         return value == actual_value
 
+    def compile(self, value):
+        '''
+        Returns a predicate that takes the actual value and answers the same
+        question as ``is_active(value, actual_value)``. Fields that need to
+        parse ``value`` should do it here, so the work happens once per switch
+        rather than on every check.
+        '''
+        return partial(self.is_active, value)
+
+    def compile_many(self, values, key=None):
+        '''
+        Returns a list of predicates that, between them, are active whenever
+        any of ``values`` is, like ``compile`` does for a single value. Fields
+        able to check several values at once may return fewer predicates than
+        values. ``key`` is the key of the switch the values belong to.
+        '''
+        return [self.compile(value) for value in values]
+
     def validate(self, data):
         value = data.get(self.name)
         if value:
@@ -154,9 +200,15 @@ class Percent(Range):
     default_help_text = 'Enter two ranges, e.g. 0-50 is lower 50%.'
 
     def is_active(self, value, actual_value):
-        value = map(int, value.split('-'))
-        mod = actual_value % 100
-        return super(Percent, self).is_active(value, mod)
+        return self.compile(value)(actual_value)
+
+    def compile(self, value):
+        low, high = map(int, value.split('-'))
+
+        def is_active(actual_value):
+            mod = actual_value % 100
+            return mod >= low and mod <= high
+        return is_active
 
     def display(self, value):
         value = value.split('-')
@@ -176,6 +228,48 @@ class Percent(Range):
         return value
 
 
+def hashed_percentile(identifier, salt=''):
+    '''
+    Returns the percentile, from 0 to 99, that ``identifier`` (of any type)
+    hashes to once prefixed with ``salt``.
+    '''
+    if isinstance(identifier, unicode):
+        identifier = identifier.encode('utf-8')
+    elif not isinstance(identifier, str):
+        identifier = str(identifier)
+    return smhasher.murmur3_x86_64(salt + identifier) % 100
+
+
+class HashedPercent(Percent):
+    '''
+    Implements a percentage field which, rather than modding the actual value
+    against 100, hashes it along with the key of the switch (see
+    :func:`hashed_percentile`). Identifiers of any type are thus spread evenly
+    across percentiles, and land in unrelated percentiles for each switch.
+    Without a key, identifiers are hashed on their own.
+    '''
+    uses_key = True
+
+    def is_active(self, value, actual_value, key=None):
+        return self.compile(value, key)(actual_value)
+
+    def compile(self, value, key=None):
+        low, high = map(int, value.split('-'))
+        salt = '%s:' % key if key else ''
+        if isinstance(salt, unicode):
+            salt = salt.encode('utf-8')
+
+        def is_active(actual_value):
+            if actual_value is None:
+                return False
+            percentile = hashed_percentile(actual_value, salt)
+            return percentile >= low and percentile <= high
+        return is_active
+
+    def compile_many(self, values, key=None):
+        return [self.compile(value, key) for value in values]
+
+
 class String(Field):  # pragma: nocover
     '''
     Implements a plain string field. Essentially an alias for :class:`Field`,
@@ -191,7 +285,40 @@ class Regex(String):
     flexible than the :class:`String` field's equality comparison.
     '''
     def is_active(self, value, actual_value):
-        return bool(re.search(value, actual_value))
+        return bool(compile_regex(value).search(actual_value))
+
+    def compile(self, value):
+        search = compile_regex(value).search
+
+        def is_active(actual_value):
+            return bool(search(actual_value))
+        return is_active
+
+    def compile_many(self, values, key=None):
+        '''
+        Combines the regular expressions into a single alternation, so that
+        the actual value is scanned once, except for those that rely on group
+        numbers, group names or flags.
+        '''
+        combinable = [v for v in values if not _UNCOMBINABLE.search(v)]
+        predicates = [self.compile(v) for v in values if v not in combinable]
+        if len(combinable) > 1:
+            pattern = '|'.join('(?:%s)' % v for v in combinable)
+            try:
+                predicates.append(self.compile(pattern))
+            # The re module raises AssertionError past 100 groups.
+            except (re.error, AssertionError):
+                predicates.extend(self.compile(v) for v in combinable)
+        else:
+            predicates.extend(self.compile(v) for v in combinable)
+        return predicates
+
+    def clean(self, value):
+        try:
+            compile_regex(value)
+        except re.error as e:
+            raise Invalid('Invalid regular expression: %s' % e)
+        return value
 
     def render(self, value):
         html = ('/<input type="text" value="%s" name="%s" '
@@ -232,14 +359,19 @@ class AbstractDate(Field):
         return '<input type="text" value="%s" name="%s"/>' % (value, self.name)
 
     def is_active(self, value, actual_value):
-        assert isinstance(actual_value, datetime.date)
-        if isinstance(actual_value, datetime.datetime):
-            # datetime.datetime cannot be compared to datetime.date with > and
-            # < operators.
-            actual_value = actual_value.date()
+        return self.compile(value)(actual_value)
 
+    def compile(self, value):
         condition_date = self.str_to_date(value)
-        return self.date_is_active(condition_date, actual_value)
+
+        def is_active(actual_value):
+            assert isinstance(actual_value, datetime.date)
+            if isinstance(actual_value, datetime.datetime):
+                # datetime.datetime cannot be compared to datetime.date with >
+                # and < operators.
+                actual_value = actual_value.date()
+            return self.date_is_active(condition_date, actual_value)
+        return is_active
 
     def date_is_active(self, condition_date, value):
         raise NotImplementedError
@@ -263,6 +395,15 @@ class OnOrAfterDate(AbstractDate):
         return value >= after_this_date
 
 
+def overrides(condition_set, name):
+    '''
+    Returns whether the class of ``condition_set`` overrides the
+    :class:`ConditionSet` method ``name``.
+    '''
+    method = getattr(type(condition_set), name)
+    return method.im_func is not getattr(ConditionSet, name).im_func
+
+
 class ConditionSetBase(type):
     def __new__(cls, name, bases, attrs):
         attrs['fields'] = {}
@@ -328,17 +469,24 @@ class ConditionSet(object):
             value = value()
         return value
 
-    def has_active_condition(self, condition, instances):
+    def has_active_condition(self, condition, instances, key=None):
         """
         Given a list of instances, and the condition active for
         this switch, returns a boolean representing if the
         conditional is met, including a non-instance default.
+        ``key`` is the key of the switch, for the fields that use it; it is
+        left out when a subclass overrides ``is_active``.
         """
+        if overrides(self, 'is_active'):
+            key = None
         return_value = None
         for instance in instances + [None]:
             if not self.can_execute(instance):
                 continue
-            result = self.is_active(instance, condition)
+            if key is None:
+                result = self.is_active(instance, condition)
+            else:
+                result = self._is_active(instance, condition, key)
             if result is False:
                 return False
             elif result is True:
@@ -350,19 +498,52 @@ class ConditionSet(object):
         Given an instance, and the condition active for this switch, returns
         a boolean representing if the feature is active.
         """
+        return self._is_active(instance, condition)
+
+    def _is_active(self, instance, condition, key=None):
         return_value = None
         for name, field_conditions in condition.iteritems():
             field = self.fields.get(name)
             if field:
                 value = self.get_field_value(instance, name)
                 for status, field_cond in field_conditions:
-                    if field.is_active(field_cond, value):
+                    if field.uses_key:
+                        active = field.is_active(field_cond, value, key)
+                    else:
+                        active = field.is_active(field_cond, value)
+                    if active:
                         exclude = status == EXCLUDE
                         if exclude:
                             return False
                         return_value = True
         return return_value
 
+    def compile(self, condition, key=None):
+        """
+        Given the condition active for this switch, and the switch's key,
+        returns a :class:`CompiledCondition` with every field value already
+        parsed and split into include and exclude predicates (see
+        :meth:`Field.compile_many`). Subclasses that override ``is_active`` or
+        ``has_active_condition`` get an :class:`UncompiledCondition` instead,
+        which leaves the checks to those methods.
+        """
+        if (overrides(self, 'is_active') or
+                overrides(self, 'has_active_condition')):
+            return UncompiledCondition(self, condition, key)
+        fields = []
+        for name, field_conditions in condition.iteritems():
+            field = self.fields.get(name)
+            if not field:
+                continue
+            includes = []
+            excludes = []
+            for status, field_cond in field_conditions:
+                values = excludes if status == EXCLUDE else includes
+                values.append(field_cond)
+            fields.append((name, tuple(field.compile_many(includes, key)),
+                           tuple(field.compile_many(excludes, key))))
+        return CompiledCondition(self, tuple(fields))
+
     def get_group_label(self):  # pragma: nocover
         """
         Returns a string representing a human readable version
@@ -371,6 +552,89 @@ class ConditionSet(object):
         return self.__class__.__name__.title()
 
 
+class CompiledCondition(object):
+    '''
+    The conditions a switch holds for a single :class:`ConditionSet`, parsed
+    ahead of time by :meth:`ConditionSet.compile`. Evaluates exactly like
+    :meth:`ConditionSet.has_active_condition` and
+    :meth:`ConditionSet.is_active`, without touching the raw condition data.
+    '''
+    __slots__ = ('condition_set', 'fields')
+
+    def __init__(self, condition_set, fields):
+        self.condition_set = condition_set
+        # A tuple of (field name, include predicates, exclude predicates).
+        self.fields = fields
+
+    def has_active_condition(self, instances, values=None):
+        """
+        ``values``, if given, is a dictionary in which the field values
+        extracted from ``instances`` are kept for reuse, keyed by condition
+        set, instance identity and field name. Each instance is kept along
+        with its values, so that its identity can't be reused by another
+        object while the dictionary is around.
+        """
+        can_execute = self.condition_set.can_execute
+        return_value = None
+        for instance in instances + [None]:
+            if not can_execute(instance):
+                continue
+            result = self.is_active(instance, values)
+            if result is False:
+                return False
+            elif result is True:
+                return_value = True
+        return return_value
+
+    def is_active(self, instance, values=None):
+        get_field_value = self.condition_set.get_field_value
+        return_value = None
+        for name, includes, excludes in self.fields:
+            if values is None:
+                value = get_field_value(instance, name)
+            else:
+                value_key = (self.condition_set, id(instance), name)
+                entry = values.get(value_key)
+                if entry is not None and entry[0] is instance:
+                    value = entry[1]
+                else:
+                    value = get_field_value(instance, name)
+                    values[value_key] = (instance, value)
+            for is_active in excludes:
+                if is_active(value):
+                    return False
+            if return_value is None:
+                for is_active in includes:
+                    if is_active(value):
+                        return_value = True
+                        break
+        return return_value
+
+
+class UncompiledCondition(object):
+    '''
+    Stands in for a :class:`CompiledCondition` when the condition set checks
+    conditions its own way, by overriding :meth:`ConditionSet.is_active` or
+    :meth:`ConditionSet.has_active_condition`; the raw condition is passed to
+    the latter on every check.
+    '''
+    __slots__ = ('condition_set', 'condition', 'key')
+
+    def __init__(self, condition_set, condition, key=None):
+        self.condition_set = condition_set
+        # A copy, so that later changes to the switch don't leak in.
+        self.condition = copy.deepcopy(condition)
+        self.key = key
+
+    def has_active_condition(self, instances, values=None):
+        condition_set = self.condition_set
+        if overrides(condition_set, 'has_active_condition'):
+            return condition_set.has_active_condition(self.condition,
+                                                      instances)
+        return condition_set.has_active_condition(self.condition, instances,
+                                                  self.key)
+
+
 class ModelConditionSet(ConditionSet):
     percent = Percent()
 
@@ -384,6 +648,16 @@ class ModelConditionSet(ConditionSet):
         return isinstance(instance, self.model)
 
 
+class HashedModelConditionSet(ModelConditionSet):
+    '''
+    A :class:`ModelConditionSet` whose percentages hash the instances' ids
+    along with the key of the switch (see :class:`HashedPercent`), rather than
+    modding them against 100; for ids that aren't sequential integers, or to
+    keep switches from being active for the same instances.
+    '''
+    percent = HashedPercent()
+
+
 class RequestConditionSet(ConditionSet):
     def get_namespace(self):  # pragma: nocover
         return 'request'
@@ -0,0 +1,117 @@
+"""
+switchboard.feed
+~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2015 Kyle Adams.
+:license: Apache License 2.0, see LICENSE for more details.
+"""
+
+import json
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class ChangeFeed(object):
+    '''
+    A channel on which every write to the datastore is announced to all
+    processes, so that they can refresh their copies of the switches right
+    away rather than polling for changes.
+
+    A change is a dictionary holding the new ``version``, the ``previous``
+    version and the ``keys`` of the switches that changed, or ``None`` if
+    those aren't known (see :meth:`~switchboard.models.Model.bump_version`).
+    Once passed to ``configure``, changes are published by ``bump_version``
+    and, when received, expire the process's
+    :class:`~switchboard.cache.Snapshot`.
+
+    Subclasses implement ``publish`` and call ``notify`` with every change
+    they receive.
+    '''
+    def __init__(self):
+        self.subscribers = []
+
+    def __repr__(self):  # pragma: nocover
+        return '<%s>' % self.__class__.__name__
+
+    def subscribe(self, callback):
+        '''
+        Registers ``callback`` to be called with every change received.
+        '''
+        if callback not in self.subscribers:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def publish(self, change):  # pragma: nocover
+        raise NotImplementedError
+
+    def notify(self, change):
+        for callback in list(self.subscribers):
+            try:
+                callback(change)
+            except Exception:
+                log.exception('Error notifying %r of change %r', callback,
+                              change)
+
+
+class LocalChangeFeed(ChangeFeed):
+    '''
+    A feed whose changes never leave the process; published changes are
+    handed to the subscribers right away. Useful for tests and single-process
+    deployments.
+    '''
+    def publish(self, change):
+        self.notify(change)
+
+
+class RedisChangeFeed(ChangeFeed):
+    '''
+    A feed on top of Redis' publish/subscribe, given a Redis client. Changes
+    are received by a daemon thread, started by ``start``.
+
+        feed = RedisChangeFeed(redis.StrictRedis())
+        feed.start()
+        configure(config, datastore, feed=feed)
+    '''
+    # Seconds to wait before listening again after losing the connection.
+    retry_delay = 1
+
+    def __init__(self, redis, channel='switchboard'):
+        super(RedisChangeFeed, self).__init__()
+        self.redis = redis
+        self.channel = channel
+        self._thread = None
+
+    def publish(self, change):
+        self.redis.publish(self.channel, json.dumps(change))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run,
+                                            name='switchboard-feed')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except Exception:
+                log.exception('Lost %r, listening again in %ss', self,
+                              self.retry_delay)
+            time.sleep(self.retry_delay)
+
+    def listen(self):
+        '''
+        Receives changes until the connection to Redis is lost.
+        '''
+        pubsub = self.redis.pubsub()
+        pubsub.subscribe(self.channel)
+        for message in pubsub.listen():
+            if message['type'] == 'message':
+                self.notify(json.loads(message['data']))
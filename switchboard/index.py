@@ -0,0 +1,133 @@
+"""
+switchboard.index
+~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2015 Kyle Adams.
+:license: Apache License 2.0, see LICENSE for more details.
+"""
+
+import bisect
+import logging
+import time
+
+from .models import _meta_key, _timestamp
+
+log = logging.getLogger(__name__)
+
+
+def _sort_value(instance, field):
+    value = getattr(instance, field, None)
+    if field.startswith('date_'):
+        # Stored as numbers, which every serializer can handle.
+        return _timestamp(value)
+    return value
+
+
+class SortIndex(object):
+    '''
+    The keys of every record of a :class:`~switchboard.models.Model`, sorted
+    by each of ``fields`` and stored in the datastore, so that a page of
+    records can be listed without reading and sorting all of them.
+
+        index = SortIndex(Switch, ('label', 'date_modified'))
+        keys, total = index.page('label', offset=50, limit=50)
+
+    The stored index records the datastore version (see
+    :meth:`~switchboard.models.Model.get_version`) it is up to date with.
+    Whenever that differs from the current version, only the records listed
+    in the change log since then are read again, unless the log doesn't cover
+    all of the versions since, in which case the index is rebuilt from all
+    records. It is also rebuilt once it is ``max_age`` seconds old, so that a
+    change the log missed doesn't stay out of it for good.
+
+    The index is stored as a single record, holding the sort values of every
+    record along with one order per field. Listing a page thus reads the
+    whole index, and any change writes it back whole: far less than reading
+    every record, but still growing with the number of records.
+    '''
+    def __init__(self, model, fields, name=None, max_age=300):
+        self.model = model
+        self.fields = tuple(fields)
+        self.max_age = max_age
+        self.key = _meta_key('index/%s' % (name or model.__name__.lower()))
+
+    def __repr__(self):  # pragma: nocover
+        return '<%s: %s>' % (self.__class__.__name__, self.model.__name__)
+
+    def page(self, field, reverse=False, offset=0, limit=None):
+        '''
+        Returns the keys of the records at ``offset`` in the order of
+        ``field``, at most ``limit`` of them, along with the total number of
+        records.
+        '''
+        entries = self.load()['orders'][field]
+        total = len(entries)
+        if offset >= total:
+            return [], total
+        end = total if limit is None else min(offset + limit, total)
+        if reverse:
+            selected = reversed(entries[total - end:total - offset])
+        else:
+            selected = entries[offset:end]
+        return [key for _, key in selected], total
+
+    def load(self):
+        '''
+        Returns the stored index, bringing it up to date first if the
+        datastore's version changed.
+        '''
+        version = self.model.get_version()
+        index = self.model.ds.get(self.key)
+        if (index is None or index.get('fields') != list(self.fields) or
+                time.time() - index.get('built', 0) >= self.max_age or
+                not self._update(index, version)):
+            index = self._build(version)
+        elif index['version'] == version:
+            return index
+        index['version'] = version
+        self.model.ds.put(self.key, index)
+        return index
+
+    def _build(self, version):
+        log.debug('Rebuilding %r at version %s', self, version)
+        values = {}
+        for instance in self.model.iterall(frozen=True):
+            values[instance.key] = [_sort_value(instance, field)
+                                    for field in self.fields]
+        orders = {}
+        for i, field in enumerate(self.fields):
+            orders[field] = sorted([v[i], key]
+                                   for key, v in values.iteritems())
+        return dict(version=version, fields=list(self.fields), values=values,
+                    orders=orders, built=time.time())
+
+    def _update(self, index, version):
+        '''
+        Updates ``index`` in place with the records changed since its version.
+        Returns whether it could.
+        '''
+        if index['version'] == version:
+            return True
+        keys = self.model.get_changes(index['version'], version)
+        if keys is None:
+            return False
+        log.debug('Updating %r to version %s: %s', self, version, sorted(keys))
+        changed = self.model.get_many(list(keys), frozen=True)
+        values = index['values']
+        orders = index['orders']
+        for key in keys:
+            old = values.pop(key, None)
+            if old is not None:
+                for field, value in zip(self.fields, old):
+                    entries = orders[field]
+                    i = bisect.bisect_left(entries, [value, key])
+                    if i < len(entries) and entries[i] == [value, key]:
+                        del entries[i]
+            instance = changed.get(key)
+            if instance is None:
+                continue
+            new = [_sort_value(instance, field) for field in self.fields]
+            values[key] = new
+            for field, value in zip(self.fields, new):
+                bisect.insort(orders[field], [value, key])
+        return True
@@ -7,15 +7,24 @@ switchboard.manager
 """
 
 import logging
+import threading
+import time
 
 from .base import ModelDict
+from .cache import Snapshot
 from .models import (
     Switch,
+    switch_defaults,
     DISABLED, SELECTIVE, GLOBAL, INHERIT,
     INCLUDE, EXCLUDE,
 )
 from .proxy import SwitchProxy
 from .settings import settings, Settings
+from .signals import (
+    condition_set_checked,
+    result_cache_checked,
+    switch_checked,
+)
 
 log = logging.getLogger(__name__)
 # These are (mostly) read-only module variables since we want it shared among
@@ -23,6 +32,60 @@ log = logging.getLogger(__name__)
 # populated on Switchboard startup (i.e., operator.register()).
 registry = {}
 registry_by_namespace = {}
+# The registered condition sets, sorted by group label, and the same entries
+# by namespace; see CatalogEntry. Rebuilt whenever the registry changes.
+catalog = ()
+catalog_by_namespace = {}
+# Compiled switch conditions, by switch key. Entries are rebuilt whenever the
+# stored conditions change, and dropped whenever the registry changes or the
+# switch is removed.
+compiled_switches = {}
+# Marks a result cache miss, since None is a valid is_active result for
+# parent switches.
+MISSING = object()
+
+
+def lineage(key):
+    """
+    Returns the keys of all ancestors of a switch, followed by its own key.
+
+    >>> lineage('a:b:c')
+    ['a', 'a:b', 'a:b:c']
+    """
+    parts = key.split(':')
+    return [':'.join(parts[:i]) for i in xrange(1, len(parts) + 1)]
+
+
+class CatalogEntry(object):
+    '''
+    What the admin UI needs to know about a registered condition set, worked
+    out once when it is registered: its id, namespace, group label and
+    fields, as a tuple of (name, field) pairs. ``position`` is the entry's
+    index in the catalog.
+    '''
+    __slots__ = ('condition_set', 'id', 'namespace', 'group', 'fields',
+                 'position')
+
+    def __init__(self, condition_set, position):
+        self.condition_set = condition_set
+        self.id = condition_set.get_id()
+        self.namespace = condition_set.get_namespace()
+        self.group = condition_set.get_group_label()
+        self.fields = tuple(condition_set.fields.iteritems())
+        self.position = position
+
+
+def build_catalog():
+    '''
+    Rebuilds the catalog of registered condition sets.
+    '''
+    global catalog, catalog_by_namespace
+    condition_sets = sorted(registry.itervalues(),
+                            key=lambda x: x.get_group_label())
+    entries = tuple(CatalogEntry(condition_set, i)
+                    for i, condition_set in enumerate(condition_sets))
+    catalog = entries
+    catalog_by_namespace = dict((e.namespace, e) for e in entries)
 
 
 def nested_config(config):
@@ -34,9 +97,38 @@ def nested_config(config):
     return cfg
 
 
-def configure(config={}, datastore=None, nested=False):
+def expire_snapshot(change):
+    """
+    Subscribed to the change feed passed to ``configure``; expires the
+    snapshot, if any, whenever a change is received, along with the compiled
+    conditions of the switches changed.
+    """
+    snapshot = Switch.snapshot
+    if snapshot is not None:
+        snapshot.expire()
+    if change.get('keys') is None:
+        compiled_switches.clear()
+    else:
+        for key in change['keys']:
+            compiled_switches.pop(key, None)
+
+
+def forget_compiled(switch):
     """
-    Useful for when you need to control Switchboard's setup
+    Connected to ``post_delete``; drops the compiled conditions of a switch
+    removed by this process.
+    """
+    compiled_switches.pop(switch.key, None)
+
+
+Switch.post_delete.connect(forget_compiled)
+
+
+def configure(config={}, datastore=None, nested=False, feed=None,
+              request_state=None):
+    """
+    Useful for when you need to control Switchboard's setup. ``request_state``
+    replaces the :class:`RequestState` of the global ``operator``.
     """
     if nested:
         config = nested_config(config)
@@ -47,10 +139,60 @@ def configure(config={}, datastore=None, nested=False):
     if datastore:
         Switch.ds = datastore
 
+    if feed:
+        Switch.feed = feed
+        feed.subscribe(expire_snapshot)
+
+    if request_state is not None:
+        operator._state = request_state
+
+    # Index the switch defaults now, rather than when creating a switch.
+    switch_defaults()
+
+    timeout = getattr(settings, 'SWITCHBOARD_CACHE_TIMEOUT', None)
+    if timeout is None:
+        Switch.snapshot = None
+    else:
+        Switch.snapshot = Snapshot(Switch, timeout)
+
     # Register the builtins
     __import__('switchboard.builtins')
 
 
+class RequestState(threading.local):
+    '''
+    The part of a :class:`SwitchManager`'s state that belongs to whatever the
+    current thread is doing, e.g. handling a request. Everything else, such as
+    switches and compiled conditions, is shared by all threads.
+
+    Where requests aren't handled one per thread, e.g. with greenlets or
+    coroutines, pass the manager any object with the same attributes and
+    defaults, stored per request as appropriate (see ``configure``).
+    '''
+    def __init__(self):
+        self.context = {}
+        self.result_cache = None
+        # Field values extracted from instances, kept for reuse by every
+        # check while set to a {}; see CompiledCondition.has_active_condition.
+        self.field_values = None
+        # Switches fetched up front while checking a nested key; see
+        # SwitchManager.is_active.
+        self.prefetched = None
+
+
+def request_state(name, doc=None):
+    '''
+    Returns a property for the attribute ``name`` of a manager's
+    :class:`RequestState`.
+    '''
+    def fget(self):
+        return getattr(self._state, name)
+
+    def fset(self, value):
+        setattr(self._state, name, value)
+    return property(fget, fset, doc=doc)
+
+
 class SwitchManager(ModelDict):
     DISABLED = DISABLED
     SELECTIVE = SELECTIVE
@@ -68,10 +210,14 @@ class SwitchManager(ModelDict):
             new_args.append(a)
         kwargs['key'] = 'key'
         kwargs['value'] = 'value'
-        self.result_cache = None
-        self.context = {}
+        self._state = kwargs.pop('request_state', None) or RequestState()
         super(SwitchManager, self).__init__(*new_args, **kwargs)
 
+    context = request_state('context', 'Objects every check is made against.')
+    result_cache = request_state('result_cache')
+    field_values = request_state('field_values')
+    _prefetched = request_state('prefetched')
+
     def __unicode__(self):  # pragma: nocover
         return "<%s: %s (%s)>" % (self.__class__.__name__,
                                   getattr(self, 'model', ''),
@@ -85,24 +231,52 @@ class SwitchManager(ModelDict):
         """
         return SwitchProxy(self, super(SwitchManager, self).__getitem__(key))
 
+    def get_switch(self, key):
+        """
+        Returns a switch for read-only use, e.g. to check whether it is
+        active. Served from the in-process snapshot when one is configured
+        (see ``configure``); otherwise the same as ``operator[key]``.
+        """
+        prefetched = self._prefetched
+        if prefetched is not None and key in prefetched:
+            switch = prefetched[key]
+            if switch is None:
+                raise KeyError(key)
+            return switch
+        snapshot = Switch.snapshot
+        if snapshot is not None:
+            switch = snapshot.get(key)
+            if switch is not None:
+                return SwitchProxy(self, switch)
+            elif not self._auto_create:
+                raise KeyError(key)
+        return self[key]
+
     def with_result_cache(func):
         """
         Decorator specifically for is_active.  If self.result_cache is set to a {}
-        the is_active results will be cached for each set of params.
+        or a :class:`~switchboard.cache.ResultCache` the is_active results will
+        be cached for each set of params and context objects, including the
+        results of the parent checks of nested switches. SwitchboardMiddleware
+        does so for the length of each request.
         """
         def inner(self, *args, **kwargs):
             dic = self.result_cache
             cache_key = None
             if dic is not None:
-                cache_key = (args, tuple(kwargs.items()))
+                cache_key = (args, tuple(sorted(kwargs.items())),
+                             tuple(sorted(self.context.items())))
                 try:
-                    result = dic.get(cache_key)
+                    result = dic.get(cache_key, MISSING)
                 except TypeError as e:  # not hashable
                     log.debug('Switchboard result cache not active for this "%s" check due to: %s within args: %s',
                               args[0], e, repr(cache_key)[:200])
                     cache_key = None
                 else:
-                    if result is not None:
+                    if result_cache_checked.receivers:
+                        result_cache_checked.send(args[0],
+                                                  hit=result is not MISSING)
+                    if result is not MISSING:
                         return result
             result = func(self, *args, **kwargs)
             if cache_key is not None:
@@ -110,6 +284,22 @@ class SwitchManager(ModelDict):
             return result
         return inner
 
+    def with_timing(func):
+        """
+        Decorator specifically for is_active. Sends the ``switch_checked``
+        signal after each check, while anything is connected to it.
+        """
+        def inner(self, key, *args, **kwargs):
+            if not switch_checked.receivers:
+                return func(self, key, *args, **kwargs)
+            start = time.time()
+            result = func(self, key, *args, **kwargs)
+            switch_checked.send(key, result=result,
+                                duration=time.time() - start)
+            return result
+        return inner
+
+    @with_timing
     @with_result_cache
     def is_active(self, key, *instances, **kwargs):
         """
@@ -118,11 +308,20 @@ class SwitchManager(ModelDict):
 
         >>> operator.is_active('my_feature', request) #doctest: +SKIP
         """
+        parts = key.split(':')
+        # Fetch a nested key's whole lineage at once, rather than one switch
+        # at a time while recursing through its parents below.
+        prefetch = len(parts) > 1 and self._prefetched is None
         try:
             default = kwargs.pop('default', False)
 
+            if prefetch:
+                keys = lineage(key)
+                prefetched = dict.fromkeys(keys)
+                prefetched.update(self.get_switches(keys))
+                self._prefetched = prefetched
+
             # Check all parents for a disabled state
-            parts = key.split(':')
             if len(parts) > 1:
                 child_kwargs = kwargs.copy()
                 child_kwargs['default'] = None
@@ -135,42 +334,154 @@ class SwitchManager(ModelDict):
                     default = result
 
             try:
-                switch = self[key]
+                switch = self.get_switch(key)
             except KeyError:
                 # switch is not defined, defer to parent
                 return default
 
-            if switch.status == GLOBAL:
-                return True
-            elif switch.status == DISABLED:
-                return False
-            elif switch.status == INHERIT:
-                return default
-
-            conditions = switch.value
-            # If no conditions are set, we inherit from parents
-            if not conditions:
-                return default
-
             instances = list(instances) if instances else []
             instances.extend(self.context.values())
 
-            # check each switch to see if it can execute
-            return_value = False
+            return self._evaluate(switch, default, instances,
+                                  self.field_values)
+        except:
+            log.exception('Error checking if switch "%s" is active', key)
+            return False
+        finally:
+            if prefetch:
+                self._prefetched = None
 
-            for namespace, condition in conditions.iteritems():
-                condition_set = registry_by_namespace.get(namespace)
-                if not condition_set:
-                    continue
-                result = condition_set.has_active_condition(condition,
-                                                            instances)
+    def are_active(self, keys, *instances, **kwargs):
+        """
+        Returns a dictionary mapping each of ``keys`` to what ``is_active``
+        would return for it. All the switches involved, including the parents
+        of nested keys, are fetched at once, and parents shared by several
+        keys as well as the values that condition sets extract from
+        ``instances`` are only worked out once.
+
+        >>> operator.are_active(['foo', 'foo:bar'], request) #doctest: +SKIP
+        {'foo': True, 'foo:bar': False}
+        """
+        default = kwargs.pop('default', False)
+        keys = list(keys)
+        switches = self.get_switches(set(k for key in keys
+                                         for k in lineage(key)))
+        return self._evaluate_many(keys, switches, instances, default)
+
+    def active_switches(self, *instances, **kwargs):
+        """
+        Returns a dictionary mapping the key of every switch to what
+        ``is_active`` would return for it.
+
+        >>> operator.active_switches(request) #doctest: +SKIP
+        {'foo': True, 'foo:bar': False}
+        """
+        default = kwargs.pop('default', False)
+        snapshot = Switch.snapshot
+        if snapshot is not None:
+            switches = snapshot.records()
+        else:
+            switches = dict((s.key, s)
+                            for s in self._model.iterall(frozen=True))
+        switches = dict((k, SwitchProxy(self, s))
+                        for k, s in switches.iteritems())
+        return self._evaluate_many(switches.keys(), switches, instances,
+                                   default)
+
+    def get_switches(self, keys):
+        """
+        Returns a dictionary of switches by key for read-only use, like
+        ``get_switch`` does for a single key. Keys without a switch are left
+        out, unless the manager auto-creates switches.
+        """
+        keys = list(keys)
+        snapshot = Switch.snapshot
+        if snapshot is not None:
+            records = snapshot.records()
+            switches = dict((k, records[k]) for k in keys if k in records)
+        else:
+            switches = self._model.get_many(keys, frozen=True)
+        if self._auto_create:
+            for key in keys:
+                if key not in switches:
+                    switches[key] = self._model.get_or_create(key)[0]
+        return dict((k, SwitchProxy(self, s)) for k, s in switches.iteritems())
+
+    def _evaluate_many(self, keys, switches, instances, default):
+        instances = list(instances) if instances else []
+        instances.extend(self.context.values())
+        # Parent results, which (as with is_active) default to None, and the
+        # field values extracted from instances, shared by all keys.
+        parents = {}
+        values = self.field_values
+        if values is None:
+            values = {}
+
+        def check(key, default):
+            parts = key.split(':')
+            if len(parts) > 1:
+                parent = ':'.join(parts[:-1])
+                if parent not in parents:
+                    parents[parent] = check(parent, None)
+                result = parents[parent]
                 if result is False:
-                    return False
+                    return result
                 elif result is True:
-                    return_value = True
-        except:
-            log.exception('Error checking if switch "%s" is active', key)
-            return_value = False
+                    default = result
+            switch = switches.get(key)
+            if switch is None:
+                # switch is not defined, defer to parent
+                return default
+            return self._evaluate(switch, default, instances, values)
+
+        results = {}
+        timed = bool(switch_checked.receivers)
+        for key in keys:
+            if timed:
+                start = time.time()
+            try:
+                results[key] = check(key, default)
+            except:
+                log.exception('Error checking if switch "%s" is active', key)
+                results[key] = False
+            if timed:
+                switch_checked.send(key, result=results[key],
+                                    duration=time.time() - start)
+        return results
+
+    def _evaluate(self, switch, default, instances, values=None):
+        """
+        Returns whether ``switch`` itself is active for ``instances``, given
+        the ``default`` that its parents resolved to.
+        """
+        if switch.status == GLOBAL:
+            return True
+        elif switch.status == DISABLED:
+            return False
+        elif switch.status == INHERIT:
+            return default
+
+        # If no conditions are set, we inherit from parents
+        if not switch.value:
+            return default
+
+        # check each switch to see if it can execute
+        return_value = False
+        timed = bool(condition_set_checked.receivers)
+
+        for condition in self.get_compiled(switch).conditions:
+            if timed:
+                start = time.time()
+                result = condition.has_active_condition(instances, values)
+                condition_set_checked.send(
+                    condition.condition_set.get_namespace(), key=switch.key,
+                    result=result, duration=time.time() - start)
+            else:
+                result = condition.has_active_condition(instances, values)
+            if result is False:
+                return False
+            elif result is True:
+                return_value = True
 
         # there were no matching conditions, so it must not be enabled
         return return_value
@@ -187,6 +498,8 @@ class SwitchManager(ModelDict):
             condition_set = condition_set()
         registry[condition_set.get_id()] = condition_set
         registry_by_namespace[condition_set.get_namespace()] = condition_set
+        compiled_switches.clear()
+        build_catalog()
 
     def unregister(self, condition_set):
         """
@@ -198,6 +511,8 @@ class SwitchManager(ModelDict):
             condition_set = condition_set()
         registry.pop(condition_set.get_id(), None)
         registry_by_namespace.pop(condition_set.get_namespace(), None)
+        compiled_switches.clear()
+        build_catalog()
 
     def get_condition_set_by_id(self, switch_id):
         """
@@ -206,6 +521,25 @@ class SwitchManager(ModelDict):
         """
         return registry[switch_id]
 
+    def get_condition_set_by_namespace(self, namespace):
+        """
+        Given the namespace of a condition set (described in
+        ConditionSet.get_namespace()), returns the registered instance, or
+        ``None`` if nothing is registered under that namespace.
+        """
+        return registry_by_namespace.get(namespace)
+
+    def get_compiled(self, switch):
+        """
+        Returns the :class:`~switchboard.models.CompiledSwitch` for a switch,
+        compiling it only if its conditions changed since the last call.
+        """
+        compiled = compiled_switches.get(switch.key)
+        if compiled is None or not compiled.is_current(switch):
+            compiled = switch.compile()
+            compiled_switches[switch.key] = compiled
+        return compiled
+
     def get_condition_sets(self):
         """
         Returns a generator yielding all currently registered
@@ -213,6 +547,17 @@ class SwitchManager(ModelDict):
         """
         return registry.itervalues()
 
+    def get_catalog(self, namespaces=None):
+        """
+        Returns the :class:`CatalogEntry` of every registered condition set,
+        sorted by group label; only those for ``namespaces``, if given.
+        """
+        if namespaces is None:
+            return catalog
+        entries = [catalog_by_namespace.get(ns) for ns in namespaces]
+        return sorted((e for e in entries if e is not None),
+                      key=lambda e: e.position)
+
     def get_all_conditions(self):
         """
         Returns a generator which yields groups of lists of conditions.
@@ -220,11 +565,10 @@ class SwitchManager(ModelDict):
         >>> for set_id, label, field in operator.get_all_conditions(): #doctest: +SKIP
         >>>     print "%(label)s: %(field)s" % (label, field.label) #doctest: +SKIP
         """
-        cs = self.get_condition_sets()
-        for condition_set in sorted(cs, key=lambda x: x.get_group_label()):
-            group = unicode(condition_set.get_group_label())
-            for field in condition_set.fields.itervalues():
-                yield condition_set.get_id(), group, field
+        for entry in catalog:
+            group = unicode(entry.group)
+            for _, field in entry.fields:
+                yield entry.id, group, field
 
 
 auto_create = getattr(settings, 'SWITCHBOARD_AUTO_CREATE', True)
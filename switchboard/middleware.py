@@ -7,6 +7,7 @@ switchboard.middleware
 """
 
 from webob import Request
+from switchboard.cache import ResultCache
 from switchboard.signals import request_finished
 from switchboard import operator
 
@@ -21,6 +22,10 @@ class SwitchboardMiddleware(object):
         try:
             req = Request(environ)
             operator.context['request'] = req
+            # Repeated checks within the request are answered from memory,
+            # and each value a condition looks at is only worked out once.
+            operator.result_cache = ResultCache()
+            operator.field_values = {}
             self.pre_request(req)
             resp = req.get_response(self.app)
             return resp(environ, start_response)
@@ -44,6 +49,8 @@ class SwitchboardMiddleware(object):
         pass
 
     def request_finished(self, req):
+        operator.result_cache = None
+        operator.field_values = None
         if req:
             # Notify Switchboard that the request is finished
             request_finished.send(req)
@@ -6,9 +6,12 @@ switchboard.models
 :license: Apache License 2.0, see LICENSE for more details.
 """
 
+import copy
 from datetime import datetime
 import logging
 import os
+import threading
+import time
 import uuid
 
 from blinker import signal
@@ -16,6 +19,7 @@ import datastore.core
 import datastore.filesystem
 
 from .settings import settings
+from .signals import datastore_read
 
 log = logging.getLogger(__name__)
 
@@ -28,6 +32,9 @@ INCLUDE = 'i'
 EXCLUDE = 'e'
 
 NAMESPACE = 'switchboard'
+# Bookkeeping records live outside of NAMESPACE so that they never show up
+# when querying for models.
+META_NAMESPACE = 'switchboard_meta'
 
 
 def _key(key=''):
@@ -43,6 +50,48 @@ def _key(key=''):
     return key
 
 
+def _unkey(key):
+    '''
+    Returns the Switchboard key for a datastore key within the NAMESPACE; the
+    inverse of _key.
+    '''
+    prefix = '%s/' % _key()
+    return str(key)[len(prefix):].replace('|', ':')
+
+
+def _meta_key(name):
+    '''
+    Returns a Datastore key object for a bookkeeping record, prefixed with the
+    META_NAMESPACE.
+    '''
+    return datastore.Key(os.path.join(META_NAMESPACE, name))
+
+
+VERSION_KEY = _meta_key('version')
+# The change log keeps the entry of each version in one of CHANGE_LOG_SIZE
+# slots, so that old entries are overwritten rather than piling up. Versions
+# are consecutive, so the log is a ring holding the latest CHANGE_LOG_SIZE.
+CHANGE_LOG_SIZE = 4096
+# The most versions get_changes reads the change log entries of; when further
+# behind, reading every record is about as cheap.
+MAX_CHANGES = 100
+# Serializes the writes of the version in datastores without an atomic
+# increment; see Model.bump_version.
+_version_lock = threading.Lock()
+
+
+def _change_key(version):
+    '''
+    Returns the Datastore key of the change log slot for ``version``.
+    '''
+    return _meta_key('changes/%d' % (version % CHANGE_LOG_SIZE))
+
+
+# How many keys to ask for per SCAN call, and to read per MGET call, when
+# iterating over all records in Redis.
+SCAN_BATCH_SIZE = 500
+
+
 class Model(object):
     '''
     Basic data object for CRUD operations on top of a datastore.
@@ -53,6 +102,15 @@ class Model(object):
     # http://datastore.readthedocs.io/en/latest/ for more details about what
     # all can be done with datastores.
     ds = datastore.DictDatastore()
+    # Optional process-local copy of all records (see switchboard.cache); set
+    # up by the configure call when a cache timeout is configured.
+    snapshot = None
+    # Optional channel on which every change is published to other processes
+    # (see switchboard.feed); set up by the configure call.
+    feed = None
+    # Optional compact, read-only class for instances that are only looked
+    # at, e.g. to check whether a switch is active; see FrozenSwitch.
+    frozen_class = None
 
     pre_save = signal('pre_save')
     post_save = signal('post_save')
@@ -75,6 +133,7 @@ class Model(object):
             previous = self.get(key)
         self.pre_save.send(previous)
         self.ds.put(key, self.__dict__)
+        self.bump_version([self.key])
         self.post_save.send(self)
         return self.key
 
@@ -90,8 +149,180 @@ class Model(object):
     @classmethod
     def get(cls, key):
         key = _key(key)
+        if datastore_read.receivers:
+            datastore_read.send(cls, keys=[_unkey(key)])
         data = cls.ds.get(key)
-        return cls(**data) if data else None
+        return cls.from_data(data) if data else None
+
+    @classmethod
+    def from_data(cls, data):
+        '''
+        Returns an instance made out of stored data.
+        '''
+        return cls(**data)
+
+    @classmethod
+    def _loader(cls, frozen):
+        '''
+        Returns the function that makes an instance out of stored data.
+        '''
+        if frozen and cls.frozen_class is not None:
+            return cls.frozen_class.from_data
+        return cls.from_data
+
+    @classmethod
+    def get_many(cls, keys, frozen=False):
+        '''
+        Returns a dictionary of instances by key, for those of ``keys`` that
+        exist. With a Redis datastore all keys are read with a single MGET;
+        otherwise this falls back to reading one key at a time. If ``frozen``,
+        the instances are of the model's ``frozen_class``, when it has one.
+        '''
+        keys = list(keys)
+        ds_keys = [_key(k) for k in keys]
+        if keys and datastore_read.receivers:
+            datastore_read.send(cls, keys=keys)
+        values = cls._read_many(ds_keys)
+        load = cls._loader(frozen)
+        return dict((k, load(v)) for k, v in zip(keys, values) if v)
+
+    @classmethod
+    def _read_many(cls, ds_keys):
+        '''
+        Returns the stored values of the datastore keys ``ds_keys``, or
+        ``None`` for those missing, with a single MGET on Redis.
+        '''
+        if not ds_keys:
+            return []
+        elif hasattr(cls.ds, '_redis'):
+            # See _queryless_all for why this drops down to the native client.
+            serializer = cls.ds.child_datastore.serializer
+            values = cls.ds._redis.mget([str(k) for k in ds_keys])
+            return [v if v is None else serializer.loads(v) for v in values]
+        return [cls.ds.get(k) for k in ds_keys]
+
+    @classmethod
+    def save_many(cls, instances):
+        '''
+        Saves all of ``instances``, sending the same signals as ``save`` does
+        for each. With a Redis datastore the previous values are read with a
+        single MGET and the new ones written in a single pipeline; otherwise
+        this falls back to writing one instance at a time. Returns the keys of
+        the saved instances.
+        '''
+        instances = list(instances)
+        for instance in instances:
+            if getattr(instance, 'key', None) is None:
+                instance.key = str(uuid.uuid4())
+        previous = cls.get_many(instance.key for instance in instances)
+        for instance in instances:
+            cls.pre_save.send(previous.get(instance.key))
+        items = [(_key(instance.key), instance.__dict__)
+                 for instance in instances]
+        if hasattr(cls.ds, '_redis'):
+            serializer = cls.ds.child_datastore.serializer
+            pipeline = cls.ds._redis.pipeline()
+            for key, value in items:
+                pipeline.set(str(key), serializer.dumps(value))
+            pipeline.execute()
+        else:
+            for key, value in items:
+                cls.ds.put(key, value)
+        if instances:
+            cls.bump_version([instance.key for instance in instances])
+        for instance in instances:
+            cls.post_save.send(instance)
+        return [instance.key for instance in instances]
+
+    @classmethod
+    def get_version(cls):
+        '''
+        Returns the version of the stored data, which changes every time a
+        model is saved or removed, or ``None`` if nothing was ever written.
+        '''
+        if hasattr(cls.ds, '_redis'):
+            # Written with INCR, so not in the datastore's serialized format.
+            version = cls.ds._redis.get(str(VERSION_KEY))
+            return version if version is None else int(version)
+        return cls.ds.get(VERSION_KEY)
+
+    @classmethod
+    def _next_version(cls):
+        '''
+        Moves the version forward by one and returns it. A datastore without
+        a version starts off at the current time in microseconds, so that
+        versions handed out before it was emptied aren't handed out again.
+        With a Redis datastore the version is moved with INCR, so every writer
+        gets a version of its own; otherwise writers in other processes may
+        race for the same one, see ``bump_version``.
+        '''
+        start = int(time.time() * 1000000)
+        if hasattr(cls.ds, '_redis'):
+            r = cls.ds._redis
+            r.setnx(str(VERSION_KEY), start - 1)
+            return r.incr(str(VERSION_KEY))
+        with _version_lock:
+            previous = cls.ds.get(VERSION_KEY)
+            version = start if previous is None else previous + 1
+            cls.ds.put(VERSION_KEY, version)
+        return version
+
+    @classmethod
+    def bump_version(cls, keys=()):
+        '''
+        Moves the version of the stored data forward, recording that the
+        models with the given ``keys`` changed in the change log (see
+        ``get_changes``) and publishing the change to the ``feed``, if any.
+
+        Where two writers end up with the same version, which only happens
+        with datastores that have no atomic increment, the change log slot
+        gets written twice. Each writer checks the slot before and after
+        writing to it, and on finding the other's entry marks the version as
+        having unknown changes, which makes ``get_changes`` give up on it.
+        '''
+        version = cls._next_version()
+        previous = version - 1 if version > 1 else None
+        change = dict(version=version, previous=previous, keys=list(keys))
+        slot = _change_key(version)
+        if hasattr(cls.ds, '_redis'):
+            cls.ds.put(slot, change)
+        else:
+            token = str(uuid.uuid4())
+            existing = cls.ds.get(slot)
+            if existing and existing['version'] == version:
+                change['keys'] = None
+            cls.ds.put(slot, dict(change, token=token))
+            if cls.ds.get(slot).get('token') != token:
+                change['keys'] = None
+                cls.ds.put(slot, change)
+        if cls.snapshot is not None:
+            cls.snapshot.expire()
+        if cls.feed is not None:
+            cls.feed.publish(change)
+        return version
+
+    @classmethod
+    def get_changes(cls, since, version):
+        '''
+        Returns the set of keys of the models changed after version ``since``,
+        up to and including ``version``, by reading the change log entries of
+        the versions in between, with a single MGET on Redis. Returns ``None``
+        when there are more than MAX_CHANGES of them or the log doesn't cover
+        them all, e.g. because their entries were overwritten since, not
+        written yet or marked as unknown by racing writers.
+        '''
+        if (since is None or version is None or since > version or
+                version - since > MAX_CHANGES):
+            return None
+        versions = range(since + 1, version + 1)
+        changes = cls._read_many([_change_key(v) for v in versions])
+        keys = set()
+        for v, change in zip(versions, changes):
+            if (not change or change['version'] != v or
+                    change['keys'] is None):
+                return None
+            keys.update(change['keys'])
+        return keys
 
     @classmethod
     def contains(cls, key):
@@ -152,20 +383,70 @@ class Model(object):
         if instance:
             cls.pre_delete.send(instance)
             result = cls.ds.delete(key)
+            cls.bump_version([instance.key])
             cls.post_delete.send(instance)
         else:
             # XXX Should there be any error thrown if this is a noop?
             result = None
         return result
 
+    @classmethod
+    def remove_many(cls, keys):
+        '''
+        Removes the instances of ``keys`` that exist, sending the same signals
+        as ``remove`` does for each and bumping the version once. Returns the
+        keys of the removed instances.
+        '''
+        keys = list(keys)
+        found = cls.get_many(keys)
+        instances = [found[key] for key in keys if key in found]
+        for instance in instances:
+            cls.pre_delete.send(instance)
+        for instance in instances:
+            cls.ds.delete(_key(instance.key))
+        if instances:
+            cls.bump_version([instance.key for instance in instances])
+        for instance in instances:
+            cls.post_delete.send(instance)
+        return [instance.key for instance in instances]
+
     @classmethod
     def all(cls):
+        return list(cls.iterall())
+
+    @classmethod
+    def iterall(cls, frozen=False):
+        '''
+        Returns a generator over all instances, creating each one only as it
+        is read from the datastore. If ``frozen``, the instances are of the
+        model's ``frozen_class``, when it has one.
+        '''
+        load = cls._loader(frozen)
+        return (load(result) for result in cls._all_records())
+
+    @classmethod
+    def iterkeys(cls):
+        '''
+        Returns a generator over the keys of all instances, without creating
+        the instances. With Redis or a DictDatastore the stored values are not
+        read at all.
+        '''
+        if hasattr(cls.ds, '_redis'):
+            return (_unkey(k) for k in cls._scan_redis_keys(cls.ds._redis))
+        if isinstance(cls.ds, datastore.DictDatastore):
+            collection = cls.ds._items.get(str(_key().child('_').path), {})
+            return (_unkey(k) for k in list(collection))
+        return (result['key'] for result in cls._all_records())
+
+    @classmethod
+    def _all_records(cls):
+        if datastore_read.receivers:
+            datastore_read.send(cls, keys=None)
         query = datastore.Query(_key())
         try:
-            results = cls.ds.query(query)
+            return cls.ds.query(query)
         except NotImplementedError:
-            results = cls._queryless_all()
-        return [cls(**result) for result in results]
+            return cls._queryless_all()
 
     @classmethod
     def _queryless_all(cls):
@@ -180,17 +461,39 @@ class Model(object):
         to work, so quick-and-dirty will suffice.
         '''
         if hasattr(cls.ds, '_redis'):
-            r = cls.ds._redis
-            keys = r.keys()
-            serializer = cls.ds.child_datastore.serializer
-
-            def get_value(k):
-                value = r.get(k)
-                return value if value is None else serializer.loads(value)
-            return [get_value(k) for k in keys]
+            return cls._scan_redis(cls.ds._redis,
+                                   cls.ds.child_datastore.serializer)
         else:
             raise NotImplementedError
 
+    @classmethod
+    def _scan_redis(cls, r, serializer):
+        '''
+        Yields the records stored under the NAMESPACE, walking the keyspace
+        incrementally with SCAN (rather than blocking Redis with KEYS) and
+        reading the values in batches of SCAN_BATCH_SIZE with MGET.
+        '''
+        batch = []
+        for k in cls._scan_redis_keys(r):
+            batch.append(k)
+            if len(batch) >= SCAN_BATCH_SIZE:
+                for value in cls._load_redis_batch(r, serializer, batch):
+                    yield value
+                batch = []
+        for value in cls._load_redis_batch(r, serializer, batch):
+            yield value
+
+    @staticmethod
+    def _scan_redis_keys(r):
+        return r.scan_iter(match='%s/*' % _key(), count=SCAN_BATCH_SIZE)
+
+    @staticmethod
+    def _load_redis_batch(r, serializer, keys):
+        if not keys:
+            return []
+        # Keys removed since they were scanned come back as None.
+        return [serializer.loads(v) for v in r.mget(keys) if v is not None]
+
     @classmethod
     def drop(cls):
         for m in cls.all():
@@ -198,7 +501,47 @@ class Model(object):
 
     @classmethod
     def count(cls):
-        return len(cls.ds)
+        '''
+        Returns the number of instances. Bookkeeping records share the
+        datastore, so only the keys within the NAMESPACE are counted; other
+        than with Redis or a DictDatastore (see :meth:`iterkeys`), that means
+        reading every record.
+        '''
+        return sum(1 for _ in cls.iterkeys())
+
+
+# The SWITCHBOARD_SWITCH_DEFAULTS setting last seen by switch_defaults, and
+# the index built from it.
+_switch_defaults = (None, {})
+
+
+def switch_defaults():
+    '''
+    Returns the SWITCHBOARD_SWITCH_DEFAULTS setting as a dictionary of the
+    attributes that a new switch gets, by key. The dictionary is rebuilt only
+    when the setting is replaced.
+    '''
+    global _switch_defaults
+    # Read the raw settings, rather than have a missing setting raise.
+    value = settings._state.get('SWITCHBOARD_SWITCH_DEFAULTS')
+    setting, index = _switch_defaults
+    if setting is not value:
+        index = {}
+        for key, switch_default in (value or {}).iteritems():
+            if not isinstance(switch_default, dict):
+                log.warning('Ignoring invalid default for switch "%s"', key)
+                continue
+            defaults = {}
+            is_active = switch_default.get('is_active')
+            if is_active is True:
+                defaults['status'] = GLOBAL
+            elif is_active is False:
+                defaults['status'] = DISABLED
+            defaults['label'] = switch_default.get('label')
+            defaults['description'] = switch_default.get('description')
+            index[key] = defaults
+        _switch_defaults = (value, index)
+    return index
 
 
 class Switch(Model):
@@ -229,35 +572,54 @@ class Switch(Model):
         DISABLED: 'Disabled for everyone',
     }
 
+    # The attributes every stored switch has; see from_data.
+    FIELDS = frozenset(['key', 'value', 'label', 'date_created',
+                        'date_modified', 'description', 'status'])
+    # Whether instances are never changed in place; see CompiledSwitch.
+    _frozen = False
+
     def __init__(self, *args, **kwargs):
-        if (
-            kwargs and
-            hasattr(settings, 'SWITCHBOARD_SWITCH_DEFAULTS') and
-            'key' in kwargs and
-            'status' not in kwargs
-        ):
-            key = kwargs['key']
-            switch_default = settings.SWITCHBOARD_SWITCH_DEFAULTS.get(key)
-            if switch_default is not None:
-                is_active = switch_default.get('is_active')
-                if is_active is True:
-                    kwargs['status'] = GLOBAL
-                elif is_active is False:
-                    kwargs['status'] = DISABLED
+        if 'key' in kwargs and 'status' not in kwargs:
+            defaults = switch_defaults().get(kwargs['key'])
+            if defaults is not None:
+                if 'status' in defaults:
+                    kwargs['status'] = defaults['status']
                 if not kwargs.get('label'):
-                    kwargs['label'] = switch_default.get('label')
+                    kwargs['label'] = defaults['label']
                 if not kwargs.get('description'):
-                    kwargs['description'] = switch_default.get('description')
+                    kwargs['description'] = defaults['description']
         self.value = kwargs.get('value', {})
         self.label = kwargs.get('label', '')
-        self.date_created = kwargs.get('date_created', datetime.utcnow())
-        self.date_modified = kwargs.get('date_modified', datetime.utcnow())
+        if 'date_created' in kwargs:
+            self.date_created = kwargs['date_created']
+        else:
+            self.date_created = datetime.utcnow()
+        if 'date_modified' in kwargs:
+            self.date_modified = kwargs['date_modified']
+        else:
+            self.date_modified = datetime.utcnow()
         self.description = kwargs.get('description', '')
         self.status = kwargs.get('status', DISABLED)
         # Parent constructor will handle kwargs like "key" that don't have
         # default values.
         super(Switch, self).__init__(*args, **kwargs)
 
+    @classmethod
+    def from_data(cls, data):
+        '''
+        Returns a switch made out of stored data. A complete record is taken
+        as is; defaults only apply to records missing some attributes.
+        '''
+        if cls.FIELDS.issubset(data):
+            switch = cls.__new__(cls)
+            switch.__dict__.update(data)
+        else:
+            switch = cls(**data)
+        # Compact serializers store dates as timestamps.
+        switch.date_created = _to_datetime(switch.date_created)
+        switch.date_modified = _to_datetime(switch.date_modified)
+        return switch
+
     def __unicode__(self):
         return u'%s=%s' % (self.key, self.value)
 
@@ -282,6 +644,9 @@ class Switch(Model):
         assert isinstance(condition, basestring), 'conditions must be strings'
 
         namespace = condition_set.get_namespace()
+        # Conditions are never changed in place, since they may be shared with
+        # the stored record and whoever else read it; see CompiledSwitch.
+        self.value = copy.deepcopy(self.value)
 
         if namespace not in self.value:
             self.value[namespace] = {}
@@ -318,6 +683,7 @@ class Switch(Model):
         if field_name not in self.value[namespace]:
             return
 
+        self.value = copy.deepcopy(self.value)
         conditions = self.value[namespace][field_name]
         self.value[namespace][field_name] = ([c for c in conditions
                                              if c[1] != condition])
@@ -358,10 +724,12 @@ class Switch(Model):
         if namespace not in self.value:
             return
 
+        if field_name and field_name not in self.value[namespace]:
+            return
+
+        self.value = copy.deepcopy(self.value)
         if not field_name:
             del self.value[namespace]
-        elif field_name not in self.value[namespace]:
-            return
         else:
             del self.value[namespace][field_name]
 
@@ -377,19 +745,32 @@ class Switch(Model):
         >>>     print ("%(label)s: %(field)s = %(value)s (exclude: %(exc)s)"
         >>>            % (label, field.label, value, exc)) #doctest: +SKIP
         '''
-        for condition_set in sorted(manager.get_condition_sets(),
-                                    key=lambda x: x.get_group_label()):
-            ns = condition_set.get_namespace()
-            condition_set_id = condition_set.get_id()
-            if ns in self.value:
-                group = condition_set.get_group_label()
-                for name, field in condition_set.fields.iteritems():
-                    for value in self.value[ns].get(name, []):
-                        try:
-                            yield (condition_set_id, group, field, value[1],
-                                   value[0] == EXCLUDE)
-                        except TypeError:
-                            continue
+        for entry in manager.get_catalog(self.value):
+            conditions = self.value[entry.namespace]
+            for name, field in entry.fields:
+                for value in conditions.get(name, []):
+                    try:
+                        yield (entry.id, entry.group, field, value[1],
+                               value[0] == EXCLUDE)
+                    except TypeError:
+                        continue
+
+    def compile(self, manager):
+        '''
+        Returns a :class:`CompiledSwitch` holding this switch's conditions
+        parsed against the condition sets registered with ``manager``.
+        Namespaces without a registered condition set are left out, just as
+        ``is_active`` skips them.
+        '''
+        conditions = []
+        for namespace, condition in self.value.iteritems():
+            condition_set = manager.get_condition_set_by_namespace(namespace)
+            if not condition_set:
+                continue
+            conditions.append(condition_set.compile(condition, self.key))
+        if self._frozen:
+            return CompiledSwitch(self.value, tuple(conditions))
+        return CompiledSwitch(copy.deepcopy(self.value), tuple(conditions))
 
     def get_status_label(self):
         if self.status == SELECTIVE and not self.value:
@@ -429,3 +810,115 @@ class Switch(Model):
         if last:
             data['conditions'].append(last)
         return data
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _timestamp(value):
+    '''
+    Returns a date as microseconds since the epoch; dates that are already
+    numbers are taken to be POSIX timestamps.
+    '''
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.utcoffset() is not None:
+            value = value.replace(tzinfo=None) - value.utcoffset()
+        delta = value - EPOCH
+        return ((delta.days * 86400 + delta.seconds) * 1000000 +
+                delta.microseconds)
+    return int(round(value * 1000000))
+
+
+def _to_datetime(value):
+    '''
+    Returns a stored date as a datetime; dates may be stored either as
+    datetimes or as POSIX timestamps.
+    '''
+    if isinstance(value, (int, long, float)):
+        return datetime.utcfromtimestamp(value)
+    return value
+
+
+class FrozenSwitch(object):
+    '''
+    A compact, read-only form of a :class:`Switch`, holding just what is
+    needed to check whether it is active or to display it. The snapshot and
+    the batch APIs use it, since they may hold on to many switches at once.
+    Stored dates are only turned into datetimes when asked for, and any
+    attribute that Switch doesn't define is left out.
+    '''
+    __slots__ = ('key', 'label', 'description', 'status', 'value',
+                 '_date_created', '_date_modified')
+
+    STATUS_CHOICES = Switch.STATUS_CHOICES
+    STATUS_LABELS = Switch.STATUS_LABELS
+    _frozen = True
+
+    def __init__(self, key, value, status, label='', description='',
+                 date_created=None, date_modified=None):
+        set_attr = super(FrozenSwitch, self).__setattr__
+        set_attr('key', key)
+        set_attr('value', value)
+        set_attr('status', status)
+        set_attr('label', label)
+        set_attr('description', description)
+        set_attr('_date_created', date_created)
+        set_attr('_date_modified', date_modified)
+
+    @classmethod
+    def from_data(cls, data):
+        if 'status' not in data:
+            # Let Switch work out the defaults.
+            data = Switch(**data).__dict__
+        return cls(data['key'], data.get('value', {}), data['status'],
+                   data.get('label', ''), data.get('description', ''),
+                   data.get('date_created'), data.get('date_modified'))
+
+    def __setattr__(self, attr, value):
+        raise AttributeError('%s is read-only' % self.__class__.__name__)
+
+    def __unicode__(self):  # pragma: nocover
+        return u'%s=%s' % (self.key, self.value)
+
+    def __repr__(self):  # pragma: nocover
+        return '<%s: %s>' % (self.__class__.__name__, self.key)
+
+    @property
+    def date_created(self):
+        return _to_datetime(self._date_created)
+
+    @property
+    def date_modified(self):
+        return _to_datetime(self._date_modified)
+
+    compile = Switch.__dict__['compile']
+    get_status_display = Switch.__dict__['get_status_display']
+    get_status_label = Switch.__dict__['get_status_label']
+
+
+Switch.frozen_class = FrozenSwitch
+
+
+class CompiledSwitch(object):
+    """
+    Immutable, pre-parsed form of a switch's conditions, built by
+    :meth:`Switch.compile`. ``value`` holds the conditions it was built from,
+    so a cached instance can be checked against the switch's current
+    conditions: a copy of them for a :class:`Switch`, which can be changed in
+    place, and the very same object for a :class:`FrozenSwitch`. Since
+    :class:`Switch` replaces its conditions rather than changing them in
+    place, the same conditions object, e.g. from the snapshot or shared with
+    the stored record, is recognized without comparing any conditions; other
+    ones, e.g. freshly deserialized, are compared by value.
+    """
+    __slots__ = ('value', 'conditions')
+
+    def __init__(self, value, conditions):
+        self.value = value
+        self.conditions = conditions
+
+    def is_current(self, switch):
+        value = switch.value
+        return value is self.value or value == self.value
@@ -32,6 +32,9 @@ class SwitchProxy(object):
     def clear_conditions(self, *args, **kwargs):
         return self._switch.clear_conditions(self._manager, *args, **kwargs)
 
+    def compile(self, *args, **kwargs):
+        return self._switch.compile(self._manager, *args, **kwargs)
+
     def get_active_conditions(self, *args, **kwargs):
         return self._switch.get_active_conditions(self._manager, *args,
                                                   **kwargs)
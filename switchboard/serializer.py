@@ -0,0 +1,219 @@
+"""
+switchboard.serializer
+~~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2015 Kyle Adams.
+:license: Apache License 2.0, see LICENSE for more details.
+"""
+
+from datetime import datetime, timedelta
+import json
+import pickle
+import threading
+
+try:
+    import msgpack
+except ImportError:  # pragma: nocover
+    msgpack = None
+
+from .models import (
+    CHANGE_LOG_SIZE,
+    EPOCH,
+    VERSION_KEY,
+    Switch,
+    _change_key,
+    _key,
+    _timestamp,
+)
+
+# Every record written by a Serializer starts with MAGIC, the FORMAT_VERSION
+# and the tag of the codec that encoded the rest of it, e.g. "SB1j". Pickles
+# never start with MAGIC, which is how older records are told apart.
+MAGIC = 'SB'
+FORMAT_VERSION = '1'
+
+# The kinds of records, the first item of every encoded record.
+VALUE = 0
+SWITCH = 1
+
+# Datetimes found anywhere else in a record are encoded as a mapping of this
+# key to microseconds since the epoch.
+DATETIME = '__datetime__'
+
+
+def pack_switch(data):
+    '''
+    Returns the stored attributes of a switch as a list, with the dates as
+    microseconds since the epoch and the conditions as nested lists of
+    ``[namespace, [[field, conditions], ...]]``. Any other attributes follow
+    as a dictionary.
+    '''
+    conditions = [[namespace, [[field, values]
+                               for field, values in fields.iteritems()]]
+                  for namespace, fields in data['value'].iteritems()]
+    packed = [SWITCH, data['key'], data['status'], data['label'],
+              data['description'], _timestamp(data['date_created']),
+              _timestamp(data['date_modified']), conditions]
+    extra = dict((name, value) for name, value in data.iteritems()
+                 if name not in Switch.FIELDS)
+    if extra:
+        packed.append(extra)
+    return packed
+
+
+def unpack_switch(packed):
+    '''
+    Returns the attributes of a switch packed by ``pack_switch``. Dates are
+    left as POSIX timestamps, which :class:`~switchboard.models.Switch` and
+    :class:`~switchboard.models.FrozenSwitch` turn into datetimes.
+    '''
+    (_, key, status, label, description, date_created, date_modified,
+     conditions) = packed[:8]
+    value = dict((namespace, dict((field, values) for field, values in fields))
+                 for namespace, fields in conditions)
+    data = dict(packed[8]) if len(packed) > 8 else {}
+    data.update({
+        'key': key,
+        'value': value,
+        'status': status,
+        'label': label,
+        'description': description,
+        'date_created': (None if date_created is None
+                         else date_created / 1000000.0),
+        'date_modified': (None if date_modified is None
+                          else date_modified / 1000000.0),
+    })
+    return data
+
+
+def _is_switch(value):
+    return (isinstance(value, dict) and Switch.FIELDS.issubset(value) and
+            isinstance(value['value'], dict))
+
+
+def _encode_datetime(value):
+    if isinstance(value, datetime):
+        return {DATETIME: _timestamp(value)}
+    raise TypeError('%r is not serializable' % (value,))
+
+
+def _decode_datetime(value):
+    if len(value) == 1 and DATETIME in value:
+        return EPOCH + timedelta(microseconds=value[DATETIME])
+    return value
+
+
+def _json_dumps(value):
+    return json.dumps(value, separators=(',', ':'), default=_encode_datetime)
+
+
+def _json_loads(data):
+    return json.loads(data, object_hook=_decode_datetime)
+
+
+def _msgpack_dumps(value):
+    return msgpack.packb(value, use_bin_type=True, default=_encode_datetime)
+
+
+def _msgpack_loads(data):
+    return msgpack.unpackb(data, raw=False, object_hook=_decode_datetime)
+
+
+# The codecs a record may be encoded with, by tag.
+CODECS = {
+    'j': (_json_dumps, _json_loads),
+    'm': (_msgpack_dumps, _msgpack_loads),
+}
+
+
+class Serializer(object):
+    '''
+    Serializes the records Switchboard stores, for use with datastores that
+    take a serializer, e.g.::
+
+        ds = datastore.serialize.shim(ds_child, Serializer())
+
+    Switches are stored as compact lists rather than as dictionaries, and
+    their dates as integers. ``codec`` is the tag of the encoding to write
+    with: ``'m'`` for MessagePack, the default when the msgpack library is
+    installed, or ``'j'`` for compact JSON. Records written with either codec
+    can be read back, as long as the library is installed.
+
+    Records that weren't written by a Serializer are refused, since unpickling
+    data can run arbitrary code. Pass e.g. ``legacy=pickle`` to read them with
+    that module instead; :func:`migrate` does so while it runs.
+    '''
+    def __init__(self, codec=None, legacy=None):
+        if codec is None:
+            codec = 'j' if msgpack is None else 'm'
+        if codec not in CODECS:
+            raise ValueError('Unknown codec: %s' % codec)
+        if codec == 'm' and msgpack is None:
+            raise ValueError('The msgpack library is not installed')
+        self.codec = codec
+        self.legacy = legacy
+        self.header = MAGIC + FORMAT_VERSION + codec
+        self.encode = CODECS[codec][0]
+
+    def dumps(self, value):
+        if _is_switch(value):
+            record = pack_switch(value)
+        else:
+            record = [VALUE, value]
+        return self.header + self.encode(record)
+
+    def loads(self, data):
+        if not data.startswith(MAGIC):
+            legacy = self.legacy or getattr(_migrating, 'legacy', None)
+            if legacy is None:
+                raise ValueError('Not a Switchboard record')
+            return legacy.loads(data)
+        header = data[:len(self.header)]
+        tag = header[-1]
+        if header[len(MAGIC):-1] != FORMAT_VERSION or tag not in CODECS:
+            raise ValueError('Unsupported record format: %s' % header)
+        if tag == 'm' and msgpack is None:
+            raise ValueError('The msgpack library is not installed')
+        record = CODECS[tag][1](data[len(header):])
+        if record[0] == SWITCH:
+            return unpack_switch(record)
+        return record[1]
+
+
+_default = Serializer()
+# Holds the legacy serializer of a running migrate(), for the Serializers
+# of its thread.
+_migrating = threading.local()
+# The module itself can be passed wherever a serializer is expected, just
+# like the json or pickle modules.
+dumps = _default.dumps
+loads = _default.loads
+
+
+def migrate(model=Switch, legacy=pickle):
+    '''
+    Rewrites every record of ``model``, along with the bookkeeping records,
+    so that they are stored in the current format of the serializer of the
+    model's datastore; typically to move a datastore from pickle to a
+    :class:`Serializer`. While it runs, Serializers read the records they
+    didn't write with ``legacy``. Versions and signals are left alone.
+    Returns the number of models rewritten.
+    '''
+    ds = model.ds
+    count = 0
+    _migrating.legacy = legacy
+    try:
+        for data in model._all_records():
+            ds.put(_key(data['key']), data)
+            count += 1
+        for slot in xrange(CHANGE_LOG_SIZE):
+            change = ds.get(_change_key(slot))
+            if change is not None:
+                ds.put(_change_key(slot), change)
+        # With Redis, the version isn't serialized; see Model.get_version.
+        version = None if hasattr(ds, '_redis') else ds.get(VERSION_KEY)
+        if version is not None:
+            ds.put(VERSION_KEY, version)
+    finally:
+        _migrating.legacy = None
+    return count
@@ -71,3 +71,58 @@ switch_condition_removed = signal('switch_condition_removed')
 #: This signal provides an easy, standard way for various frameworks to notify
 #: Switchboard that a request has finished
 request_finished = signal('request_finished')
+
+# The signals below instrument the checks and reads Switchboard makes. They
+# are only sent, and the work behind them only done, while something is
+# connected to them.
+
+#: This signal is sent after a switch is checked by ``is_active``,
+#: ``are_active`` or ``active_switches``, with the switch key as the sender.
+#: ``duration`` is the time the check took, in seconds; for nested keys it
+#: includes checking the parents.
+#:
+#: Example subscriber::
+#:
+#:      def switch_checked_callback(key, result, duration):
+#:          statsd.timing('switchboard.%s' % key, duration * 1000)
+#:
+#:      from switchboard.signals import switch_checked
+#:      switch_checked.connect(switch_checked_callback)
+switch_checked = signal('switch_checked')
+
+#: This signal is sent whenever ``is_active`` looks up the request's result
+#: cache, with the switch key as the sender and whether a result was found.
+#:
+#: Example subscriber::
+#:
+#:      def result_cache_checked_callback(key, hit):
+#:          statsd.incr('switchboard.cache.%s' % ('hit' if hit else 'miss'))
+#:
+#:      from switchboard.signals import result_cache_checked
+#:      result_cache_checked.connect(result_cache_checked_callback)
+result_cache_checked = signal('result_cache_checked')
+
+#: This signal is sent after the conditions of a switch for one condition set
+#: are checked, with the condition set's namespace as the sender.
+#:
+#: Example subscriber::
+#:
+#:      def condition_set_checked_callback(namespace, key, result, duration):
+#:          statsd.timing('switchboard.ns.%s' % namespace, duration * 1000)
+#:
+#:      from switchboard.signals import condition_set_checked
+#:      condition_set_checked.connect(condition_set_checked_callback)
+condition_set_checked = signal('condition_set_checked')
+
+#: This signal is sent whenever models are read from the datastore, with the
+#: model class as the sender. ``keys`` holds the keys read, or is ``None``
+#: when all models are read.
+#:
+#: Example subscriber::
+#:
+#:      def datastore_read_callback(model, keys):
+#:          statsd.incr('switchboard.reads')
+#:
+#:      from switchboard.signals import datastore_read
+#:      datastore_read.connect(datastore_read_callback)
+datastore_read = signal('datastore_read')
@@ -0,0 +1,302 @@
+"""
+switchboard.tests.admin.test_admin
+~~~~~~~~~~~~~~~
+
+:copyright: (c) 2015 Kyle Adams.
+:license: Apache License 2.0, see LICENSE for more details.
+"""
+
+import json
+from StringIO import StringIO
+
+from mock import Mock, patch
+from nose.tools import (
+    assert_equals,
+    assert_false,
+    assert_raises,
+    assert_true,
+)
+from webob import Request
+from webob.exc import HTTPNotFound
+
+from switchboard.admin import app, listing_etag
+from switchboard.models import (
+    Switch,
+    DISABLED, GLOBAL, SELECTIVE,
+    EXCLUDE, INCLUDE,
+)
+from switchboard import signals
+import switchboard.builtins  # noqa: registers the condition sets used below
+
+IP_CONDITION_SET = 'switchboard.builtins.IPAddressConditionSet'
+
+
+def post_batch(operations):
+    req = Request.blank('/batch', method='POST',
+                        content_type='application/json',
+                        body=json.dumps(operations))
+    return json.loads(req.get_response(app).body)
+
+
+class TestBatch(object):
+
+    def setup(self):
+        Switch.create(key='foo', status=DISABLED)
+        Switch.create(key='bar', status=SELECTIVE, value={
+            'ip': {'ip_address': [[INCLUDE, '10.0.0.2']]},
+        })
+
+    def teardown(self):
+        Switch.drop()
+
+    def test_batch(self):
+        result = post_batch([
+            dict(op='add', key='baz', label='Baz'),
+            dict(op='status', key='foo', status=GLOBAL),
+            dict(op='add_condition', key='foo', id=IP_CONDITION_SET,
+                 field='ip_address', ip_address='10.0.0.1'),
+            dict(op='remove_condition', key='bar', id=IP_CONDITION_SET,
+                 field='ip_address', value='10.0.0.2'),
+        ])
+        assert_true(result['success'])
+        assert_equals(sorted(result['data']), sorted([
+            dict(key='baz', status=DISABLED),
+            dict(key='foo', status=GLOBAL),
+            dict(key='bar', status=SELECTIVE),
+        ]))
+        assert_equals(Switch.get('baz').label, 'Baz')
+        foo = Switch.get('foo')
+        assert_equals(foo.status, GLOBAL)
+        assert_equals(foo.value, {'ip': {'ip_address': [[INCLUDE,
+                                                         '10.0.0.1']]}})
+        assert_equals(Switch.get('bar').value, {})
+
+    def test_single_write(self):
+        with patch('switchboard.models.Model.bump_version') as bump_version:
+            post_batch([
+                dict(op='status', key='foo', status=GLOBAL),
+                dict(op='status', key='bar', status=GLOBAL),
+            ])
+        assert_equals(bump_version.call_count, 1)
+
+    def test_signals_once_per_switch(self):
+        sent = []
+
+        def record(switch):
+            sent.append(switch.key)
+        with signals.switch_condition_added.connected_to(record):
+            post_batch([
+                dict(op='add_condition', key='foo', id=IP_CONDITION_SET,
+                     field='ip_address', ip_address='10.0.0.1'),
+                dict(op='add_condition', key='foo', id=IP_CONDITION_SET,
+                     field='ip_address', ip_address='10.0.0.3'),
+            ])
+        assert_equals(sent, ['foo'])
+
+    def test_unchanged(self):
+        result = post_batch([dict(op='status', key='foo', status=DISABLED)])
+        assert_equals(result['data'], [])
+
+    def test_invalid(self):
+        result = post_batch([
+            dict(op='status', key='foo', status=GLOBAL),
+            dict(op='add_condition', key='foo', id=IP_CONDITION_SET,
+                 field='ip_address', ip_address='not an ip'),
+        ])
+        assert_false(result['success'])
+        assert_true(result['data'].startswith('Operation 1: '))
+        # Nothing was saved.
+        assert_equals(Switch.get('foo').status, DISABLED)
+
+    def test_invalid_after_condition(self):
+        result = post_batch([
+            dict(op='add_condition', key='foo', id=IP_CONDITION_SET,
+                 field='ip_address', ip_address='10.0.0.1'),
+            dict(op='remove_condition', key='bar', id=IP_CONDITION_SET,
+                 field='ip_address', value='10.0.0.2'),
+            dict(op='status', key='foo', status='bogus'),
+        ])
+        assert_equals(result['data'], 'Operation 2: Status must be integer')
+        assert_equals(Switch.get('foo').value, {})
+        assert_equals(Switch.get('bar').value,
+                      {'ip': {'ip_address': [[INCLUDE, '10.0.0.2']]}})
+
+    def test_missing_switch(self):
+        result = post_batch([dict(op='status', key='missing', status=GLOBAL)])
+        assert_equals(result, dict(
+            success=False,
+            data='Operation 0: Switch with key missing does not exist',
+        ))
+
+    def test_unknown_operation(self):
+        result = post_batch([dict(op='explode', key='foo')])
+        assert_equals(result['data'],
+                      'Operation 0: Unknown operation: explode')
+
+    def test_not_a_list(self):
+        result = post_batch(dict(op='status', key='foo', status=GLOBAL))
+        assert_false(result['success'])
+
+    def test_malformed_json(self):
+        req = Request.blank('/batch', method='POST',
+                            content_type='application/json', body='[{')
+        result = json.loads(req.get_response(app).body)
+        assert_equals(result, dict(success=False,
+                                   data='Operations must be valid JSON'))
+
+    def test_key_not_a_string(self):
+        result = post_batch([dict(op='status', key=5, status=GLOBAL)])
+        assert_equals(result['data'], 'Operation 0: Key must be a string')
+        result = post_batch([dict(op='update', key='foo', curkey=['bar'])])
+        assert_equals(result['data'], 'Operation 0: Curkey must be a string')
+
+    def test_label_not_a_string(self):
+        result = post_batch([dict(op='add', key='baz', label=5)])
+        assert_equals(result['data'], 'Operation 0: Label must be a string')
+
+    def test_numeric_field_values(self):
+        result = post_batch([
+            dict(op='add_condition', key='foo', id=IP_CONDITION_SET,
+                 field='percent', **{'percent[min]': 0, 'percent[max]': 50}),
+        ])
+        assert_true(result['success'])
+        assert_equals(Switch.get('foo').value,
+                      {'ip': {'percent': [[INCLUDE, '0-50']]}})
+
+    def test_field_value_not_a_string(self):
+        result = post_batch([
+            dict(op='add_condition', key='foo', id=IP_CONDITION_SET,
+                 field='ip_address', ip_address=['10.0.0.1']),
+        ])
+        assert_equals(result['data'], 'Operation 0: ip_address must be a '
+                      'string or a number')
+
+    def test_exclude(self):
+        post_batch([
+            dict(op='add_condition', key='foo', id=IP_CONDITION_SET,
+                 field='ip_address', ip_address='10.0.0.1', exclude='0'),
+            dict(op='add_condition', key='foo', id=IP_CONDITION_SET,
+                 field='ip_address', ip_address='10.0.0.3', exclude='1'),
+        ])
+        assert_equals(Switch.get('foo').value, {'ip': {'ip_address': [
+            [INCLUDE, '10.0.0.1'], [EXCLUDE, '10.0.0.3']]}})
+
+    def test_invalid_exclude(self):
+        result = post_batch([
+            dict(op='add_condition', key='foo', id=IP_CONDITION_SET,
+                 field='ip_address', ip_address='10.0.0.1', exclude='no'),
+        ])
+        assert_equals(result['data'], 'Operation 0: Exclude must be integer')
+
+    def test_update(self):
+        updated = []
+        with signals.switch_updated.connected_to(
+                lambda switch: updated.append(switch.key)):
+            result = post_batch([
+                dict(op='update', key='foo', label='Foo', description='New'),
+                dict(op='update', curkey='bar', key='baz', label='Baz'),
+                dict(op='status', key='baz', status=GLOBAL),
+            ])
+        assert_true(result['success'])
+        assert_equals(sorted(updated), ['baz', 'foo'])
+        foo = Switch.get('foo')
+        assert_equals((foo.label, foo.description), ('Foo', 'New'))
+        assert_equals(Switch.get('bar'), None)
+        baz = Switch.get('baz')
+        assert_equals((baz.label, baz.status), ('Baz', GLOBAL))
+        assert_equals(baz.value, {'ip': {'ip_address': [[INCLUDE,
+                                                         '10.0.0.2']]}})
+
+    def test_update_existing_key(self):
+        result = post_batch([dict(op='update', curkey='bar', key='foo')])
+        assert_equals(result['data'],
+                      'Operation 0: Switch with key foo already exists')
+        assert_true(Switch.get('bar'))
+
+    def test_delete(self):
+        deleted = []
+        with signals.switch_deleted.connected_to(
+                lambda switch: deleted.append(switch.key)):
+            result = post_batch([
+                dict(op='status', key='foo', status=GLOBAL),
+                dict(op='delete', key='foo'),
+                dict(op='add', key='qux'),
+                dict(op='delete', key='qux'),
+            ])
+        assert_equals(result, dict(success=True, data=[]))
+        assert_equals(deleted, ['foo'])
+        assert_equals(sorted(s.key for s in Switch.all()), ['bar'])
+
+    def test_delete_missing(self):
+        result = post_batch([dict(op='delete', key='missing')])
+        assert_equals(result['data'],
+                      'Operation 0: Switch with key missing does not exist')
+
+
+class TestConditionalListing(object):
+
+    def setup(self):
+        Switch.create(key='foo', status=DISABLED)
+
+    def teardown(self):
+        Switch.drop()
+
+    def get(self, url, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        return Request.blank(url, headers=headers).get_response(app)
+
+    def test_switches(self):
+        resp = self.get('/switches')
+        assert_equals(resp.status_int, 200)
+        data = json.loads(resp.body)['data']
+        assert_equals([s['key'] for s in data], ['foo'])
+
+    def test_not_modified(self):
+        for url in ('/', '/switches'):
+            etag = self.get(url).headers['ETag']
+            with patch('switchboard.models.Model.get_many') as get_many:
+                with patch('switchboard.models.Model.iterall') as iterall:
+                    resp = self.get(url, etag)
+            assert_equals(resp.status_int, 304)
+            assert_equals(resp.headers['ETag'], etag)
+            assert_false(get_many.called)
+            assert_false(iterall.called)
+
+    def test_stable_etag(self):
+        # The same across processes, whatever their hash seed.
+        with patch('switchboard.admin.operator.get_catalog',
+                   return_value=[Mock(id='a.B'), Mock(id='c.D')]):
+            etag = listing_etag()
+        assert_equals(etag, '"%s-75fb1e1a"' % Switch.get_version())
+
+    def test_modified(self):
+        etag = self.get('/switches').headers['ETag']
+        Switch.create(key='bar')
+        resp = self.get('/switches', etag)
+        assert_equals(resp.status_int, 200)
+        assert_true(resp.headers['ETag'] != etag)
+        data = json.loads(resp.body)['data']
+        assert_equals([s['key'] for s in data], ['bar', 'foo'])
+
+
+class TestIndexPages(object):
+
+    def setup(self):
+        Switch.create(key='foo', status=DISABLED)
+
+    def teardown(self):
+        Switch.drop()
+
+    def get(self, url):
+        # Keeps bottle from printing the traceback of the raised errors.
+        environ = {'wsgi.errors': StringIO()}
+        return Request.blank(url, environ).get_response(app)
+
+    def test_first_page(self):
+        assert_equals(self.get('/?page=1').status_int, 200)
+
+    def test_page_past_end(self):
+        assert_raises(HTTPNotFound, self.get, '/?page=2')
+
+    def test_page_before_start(self):
+        assert_raises(HTTPNotFound, self.get, '/?page=0')
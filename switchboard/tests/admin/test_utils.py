@@ -7,6 +7,7 @@ switchboard.tests.admin.test_utils
 """
 
 from datetime import datetime
+import json
 
 from mock import patch
 from nose.tools import assert_equals, assert_true, raises
@@ -14,12 +15,24 @@ from nose.tools import assert_equals, assert_true, raises
 from switchboard.admin.utils import (
     SwitchboardException,
     json_api,
+    json_response,
     valid_sort_orders,
 )
 from switchboard.conditions import Invalid
 from switchboard.settings import settings
 
 
+def decode(response):
+    assert_equals(response.content_type, 'application/json')
+    return json.loads(response.body)
+
+
+def test_json_response():
+    response = json_response(dict(foo=['bar', 1]))
+    assert_equals(response.status_code, 200)
+    assert_equals(decode(response), dict(foo=['bar', 1]))
+
+
 def test_json_api_success():
     data = dict(foo='bar')
 
@@ -27,7 +40,7 @@ def test_json_api_success():
     def tester():
         return data
 
-    assert_equals(tester(), dict(success=True, data=data))
+    assert_equals(decode(tester()), dict(success=True, data=data))
 
 
 def test_json_api_switchboard_exception():
@@ -35,7 +48,7 @@ def test_json_api_switchboard_exception():
     def tester():
         raise SwitchboardException('Boom!')
 
-    assert_equals(tester(), dict(success=False, data='Boom!'))
+    assert_equals(decode(tester()), dict(success=False, data='Boom!'))
 
 
 def test_json_api_value_error():
@@ -43,7 +56,8 @@ def test_json_api_value_error():
     def tester():
         raise ValueError
 
-    assert_equals(tester(), dict(success=False, data='Switch cannot be found'))
+    assert_equals(decode(tester()),
+                  dict(success=False, data='Switch cannot be found'))
 
 
 def test_json_api_invalid():
@@ -51,7 +65,7 @@ def test_json_api_invalid():
     def tester():
         raise Invalid('Boom!')
 
-    assert_equals(tester(), dict(success=False, data='Boom!'))
+    assert_equals(decode(tester()), dict(success=False, data='Boom!'))
 
 
 @raises(Exception)
@@ -85,7 +99,7 @@ def test_json_api_datetime():
     def tester():
         return dict(now=now)
 
-    assert_equals(tester(), dict(
+    assert_equals(decode(tester()), dict(
         success=True,
         data=dict(now=now.isoformat())
     ))
@@ -101,7 +115,7 @@ def test_json_api_object():
     def tester():
         return dict(foobar=foobar)
 
-    assert_equals(tester(), dict(
+    assert_equals(decode(tester()), dict(
         success=True,
         data=dict(foobar='foobar')
     ))
@@ -134,6 +134,18 @@ class TestModelDict(object):
         for key in mydict.iterkeys():
             assert_equals(key, mydict[key].key)
 
+    def test_iterkeys_without_values(self):
+        mydict = ModelDict(MockModel)
+        mydict['1'] = MockModel(key='1', value='foo1')
+        with patch('switchboard.models.Model.iterall') as iterall:
+            assert_equals(list(mydict.iterkeys()), ['1'])
+            assert_false(iterall.called)
+
+    def test_iterkeys_custom_key(self):
+        mydict = ModelDict(MockModel, key='value')
+        mydict['1'] = MockModel(key='1', value='foo1')
+        assert_equals(list(mydict.iterkeys()), ['foo1'])
+
     def test_itervalues(self):
         mydict = ModelDict(MockModel)
         mydict['1'] = MockModel(key='1', value='foo1')
@@ -21,9 +21,12 @@ from ..builtins import (
     HostConditionSet,
     IPAddress,
     IPAddressConditionSet,
+    IPNetwork,
+    PrefixTrie,
     QueryStringConditionSet,
+    internal_ips,
 )
-from ..conditions import Invalid
+from ..conditions import Invalid, hashed_percentile
 from ..models import Switch, SELECTIVE
 from ..settings import settings
 
@@ -47,6 +50,91 @@ class TestIPAddress(object):
         self.ip.clean('foobar')
 
 
+class TestPrefixTrie(object):
+    def test_ipv4(self):
+        trie = PrefixTrie(['10.0.0.0/8', '192.168.1.0/24', '172.16.0.1'])
+        assert_true('10.1.2.3' in trie)
+        assert_true('192.168.1.255' in trie)
+        assert_true('172.16.0.1' in trie)
+        assert_false('11.0.0.1' in trie)
+        assert_false('192.168.2.1' in trie)
+        assert_false('172.16.0.2' in trie)
+
+    def test_ipv6(self):
+        trie = PrefixTrie(['2001:db8::/32', '10.0.0.0/8'])
+        assert_true('2001:db8::1' in trie)
+        assert_false('2001:db9::1' in trie)
+        assert_false('::a00:1' in trie)
+
+    def test_nested_networks(self):
+        trie = PrefixTrie(['10.1.0.0/16', '10.0.0.0/8', '10.2.3.0/24'])
+        assert_true('10.1.0.1' in trie)
+        assert_true('10.3.0.1' in trie)
+
+    def test_everything(self):
+        trie = PrefixTrie(['0.0.0.0/0'])
+        assert_true('1.2.3.4' in trie)
+        assert_false('::1' in trie)
+
+    def test_invalid_address(self):
+        trie = PrefixTrie(['0.0.0.0/0'])
+        assert_false('foobar' in trie)
+        assert_false(None in trie)
+
+    @raises(ValueError)
+    def test_invalid_network(self):
+        PrefixTrie(['foobar'])
+
+
+class TestIPNetwork(object):
+    def setup(self):
+        self.field = IPNetwork()
+
+    def test_is_active(self):
+        assert_true(self.field.is_active('10.0.0.0/8', '10.0.0.1'))
+        assert_false(self.field.is_active('10.0.0.0/8', '11.0.0.1'))
+
+    def test_compile_many(self):
+        predicates = self.field.compile_many(['10.0.0.0/8', '2001:db8::/32'])
+        assert_equals(len(predicates), 1)
+        assert_true(predicates[0]('10.0.0.1'))
+        assert_true(predicates[0]('2001:db8::1'))
+        assert_false(predicates[0]('11.0.0.1'))
+        assert_equals(self.field.compile_many([]), [])
+
+    def test_clean(self):
+        assert_equals(self.field.clean('10.1.2.3/8'), '10.0.0.0/8')
+        assert_equals(self.field.clean('10.1.2.3'), '10.1.2.3/32')
+
+    @raises(Invalid)
+    def test_clean_invalid(self):
+        self.field.clean('10.0.0.0/33')
+
+
+class TestInternalIPs(object):
+    def test_list(self):
+        settings.SWITCHBOARD_INTERNAL_IPS = ['10.0.0.0/8', '192.168.0.1']
+        assert_true('10.0.0.1' in internal_ips())
+        assert_true('192.168.0.1' in internal_ips())
+        assert_false('192.168.0.2' in internal_ips())
+
+    def test_string(self):
+        settings.SWITCHBOARD_INTERNAL_IPS = '10.0.0.0/8, 192.168.0.1'
+        assert_true('10.0.0.1' in internal_ips())
+        assert_true('192.168.0.1' in internal_ips())
+
+    def test_invalid(self):
+        settings.SWITCHBOARD_INTERNAL_IPS = ['foobar', '10.0.0.0/8']
+        assert_true('10.0.0.1' in internal_ips())
+
+    def test_built_once(self):
+        settings.SWITCHBOARD_INTERNAL_IPS = ['10.0.0.0/8']
+        trie = internal_ips()
+        assert_true(internal_ips() is trie)
+        settings.SWITCHBOARD_INTERNAL_IPS = ['10.0.0.0/8']
+        assert_false(internal_ips() is trie)
+
+
 class TestIPAddressConditionSet(object):
     def setup(self):
         self.cs = 'switchboard.builtins.IPAddressConditionSet'
@@ -88,6 +176,60 @@ class TestIPAddressConditionSet(object):
         )
         assert_true(self.operator.is_active('test', req))
 
+    def test_hashed_percent(self):
+        Switch.create(key='test', status=SELECTIVE)
+        switch = self.operator['test']
+        req = Request.blank('', environ=dict(REMOTE_ADDR=self.ip))
+        percentile = hashed_percentile(self.ip, 'test:')
+        switch.add_condition(
+            condition_set=self.cs,
+            field_name='hashed_percent',
+            condition='%s-%s' % (percentile, percentile),
+        )
+        assert_true(self.operator.is_active('test', req))
+        switch.clear_conditions(condition_set=self.cs)
+        switch.add_condition(
+            condition_set=self.cs,
+            field_name='hashed_percent',
+            condition='%s-%s' % ((percentile + 1) % 100,
+                                 (percentile + 1) % 100),
+        )
+        assert_false(self.operator.is_active('test', req))
+
+    def test_ip_network(self):
+        Switch.create(
+            key='test',
+            status=SELECTIVE
+        )
+        switch = self.operator['test']
+        req = Request.blank('', environ=dict(REMOTE_ADDR=self.ip))
+        assert_false(self.operator.is_active('test', req))
+        switch.add_condition(
+            condition_set=self.cs,
+            field_name='ip_network',
+            condition='192.168.0.0/16',
+        )
+        assert_true(self.operator.is_active('test', req))
+        req = Request.blank('', environ=dict(REMOTE_ADDR='10.0.0.1'))
+        assert_false(self.operator.is_active('test', req))
+
+    def test_internal_ip_network(self):
+        Switch.create(
+            key='test',
+            status=SELECTIVE
+        )
+        switch = self.operator['test']
+        settings.SWITCHBOARD_INTERNAL_IPS = ['192.168.0.0/16']
+        switch.add_condition(
+            condition_set=self.cs,
+            field_name='internal_ip',
+            condition='',
+        )
+        req = Request.blank('', environ=dict(REMOTE_ADDR=self.ip))
+        assert_true(self.operator.is_active('test', req))
+        req = Request.blank('', environ=dict(REMOTE_ADDR='10.0.0.1'))
+        assert_false(self.operator.is_active('test', req))
+
     def test_internal_ip(self):
         ip = '192.168.0.1'
         switch = Switch.create(
@@ -0,0 +1,155 @@
+"""
+switchboard.tests.test_cache
+~~~~~~~~~~~~~~~
+
+:copyright: (c) 2015 Kyle Adams.
+:license: Apache License 2.0, see LICENSE for more details.
+"""
+
+from mock import patch
+from nose.tools import (
+    assert_equals,
+    assert_false,
+    assert_true,
+)
+
+from ..cache import MIN_MAX_AGE, ResultCache, Snapshot
+from ..models import Switch, VERSION_KEY, _key
+
+
+class TestSnapshot(object):
+    def setup(self):
+        Switch.create(key='foo', label='Foo')
+        self.snapshot = Snapshot(Switch, timeout=60)
+
+    def teardown(self):
+        Switch.snapshot = None
+        Switch.drop()
+
+    def test_get(self):
+        assert_equals(self.snapshot.get('foo').label, 'Foo')
+        assert_equals(self.snapshot.get('bar'), None)
+        assert_equals(self.snapshot.get('bar', 'baz'), 'baz')
+
+    def test_contains(self):
+        assert_true('foo' in self.snapshot)
+        assert_false('bar' in self.snapshot)
+
+    def test_lookups_are_served_from_memory(self):
+        self.snapshot.get('foo')
+        with patch('switchboard.models.Model.iterall') as all_:
+            with patch('switchboard.models.Model.get_version') as version:
+                self.snapshot.get('foo')
+                self.snapshot.get('bar')
+                assert_false(version.called)
+                assert_false(all_.called)
+
+    def test_reload_on_version_change(self):
+        self.snapshot.get('foo')
+        # Simulate a write from another process, which doesn't expire the
+        # snapshot but does move the version forward.
+        Switch.ds.put(_key('bar'), dict(key='bar'))
+        Switch.bump_version(['bar'])
+        assert_false('bar' in self.snapshot)
+        self.snapshot.expire()
+        with patch('switchboard.models.Model.iterall') as all_:
+            assert_true('bar' in self.snapshot)
+            assert_false(all_.called)
+
+    def test_reload_removed(self):
+        self.snapshot.get('foo')
+        Switch.ds.delete(_key('foo'))
+        Switch.bump_version(['foo'])
+        self.snapshot.expire()
+        assert_false('foo' in self.snapshot)
+
+    def test_full_reload_without_log(self):
+        self.snapshot.get('foo')
+        Switch.ds.put(_key('bar'), dict(key='bar'))
+        Switch.ds.put(VERSION_KEY, Switch.get_version() + 1)
+        self.snapshot.expire()
+        assert_true('bar' in self.snapshot)
+
+    def test_full_reload_max_age(self):
+        self.snapshot.max_age = 0
+        self.snapshot.get('foo')
+        Switch.ds.put(_key('bar'), dict(key='bar'))
+        Switch.bump_version()
+        self.snapshot.expire()
+        assert_true('bar' in self.snapshot)
+
+    def test_full_reload_max_age_same_version(self):
+        # A change the log missed still shows up once max_age passes.
+        self.snapshot.get('foo')
+        Switch.ds.put(_key('bar'), dict(key='bar'))
+        self.snapshot.expire()
+        assert_false('bar' in self.snapshot)
+        self.snapshot.max_age = 0
+        self.snapshot.expire()
+        assert_true('bar' in self.snapshot)
+
+    def test_max_age_default(self):
+        assert_equals(self.snapshot.max_age, 120)
+
+    def test_max_age_default_short_timeout(self):
+        snapshot = Snapshot(Switch, timeout=0)
+        assert_equals(snapshot.max_age, MIN_MAX_AGE)
+        snapshot.get('foo')
+        with patch('switchboard.models.Model.iterall') as all_:
+            snapshot.get('foo')
+            assert_false(all_.called)
+
+    def test_no_reload_without_version_change(self):
+        self.snapshot.get('foo')
+        self.snapshot.expire()
+        with patch('switchboard.models.Model.iterall') as all_:
+            self.snapshot.get('foo')
+            assert_false(all_.called)
+
+    def test_timeout(self):
+        self.snapshot.timeout = 0
+        self.snapshot.get('foo')
+        with patch('switchboard.models.Model.get_version') as version:
+            self.snapshot.get('foo')
+            assert_true(version.called)
+
+    def test_local_writes_expire(self):
+        Switch.snapshot = self.snapshot
+        self.snapshot.get('foo')
+        Switch.create(key='bar')
+        assert_true('bar' in self.snapshot)
+        Switch.remove('bar')
+        assert_false('bar' in self.snapshot)
+
+
+class TestResultCache(object):
+    def setup(self):
+        self.cache = ResultCache(size=2)
+
+    def test_get(self):
+        self.cache['foo'] = None
+        assert_equals(self.cache.get('foo', 'missing'), None)
+        assert_equals(self.cache.get('bar', 'missing'), 'missing')
+        assert_equals(self.cache.hits, 1)
+        assert_equals(self.cache.misses, 1)
+
+    def test_evicts_least_recently_used(self):
+        self.cache['foo'] = True
+        self.cache['bar'] = True
+        self.cache.get('foo')
+        self.cache['baz'] = True
+        assert_equals(len(self.cache), 2)
+        assert_true('foo' in self.cache)
+        assert_false('bar' in self.cache)
+        assert_true('baz' in self.cache)
+
+    def test_replace(self):
+        self.cache['foo'] = True
+        self.cache['foo'] = False
+        assert_equals(len(self.cache), 1)
+        assert_false(self.cache.get('foo'))
+
+    def test_clear(self):
+        self.cache['foo'] = True
+        self.cache.clear()
+        assert_equals(len(self.cache), 0)
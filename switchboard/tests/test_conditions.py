@@ -7,6 +7,7 @@ switchboard.tests.test_conditions
 """
 
 import datetime
+import re
 
 from mock import Mock, patch
 from nose.tools import (
@@ -17,13 +18,17 @@ from nose.tools import (
 )
 from webob import Request
 
+from .. import conditions
 from ..conditions import (
     AbstractDate,
     BeforeDate,
     Boolean,
     Choice,
+    CompiledCondition,
     ConditionSet,
     Field,
+    HashedModelConditionSet,
+    HashedPercent,
     Invalid,
     ModelConditionSet,
     OnOrAfterDate,
@@ -31,6 +36,8 @@ from ..conditions import (
     Range,
     Regex,
     RequestConditionSet,
+    UncompiledCondition,
+    hashed_percentile,
     titlize,
 )
 from ..models import INCLUDE, EXCLUDE
@@ -55,6 +62,11 @@ class TestField(object):
         assert_true(self.field.is_active('foo', 'foo'))
         assert_false(self.field.is_active('foo', 'bar'))
 
+    def test_compile(self):
+        is_active = self.field.compile('foo')
+        assert_true(is_active('foo'))
+        assert_false(is_active('bar'))
+
     def test_validate_valid_string(self):
         self.field.name = 'foo'
         assert_equals(self.field.validate(dict(foo='bar')), 'bar')
@@ -160,6 +172,16 @@ class TestPercent(object):
         assert_false(self.field.is_active('0-50', -1))
         assert_false(self.field.is_active('0-50', 51))
 
+    def test_is_active_mod(self):
+        assert_true(self.field.is_active('0-50', 125))
+        assert_false(self.field.is_active('0-50', 175))
+
+    def test_compile(self):
+        is_active = self.field.compile('0-50')
+        assert_true(is_active(25))
+        assert_true(is_active(150))
+        assert_false(is_active(51))
+
     def test_display(self):
         assert_equals(self.field.display('0-50'), 'Foo: 50% (0-50)')
 
@@ -181,6 +203,48 @@ class TestPercent(object):
             assert_true('less than' in e.message)
 
 
+class TestHashedPercent(object):
+    def setup(self):
+        self.field = HashedPercent()
+
+    def test_hashed_percentile(self):
+        assert_equals(hashed_percentile('foo'), hashed_percentile('foo'))
+        assert_equals(hashed_percentile(42), hashed_percentile('42'))
+        assert_equals(hashed_percentile(u'\xe9'),
+                      hashed_percentile('\xc3\xa9'))
+        assert_true(0 <= hashed_percentile('foo', 'bar:') < 100)
+
+    def test_distribution(self):
+        active = self.field.compile('0-9', 'my_switch')
+        hits = len(filter(active, xrange(10000)))
+        assert_true(900 < hits < 1100, hits)
+
+    def test_compile_salted(self):
+        first = self.field.compile('0-49', 'first')
+        second = self.field.compile('0-49', 'second')
+        identifiers = ['user%s' % i for i in xrange(1000)]
+        assert_true(filter(first, identifiers) != filter(second, identifiers))
+
+    def test_compile_many(self):
+        compiled = self.field.compile_many(['0-49', '50-100'], 'my_switch')
+        assert_true(all(any(c(i) for c in compiled) for i in xrange(100)))
+
+    def test_is_active(self):
+        percentile = hashed_percentile('foo')
+        assert_true(self.field.is_active('%s-%s' % (percentile, percentile),
+                                         'foo'))
+        assert_false(self.field.is_active('0-100', None))
+
+    def test_is_active_salted(self):
+        # Agrees with the compiled switch, given the same key.
+        percentile = hashed_percentile('foo', 'my_switch:')
+        value = '%s-%s' % (percentile, percentile)
+        assert_true(self.field.is_active(value, 'foo', 'my_switch'))
+        for identifier in xrange(100):
+            assert_equals(self.field.is_active('0-49', identifier, 'other'),
+                          self.field.compile('0-49', 'other')(identifier))
+
+
 class TestRegex(object):
     def setup(self):
         self.field = Regex()
@@ -190,6 +254,57 @@ class TestRegex(object):
         assert_true(self.field.is_active('^abc', 'abcdef'))
         assert_false(self.field.is_active('^abc', 'defabc'))
 
+    def test_compile(self):
+        is_active = self.field.compile('^abc')
+        assert_true(is_active('abcdef'))
+        assert_false(is_active('defabc'))
+
+    def test_compile_many(self):
+        predicates = self.field.compile_many(['^abc', 'def$', 'x(y)z'])
+        assert_equals(len(predicates), 1)
+        is_active = predicates[0]
+        assert_true(is_active('abcxyz'))
+        assert_true(is_active('xyzdef'))
+        assert_true(is_active('-xyz-'))
+        assert_false(is_active('defabc'))
+
+    def test_compile_many_uncombinable(self):
+        values = ['^abc', '(a)\\1', '(?i)^X', '(?P<n>b)(?P=n)', 'def$']
+        predicates = self.field.compile_many(values)
+        assert_equals(len(predicates), 4)
+        for actual_value in ['abc', 'aa', 'xyz', 'bb', 'def', 'ghi', 'ab']:
+            assert_equals(any(p(actual_value) for p in predicates),
+                          any(self.field.is_active(v, actual_value)
+                              for v in values))
+
+    def test_compile_many_too_many_groups(self):
+        values = ['(%s)' % i for i in range(101)]
+        predicates = self.field.compile_many(values)
+        assert_true(any(p('100') for p in predicates))
+
+    def test_compile_cached(self):
+        conditions._regex_cache.clear()
+        with patch('switchboard.conditions.re.compile',
+                   Mock(side_effect=re.compile)) as compile_:
+            self.field.is_active('^cached', 'cached')
+            self.field.compile('^cached')
+            self.field.is_active('^cached', 'cached')
+            self.field.compile('^cached')
+        assert_equals(compile_.call_count, 1)
+
+    @patch('switchboard.conditions.REGEX_CACHE_SIZE', 1)
+    def test_compile_cache_bounded(self):
+        self.field.is_active('^a', 'a')
+        self.field.is_active('^b', 'b')
+        assert_equals(conditions._regex_cache.keys(), ['^b'])
+
+    def test_clean(self):
+        assert_equals(self.field.clean('^abc'), '^abc')
+
+    @raises(Invalid)
+    def test_clean_invalid(self):
+        self.field.clean('(abc')
+
     def test_render(self):
         html = ('/<input type="text" value="^abc" name="foo" '
                 + 'placeholder="regular expression"/>/')
@@ -248,6 +363,17 @@ class TestAbstractDate(object):
     def test_is_active_with_invalid(self):
         self.field.is_active('1900-01-01', 'foo')
 
+    @patch('switchboard.conditions.AbstractDate.str_to_date')
+    @patch('switchboard.conditions.AbstractDate.date_is_active')
+    def test_compile_parses_once(self, date_is_active, str_to_date):
+        date = datetime.date(1900, 1, 1)
+        str_to_date.return_value = date
+        is_active = self.field.compile('1900-01-01')
+        is_active(date)
+        is_active(date)
+        assert_equals(str_to_date.call_count, 1)
+        date_is_active.assert_called_with(date, date)
+
 
 class TestBeforeDate(object):
     def setup(self):
@@ -311,6 +437,14 @@ class TestConditionSet(object):
         can_execute.assert_any_call(instances[0])
         is_active.assert_any_call(instances[0], conditions)
 
+    def test_has_active_condition_overridden_is_active(self):
+        class OldConditionSet(ConditionSet):
+            def is_active(self, instance, condition):
+                return True if instance == 'foo' else None
+        cs = OldConditionSet()
+        assert_true(cs.has_active_condition({}, ['foo'], 'my_switch'))
+        assert_equals(cs.has_active_condition({}, ['bar'], 'my_switch'), None)
+
     @patch('switchboard.conditions.ConditionSet.can_execute')
     @patch('switchboard.conditions.ConditionSet.is_active')
     def test_has_active_conditions_no_execute(self, is_active, can_execute):
@@ -338,7 +472,7 @@ class TestConditionSet(object):
 
     @patch('switchboard.conditions.ConditionSet.get_field_value')
     def test_is_active_include_true(self, get_field_value):
-        field = Mock()
+        field = Mock(uses_key=False)
         field.is_active.return_value = True
         name = 'bar'
         field_condition = value = 'baz'
@@ -353,7 +487,7 @@ class TestConditionSet(object):
 
     @patch('switchboard.conditions.ConditionSet.get_field_value')
     def test_is_active_no_field_conditions(self, get_field_value):
-        field = Mock()
+        field = Mock(uses_key=False)
         field.is_active.return_value = True
         name = 'bar'
         self.cs.fields = {name: field}
@@ -366,7 +500,7 @@ class TestConditionSet(object):
 
     @patch('switchboard.conditions.ConditionSet.get_field_value')
     def test_is_active_false(self, get_field_value):
-        field = Mock()
+        field = Mock(uses_key=False)
         field.is_active.return_value = False
         name = 'bar'
         field_condition = value = 'baz'
@@ -381,7 +515,7 @@ class TestConditionSet(object):
 
     @patch('switchboard.conditions.ConditionSet.get_field_value')
     def test_is_active_true_exclude(self, get_field_value):
-        field = Mock()
+        field = Mock(uses_key=False)
         field.is_active.return_value = True
         name = 'bar'
         field_condition = value = 'baz'
@@ -394,6 +528,117 @@ class TestConditionSet(object):
         get_field_value.assert_called_with(instance, name)
         field.is_active.assert_called_with(field_condition, value)
 
+    def test_compile(self):
+        include = Mock()
+        exclude = Mock()
+        field = Mock(uses_key=False)
+        field.compile_many.side_effect = lambda values, key: [{
+            'baz': include,
+            'qux': exclude,
+        }[value] for value in values]
+        self.cs.fields = {'bar': field}
+        condition = {
+            'bar': [(INCLUDE, 'baz'), (EXCLUDE, 'qux')],
+            'unknown': [(INCLUDE, 'baz')],
+        }
+        compiled = self.cs.compile(condition, 'my_switch')
+        assert_true(isinstance(compiled, CompiledCondition))
+        assert_equals(compiled.condition_set, self.cs)
+        assert_equals(compiled.fields, (('bar', (include,), (exclude,)),))
+        field.compile_many.assert_called_with(['qux'], 'my_switch')
+
+    def test_compile_overridden_is_active(self):
+        class CustomConditionSet(ConditionSet):
+            def is_active(self, instance, condition):
+                return True if instance in condition['foo'] else None
+        condition = {'foo': ['a']}
+        compiled = CustomConditionSet().compile(condition, 'my_switch')
+        assert_true(isinstance(compiled, UncompiledCondition))
+        condition['foo'].append('b')
+        assert_true(compiled.has_active_condition(['a']))
+        assert_equals(compiled.has_active_condition(['b']), None)
+
+    def test_compile_overridden_has_active_condition(self):
+        class CustomConditionSet(ConditionSet):
+            def has_active_condition(self, condition, instances):
+                return instances == condition['foo']
+        compiled = CustomConditionSet().compile({'foo': ['a']}, 'my_switch')
+        assert_true(isinstance(compiled, UncompiledCondition))
+        assert_true(compiled.has_active_condition(['a'], {}))
+        assert_false(compiled.has_active_condition(['b'], {}))
+
+
+class TestCompiledCondition(object):
+    def setup(self):
+        self.cs = ConditionSet()
+        self.cs.fields = {'foo': Field(), 'bar': Field()}
+        self.cs.fields['foo'].set_values('foo')
+        self.cs.fields['bar'].set_values('bar')
+
+    def compile(self, condition):
+        return self.cs.compile(condition)
+
+    def instance(self, **kwargs):
+        return Mock(**kwargs)
+
+    def test_is_active_include(self):
+        compiled = self.compile({'foo': [(INCLUDE, 'a'), (INCLUDE, 'b')]})
+        assert_true(compiled.is_active(self.instance(foo='b')))
+        assert_equals(compiled.is_active(self.instance(foo='c')), None)
+
+    def test_is_active_exclude(self):
+        compiled = self.compile({
+            'foo': [(INCLUDE, 'a')],
+            'bar': [(EXCLUDE, 'x')],
+        })
+        assert_true(compiled.is_active(self.instance(foo='a', bar='y')))
+        assert_false(compiled.is_active(self.instance(foo='a', bar='x')))
+
+    def test_matches_uncompiled(self):
+        condition = {
+            'foo': [(INCLUDE, 'a'), (EXCLUDE, 'b')],
+            'bar': [(INCLUDE, 'x')],
+        }
+        compiled = self.compile(condition)
+        for foo in 'abc':
+            for bar in 'xy':
+                instance = self.instance(foo=foo, bar=bar)
+                assert_equals(compiled.is_active(instance),
+                              self.cs.is_active(instance, condition))
+
+    @patch('switchboard.conditions.ConditionSet.get_field_value')
+    def test_is_active_values(self, get_field_value):
+        get_field_value.return_value = 'a'
+        compiled = self.compile({'foo': [(INCLUDE, 'a')]})
+        instance = self.instance()
+        values = {}
+        assert_true(compiled.is_active(instance, values))
+        assert_true(compiled.is_active(instance, values))
+        assert_equals(get_field_value.call_count, 1)
+        assert_equals(values,
+                      {(self.cs, id(instance), 'foo'): (instance, 'a')})
+
+    @patch('switchboard.conditions.ConditionSet.get_field_value')
+    def test_is_active_values_identity(self, get_field_value):
+        get_field_value.return_value = 'b'
+        compiled = self.compile({'foo': [(INCLUDE, 'a')]})
+        instance = self.instance()
+        # A stale entry left by another object that had the same identity.
+        values = {(self.cs, id(instance), 'foo'): (object(), 'a')}
+        assert_equals(compiled.is_active(instance, values), None)
+        assert_equals(values[(self.cs, id(instance), 'foo')], (instance, 'b'))
+
+    @patch('switchboard.conditions.ConditionSet.can_execute')
+    def test_has_active_condition(self, can_execute):
+        can_execute.side_effect = lambda instance: instance is not None
+        compiled = self.compile({'foo': [(INCLUDE, 'a')]})
+        assert_true(compiled.has_active_condition([self.instance(foo='a')]))
+        assert_equals(compiled.has_active_condition([]), None)
+        instances = [self.instance(foo='a'), self.instance(foo='b')]
+        assert_true(compiled.has_active_condition(instances))
+        compiled = self.compile({'foo': [(EXCLUDE, 'b')]})
+        assert_false(compiled.has_active_condition(instances))
+
 
 class TestModelConditionSet(object):
     def setup(self):
@@ -404,6 +649,24 @@ class TestModelConditionSet(object):
         assert_false(self.cs.can_execute('foo'))
 
 
+class TestHashedModelConditionSet(object):
+    def setup(self):
+        self.cs = HashedModelConditionSet(Mock)
+
+    def test_percent(self):
+        assert_true(isinstance(self.cs.fields['percent'], HashedPercent))
+        assert_true(isinstance(ModelConditionSet.fields['percent'], Percent))
+
+    def test_compiled_agrees(self):
+        condition = {'percent': [(INCLUDE, '0-49')]}
+        compiled = self.cs.compile(condition, 'my_switch')
+        for i in xrange(100):
+            instance = Mock(id='user%s' % i)
+            assert_equals(compiled.is_active(instance),
+                          self.cs.has_active_condition(condition, [instance],
+                                                       'my_switch'))
+
+
 class TestRequestConditionSet(object):
     def setup(self):
         self.cs = RequestConditionSet()
@@ -0,0 +1,71 @@
+"""
+switchboard.tests.test_feed
+~~~~~~~~~~~~~~~
+
+:copyright: (c) 2015 Kyle Adams.
+:license: Apache License 2.0, see LICENSE for more details.
+"""
+
+import json
+
+from mock import Mock
+from nose.tools import (
+    assert_equals,
+    assert_false,
+    assert_true,
+)
+
+from ..feed import LocalChangeFeed, RedisChangeFeed
+
+
+class TestLocalChangeFeed(object):
+    def setup(self):
+        self.feed = LocalChangeFeed()
+        self.change = dict(version=2, previous=1, keys=['foo'])
+
+    def test_publish(self):
+        callback = Mock()
+        self.feed.subscribe(callback)
+        self.feed.subscribe(callback)
+        self.feed.publish(self.change)
+        callback.assert_called_once_with(self.change)
+
+    def test_unsubscribe(self):
+        callback = Mock()
+        self.feed.subscribe(callback)
+        self.feed.unsubscribe(callback)
+        self.feed.publish(self.change)
+        assert_false(callback.called)
+
+    def test_failing_subscriber(self):
+        failing = Mock(side_effect=ValueError)
+        callback = Mock()
+        self.feed.subscribe(failing)
+        self.feed.subscribe(callback)
+        self.feed.publish(self.change)
+        assert_true(callback.called)
+
+
+class TestRedisChangeFeed(object):
+    def setup(self):
+        self.redis = Mock()
+        self.feed = RedisChangeFeed(self.redis, channel='changes')
+        self.change = dict(version=2, previous=1, keys=['foo'])
+
+    def test_publish(self):
+        self.feed.publish(self.change)
+        self.redis.publish.assert_called_with('changes',
+                                              json.dumps(self.change))
+
+    def test_listen(self):
+        callback = Mock()
+        self.feed.subscribe(callback)
+        pubsub = self.redis.pubsub.return_value
+        pubsub.listen.return_value = [
+            dict(type='subscribe', data=1),
+            dict(type='message', data=json.dumps(self.change)),
+        ]
+        self.feed.listen()
+        pubsub.subscribe.assert_called_with('changes')
+        callback.assert_called_once_with(self.change)
+        assert_equals(callback.call_args[0][0]['keys'], [u'foo'])
@@ -0,0 +1,95 @@
+"""
+switchboard.tests.test_index
+~~~~~~~~~~~~~~~
+
+:copyright: (c) 2015 Kyle Adams.
+:license: Apache License 2.0, see LICENSE for more details.
+"""
+import datetime
+
+from mock import patch
+from nose.tools import (
+    assert_equals,
+    assert_false,
+    assert_true,
+)
+
+from ..index import SortIndex
+from ..models import Model, Switch, _key
+
+
+class TestSortIndex(object):
+
+    def setup(self):
+        self.index = SortIndex(Switch, ('label', 'date_created'))
+        for i, (key, label) in enumerate([('a', 'Zed'), ('b', 'Alpha'),
+                                          ('c', 'Mid')]):
+            Switch.create(key=key, label=label,
+                          date_created=datetime.datetime(2015, 1, i + 1))
+
+    def teardown(self):
+        Switch.drop()
+        Switch.ds.delete(self.index.key)
+
+    def test_page(self):
+        assert_equals(self.index.page('label'), (['b', 'c', 'a'], 3))
+        assert_equals(self.index.page('date_created'), (['a', 'b', 'c'], 3))
+
+    def test_page_reverse(self):
+        assert_equals(self.index.page('label', reverse=True),
+                      (['a', 'c', 'b'], 3))
+
+    def test_page_offset_limit(self):
+        assert_equals(self.index.page('label', offset=1, limit=1), (['c'], 3))
+        assert_equals(self.index.page('label', reverse=True, offset=2,
+                                      limit=5), (['b'], 3))
+        assert_equals(self.index.page('label', offset=3, limit=1), ([], 3))
+
+    def test_page_reverse_past_end(self):
+        assert_equals(self.index.page('label', reverse=True, offset=3,
+                                      limit=2), ([], 3))
+        assert_equals(self.index.page('label', reverse=True, offset=5,
+                                      limit=2), ([], 3))
+
+    def test_stored(self):
+        self.index.page('label')
+        stored = Switch.ds.get(self.index.key)
+        assert_equals(stored['version'], Switch.get_version())
+        with patch('switchboard.models.Model.iterall') as iterall:
+            with patch('switchboard.models.Model.get_many') as get_many:
+                self.index.page('label')
+        assert_false(iterall.called)
+        assert_false(get_many.called)
+
+    def test_updated(self):
+        self.index.page('label')
+        Switch.get('a').delete()
+        switch = Switch.get('b')
+        switch.label = 'Omega'
+        switch.save()
+        Switch.create(key='d', label='Beta')
+        with patch('switchboard.models.Model.iterall') as iterall:
+            keys, total = self.index.page('label')
+        assert_false(iterall.called)
+        assert_equals((keys, total), (['d', 'c', 'b'], 3))
+
+    def test_rebuilt_without_change_log(self):
+        self.index.page('label')
+        Switch.create(key='d', label='Beta')
+        with patch.object(Model, 'get_changes', return_value=None):
+            assert_equals(self.index.page('label'),
+                          (['b', 'd', 'c', 'a'], 4))
+
+    def test_rebuilt_past_max_age(self):
+        self.index.page('label')
+        # A switch the change log missed.
+        Switch.ds.put(_key('d'), dict(key='d', label='Beta'))
+        assert_equals(self.index.page('label')[1], 3)
+        self.index.max_age = 0
+        assert_equals(self.index.page('label'), (['b', 'd', 'c', 'a'], 4))
+
+    def test_rebuilt_for_other_fields(self):
+        self.index.page('label')
+        index = SortIndex(Switch, ('date_modified',))
+        assert_equals(index.page('date_modified')[1], 3)
+        assert_true('date_modified' in Switch.ds.get(index.key)['orders'])
@@ -5,8 +5,10 @@ switchboard.tests.test_manager
 :copyright: (c) 2015 Kyle Adams.
 :license: Apache License 2.0, see LICENSE for more details.
 """
+import pickle
 import threading
 
+import datastore.core
 from nose.tools import (
     assert_equals,
     assert_true,
@@ -24,13 +26,32 @@ from ..builtins import (
     QueryStringConditionSet,
 )
 from ..decorators import switch_is_active
+from ..feed import LocalChangeFeed
 from ..models import (
+    CompiledSwitch,
     Switch,
     SELECTIVE, DISABLED, GLOBAL, INHERIT,
     INCLUDE, EXCLUDE
 )
-from ..manager import registry, SwitchManager
+from ..cache import ResultCache, Snapshot
+from ..conditions import ConditionSet
+from ..manager import (
+    compiled_switches,
+    lineage,
+    operator,
+    registry,
+    RequestState,
+    SwitchManager,
+)
 from ..settings import settings
+from ..signals import (
+    condition_set_checked,
+    result_cache_checked,
+    switch_checked,
+)
+
+QUERYSTRING_CONDITION_SET = 'switchboard.builtins.QueryStringConditionSet'
+default_datastore = Switch.ds
 
 
 class TestAPI(object):
@@ -71,10 +92,24 @@ class TestAPI(object):
 
     def test_get_all_conditions(self):
         conditions = list(self.operator.get_all_conditions())
-        assert_equals(len(conditions), 5)
+        assert_equals(len(conditions), 7)
         for set_id, label, field in conditions:
             assert_true(set_id in registry)
 
+    def test_catalog(self):
+        catalog = self.operator.get_catalog()
+        assert_equals([e.group for e in catalog],
+                      ['Host', 'IP Address', 'Query String'])
+        assert_equals([name for name, _ in catalog[2].fields], ['regex'])
+        self.operator.unregister(QueryStringConditionSet)
+        assert_equals([e.namespace for e in self.operator.get_catalog()],
+                      ['host', 'ip'])
+        self.operator.register(QueryStringConditionSet)
+
+    def test_catalog_namespaces(self):
+        entries = self.operator.get_catalog(['querystring', 'missing', 'ip'])
+        assert_equals([e.namespace for e in entries], ['ip', 'querystring'])
+
     @patch('switchboard.base.ModelDict.__getitem__')
     def test_error(self, getitem):
         # force the is_active call to fail right away
@@ -678,6 +713,22 @@ class TestAPI(object):
 
         assert_false(self.operator.is_active('test:child'))
 
+    def test_nested_key_fetches_lineage_once(self):
+        Switch.create(key='a', status=GLOBAL)
+        Switch.create(key='a:b', status=INHERIT)
+        Switch.create(key='a:b:c', status=GLOBAL)
+        self.operator = SwitchManager(auto_create=False)
+        with patch('switchboard.models.Model.get') as get:
+            with patch('switchboard.models.Model.get_many',
+                       wraps=Switch.get_many) as get_many:
+                assert_true(self.operator.is_active('a:b:c'))
+                assert_true(self.operator.is_active('a:b:missing'))
+        assert_equals(get_many.call_count, 2)
+        assert_equals(get_many.call_args_list[0][0][0],
+                      ['a', 'a:b', 'a:b:c'])
+        assert_false(get.called)
+        assert_equals(self.operator._prefetched, None)
+
     @patch('switchboard.base.ModelDict.__getitem__')
     def test_defaults_on_key_error(self, getitem):
         getitem.side_effect = KeyError()
@@ -685,6 +736,232 @@ class TestAPI(object):
         assert_true(operator.is_active('test', default=True))
         assert_false(operator.is_active('test', default=False))
 
+    def test_compiled_switch_is_reused(self):
+        condition_set = 'switchboard.builtins.IPAddressConditionSet'
+        Switch.create(key='test', status=SELECTIVE)
+        switch = self.operator['test']
+        switch.add_condition(
+            condition_set=condition_set,
+            field_name='ip_address',
+            condition='192.168.1.1',
+        )
+        req = Request.blank('/')
+        req.environ['REMOTE_ADDR'] = '192.168.1.1'
+        assert_true(self.operator.is_active('test', req))
+        compiled = compiled_switches['test']
+        assert_true(self.operator.is_active('test', req))
+        assert_true(compiled_switches['test'] is compiled)
+
+    def test_compiled_switch_is_rebuilt_on_change(self):
+        condition_set = 'switchboard.builtins.IPAddressConditionSet'
+        Switch.create(key='test', status=SELECTIVE)
+        switch = self.operator['test']
+        switch.add_condition(
+            condition_set=condition_set,
+            field_name='ip_address',
+            condition='192.168.1.1',
+        )
+        req = Request.blank('/')
+        req.environ['REMOTE_ADDR'] = '192.168.1.1'
+        assert_true(self.operator.is_active('test', req))
+        compiled = compiled_switches['test']
+        switch.add_condition(
+            condition_set=condition_set,
+            field_name='ip_address',
+            condition='192.168.1.1',
+            exclude=True,
+        )
+        assert_false(self.operator.is_active('test', req))
+        assert_false(compiled_switches['test'] is compiled)
+
+    def test_compiled_frozen_nested_rebuilt_on_change(self):
+        Switch.create(key='a', status=GLOBAL)
+        Switch.create(key='a:b', status=SELECTIVE)
+        switch = self.operator['a:b']
+        switch.add_condition(condition_set=QUERYSTRING_CONDITION_SET,
+                             field_name='regex', condition='foo')
+        req = Request.blank('/?foobar')
+        assert_true(self.operator.is_active('a:b', req))
+        assert_equals(self.operator.are_active(['a:b'], req), {'a:b': True})
+        switch.add_condition(condition_set=QUERYSTRING_CONDITION_SET,
+                             field_name='regex', condition='bar',
+                             exclude=True)
+        assert_false(self.operator.is_active('a:b', req))
+        assert_equals(self.operator.are_active(['a:b'], req), {'a:b': False})
+
+    def test_compiled_frozen_not_rebuilt_when_serialized(self):
+        Switch.ds = datastore.serialize.shim(datastore.DictDatastore(),
+                                             pickle)
+        try:
+            Switch.create(key='a', status=GLOBAL)
+            Switch.create(key='a:b', status=SELECTIVE, value={
+                'querystring': {'regex': [[INCLUDE, 'foo']]},
+            })
+            req = Request.blank('/?foobar')
+            compiled_switches.clear()
+            with patch('switchboard.models.CompiledSwitch',
+                       wraps=CompiledSwitch) as compiled:
+                for _ in xrange(5):
+                    assert_true(self.operator.is_active('a:b', req))
+                    assert_equals(self.operator.are_active(['a:b'], req),
+                                  {'a:b': True})
+            assert_equals(compiled.call_count, 1)
+        finally:
+            Switch.drop()
+            Switch.ds = default_datastore
+
+    def test_custom_is_active_not_compiled(self):
+        class CustomConditionSet(ConditionSet):
+            def get_namespace(self):
+                return 'custom'
+
+            def is_active(self, instance, condition):
+                return instance is None and 'on' in condition['flag']
+        self.operator.register(CustomConditionSet)
+        try:
+            Switch.create(key='test', status=SELECTIVE,
+                          value={'custom': {'flag': ['on']}})
+            assert_true(self.operator.is_active('test'))
+            assert_equals(self.operator.are_active(['test']), {'test': True})
+        finally:
+            self.operator.unregister(CustomConditionSet)
+
+    def test_compiled_switch_dropped_on_delete(self):
+        Switch.create(key='test', status=SELECTIVE)
+        compiled_switches['test'] = Mock()
+        Switch.remove('test')
+        assert_false('test' in compiled_switches)
+
+    def test_compiled_switches_cleared_on_register(self):
+        compiled_switches['test'] = Mock()
+        self.operator.register(HostConditionSet)
+        assert_equals(compiled_switches, {})
+        compiled_switches['test'] = Mock()
+        self.operator.unregister(HostConditionSet)
+        assert_equals(compiled_switches, {})
+
+
+class TestBatch(object):
+    def setup(self):
+        self.operator = SwitchManager(auto_create=True)
+        self.operator.register(IPAddressConditionSet)
+        self.condition_set = 'switchboard.builtins.IPAddressConditionSet'
+        Switch.create(key='global', status=GLOBAL)
+        Switch.create(key='global:disabled', status=DISABLED)
+        Switch.create(key='global:inherit', status=INHERIT)
+        Switch.create(key='disabled', status=DISABLED)
+        Switch.create(key='disabled:global', status=GLOBAL)
+        Switch.create(key='selective', status=SELECTIVE)
+        self.operator['selective'].add_condition(
+            condition_set=self.condition_set,
+            field_name='ip_address',
+            condition='192.168.1.1',
+        )
+        Switch.create(key='selective:child', status=INHERIT)
+        self.req = Request.blank('/')
+        self.req.environ['REMOTE_ADDR'] = '192.168.1.1'
+
+    def teardown(self):
+        Switch.drop()
+
+    def test_are_active(self):
+        keys = [
+            'global',
+            'global:disabled',
+            'global:inherit',
+            'disabled',
+            'disabled:global',
+            'selective',
+            'selective:child',
+        ]
+        for req in (self.req, Request.blank('/')):
+            expected = dict((k, self.operator.is_active(k, req))
+                            for k in keys)
+            assert_equals(self.operator.are_active(keys, req), expected)
+        assert_equals(self.operator.are_active(keys, self.req), {
+            'global': True,
+            'global:disabled': False,
+            'global:inherit': True,
+            'disabled': False,
+            'disabled:global': False,
+            'selective': True,
+            'selective:child': True,
+        })
+
+    def test_are_active_missing(self):
+        self.operator = SwitchManager(auto_create=False)
+        assert_equals(self.operator.are_active(['missing', 'global:missing']),
+                      {'missing': False, 'global:missing': True})
+        assert_equals(self.operator.are_active(['missing'], default=True),
+                      {'missing': True})
+        assert_false(Switch.contains('missing'))
+
+    def test_are_active_auto_create(self):
+        assert_equals(self.operator.are_active(['new:child']),
+                      {'new:child': False})
+        assert_true(Switch.contains('new'))
+        assert_true(Switch.contains('new:child'))
+
+    def test_are_active_context(self):
+        self.operator.context['request'] = self.req
+        assert_equals(self.operator.are_active(['selective']),
+                      {'selective': True})
+
+    @patch('switchboard.models.Model.get')
+    @patch('switchboard.models.Model.get_many')
+    def test_are_active_fetches_once(self, get_many, get):
+        get_many.return_value = {}
+        self.operator = SwitchManager(auto_create=False)
+        self.operator.are_active(['a:b:c', 'a:b:d', 'a'])
+        assert_equals(get_many.call_count, 1)
+        assert_equals(sorted(get_many.call_args[0][0]),
+                      ['a', 'a:b', 'a:b:c', 'a:b:d'])
+        assert_false(get.called)
+
+    @patch('switchboard.builtins.IPAddressConditionSet.get_field_value')
+    def test_are_active_shares_field_values(self, get_field_value):
+        get_field_value.return_value = '192.168.1.1'
+        Switch.create(key='other', status=SELECTIVE)
+        self.operator['other'].add_condition(
+            condition_set=self.condition_set,
+            field_name='ip_address',
+            condition='192.168.1.1',
+        )
+        results = self.operator.are_active(['selective', 'other'], self.req)
+        assert_equals(results, {'selective': True, 'other': True})
+        assert_equals(get_field_value.call_count, 1)
+
+    @patch('switchboard.manager.SwitchManager._evaluate')
+    def test_are_active_error(self, evaluate):
+        evaluate.side_effect = Exception('Boom!')
+        assert_equals(self.operator.are_active(['global']),
+                      {'global': False})
+
+    def test_active_switches(self):
+        assert_equals(self.operator.active_switches(self.req), {
+            'global': True,
+            'global:disabled': False,
+            'global:inherit': True,
+            'disabled': False,
+            'disabled:global': False,
+            'selective': True,
+            'selective:child': True,
+        })
+
+    def test_active_switches_snapshot(self):
+        Switch.snapshot = Snapshot(Switch, timeout=60)
+        try:
+            results = self.operator.active_switches()
+        finally:
+            Switch.snapshot = None
+        assert_equals(results['global:inherit'], True)
+        assert_equals(results['selective'], False)
+
+
+def test_lineage():
+    assert_equals(lineage('a'), ['a'])
+    assert_equals(lineage('a:b:c'), ['a', 'a:b', 'a:b:c'])
+
 
 class TestConfigure(object):
     def setup(self):
@@ -724,6 +1001,90 @@ class TestConfigure(object):
         configure(self.config, datastore='TestDatastore')
         assert_equals(Switch.ds, 'TestDatastore')
 
+    def test_snapshot_disabled(self):
+        configure(self.config)
+        assert_equals(Switch.snapshot, None)
+
+    def test_snapshot_enabled(self):
+        configure(dict(self.config, cache_timeout='5'))
+        assert_true(isinstance(Switch.snapshot, Snapshot))
+        assert_equals(Switch.snapshot.timeout, 5)
+        del settings.SWITCHBOARD_CACHE_TIMEOUT
+        Switch.snapshot = None
+
+    def test_feed(self):
+        feed = LocalChangeFeed()
+        configure(dict(self.config, cache_timeout='60'), feed=feed)
+        try:
+            assert_equals(Switch.feed, feed)
+            Switch.snapshot.records()
+            assert_true(Switch.snapshot._checked > 0)
+            compiled_switches['foo'] = Mock()
+            compiled_switches['bar'] = Mock()
+            # A change made by another process.
+            feed.notify(dict(version=1, previous=None, keys=['foo']))
+            assert_equals(Switch.snapshot._checked, 0)
+            assert_equals(compiled_switches.keys(), ['bar'])
+            feed.notify(dict(version=2, previous=1, keys=None))
+            assert_equals(compiled_switches, {})
+        finally:
+            del settings.SWITCHBOARD_CACHE_TIMEOUT
+            Switch.snapshot = None
+            Switch.feed = None
+
+    def test_request_state(self):
+        original = operator._state
+        state = RequestState()
+        try:
+            configure(self.config, request_state=state)
+            operator.context['foo'] = 'bar'
+            assert_equals(state.context, dict(foo='bar'))
+        finally:
+            operator._state = original
+
+
+class TestManagerSnapshot(object):
+    def setup(self):
+        self.operator = SwitchManager(auto_create=False)
+        Switch.snapshot = Snapshot(Switch, timeout=60)
+
+    def teardown(self):
+        Switch.snapshot = None
+        Switch.drop()
+
+    def test_is_active(self):
+        Switch.create(key='test', status=GLOBAL)
+        assert_true(self.operator.is_active('test'))
+        with patch('switchboard.models.Model.get') as get:
+            assert_true(self.operator.is_active('test'))
+            assert_false(self.operator.is_active('missing'))
+            assert_false(get.called)
+
+    def test_compiled_conditions_changed(self):
+        switch = Switch.create(key='test', status=SELECTIVE, value={
+            'querystring': {'regex': [[INCLUDE, 'foo']]},
+        })
+        req = Request.blank('/?foobar')
+        assert_true(self.operator.is_active('test', req))
+        self.operator['test'].add_condition(
+            condition_set=QUERYSTRING_CONDITION_SET, field_name='regex',
+            condition='bar', exclude=True)
+        assert_false(self.operator.is_active('test', req))
+        assert_equals(self.operator.are_active(['test'], req),
+                      {'test': False})
+
+    def test_local_changes_are_seen(self):
+        switch = Switch.create(key='test', status=GLOBAL)
+        assert_true(self.operator.is_active('test'))
+        switch.status = DISABLED
+        switch.save()
+        assert_false(self.operator.is_active('test'))
+
+    def test_auto_create(self):
+        self.operator = SwitchManager(auto_create=True)
+        assert_false(self.operator.is_active('test'))
+        assert_true('test' in Switch.snapshot)
+
 
 class TestManagerConcurrency(object):
 
@@ -755,6 +1116,46 @@ class TestManagerConcurrency(object):
         if self.exc:
             raise self.exc
 
+    def test_request_state_per_thread(self):
+        self.operator.result_cache = {}
+        self.operator.field_values = {}
+        seen = []
+
+        def read_state():
+            seen.append((self.operator.result_cache,
+                         self.operator.field_values,
+                         self.operator._auto_create))
+
+        t = threading.Thread(target=read_state)
+        t.start()
+        t.join()
+        assert_equals(seen, [(None, None, True)])
+        assert_equals(self.operator.result_cache, {})
+
+    def test_custom_request_state(self):
+        # State that isn't kept per thread, e.g. because it is kept per
+        # coroutine instead.
+        class SharedState(object):
+            context = {}
+            result_cache = None
+            field_values = None
+            prefetched = None
+        operator = SwitchManager(request_state=SharedState())
+        operator.context['foo'] = 'bar'
+        seen = []
+        t = threading.Thread(target=lambda: seen.append(operator.context))
+        t.start()
+        t.join()
+        assert_equals(seen, [dict(foo='bar')])
+
+    def test_manager_shared_across_threads(self):
+        self.operator.foo = 'bar'
+        seen = []
+        t = threading.Thread(target=lambda: seen.append(self.operator.foo))
+        t.start()
+        t.join()
+        assert_equals(seen, ['bar'])
+
 
 class TestManagerResultCaching(object):
 
@@ -786,6 +1187,126 @@ class TestManagerResultCaching(object):
         switch.save()
         assert_false(self.operator.is_active('test'))
 
+    def test_nested(self):
+        Switch.create(key='a', status=GLOBAL)
+        Switch.create(key='a:b', status=INHERIT)
+        Switch.create(key='a:b:c', status=GLOBAL)
+        Switch.create(key='a:b:d', status=DISABLED)
+        self.operator.result_cache = ResultCache()
+        with patch.object(self.operator, 'get_switch',
+                          wraps=self.operator.get_switch) as get_switch:
+            assert_true(self.operator.is_active('a:b:c'))
+            assert_equals(get_switch.call_count, 3)
+            # The parents' results, a and a:b, are cached as well.
+            assert_false(self.operator.is_active('a:b:d'))
+            assert_equals(get_switch.call_count, 4)
+            assert_true(self.operator.is_active('a:b:c'))
+            assert_equals(get_switch.call_count, 4)
+        assert_equals(self.operator.result_cache.hits, 2)
+
+
+class TestManagerFieldValues(object):
+
+    def setup(self):
+        self.operator = SwitchManager(auto_create=False)
+        self.operator.register(IPAddressConditionSet())
+        for key in ('foo', 'bar'):
+            switch = Switch.create(key=key, status=SELECTIVE)
+            switch.add_condition(
+                manager=self.operator,
+                condition_set='switchboard.builtins.IPAddressConditionSet',
+                field_name='ip_address',
+                condition='192.168.1.1',
+            )
+
+    def teardown(self):
+        Switch.drop()
+
+    @patch('switchboard.builtins.IPAddressConditionSet.get_field_value')
+    def test_shared_across_checks(self, get_field_value):
+        get_field_value.return_value = '192.168.1.1'
+        req = Request.blank('/')
+        self.operator.field_values = {}
+        assert_true(self.operator.is_active('foo', req))
+        assert_true(self.operator.is_active('bar', req))
+        assert_true(self.operator.are_active(['foo', 'bar'], req)['bar'])
+        assert_equals(get_field_value.call_count, 1)
+
+    @patch('switchboard.builtins.IPAddressConditionSet.get_field_value')
+    def test_disabled(self, get_field_value):
+        get_field_value.return_value = '192.168.1.1'
+        req = Request.blank('/')
+        assert_true(self.operator.is_active('foo', req))
+        assert_true(self.operator.is_active('bar', req))
+        assert_equals(get_field_value.call_count, 2)
+
+
+class TestManagerInstrumentation(object):
+
+    def setup(self):
+        self.operator = SwitchManager(auto_create=False)
+        self.operator.register(IPAddressConditionSet())
+        self.operator.register(QueryStringConditionSet())
+        switch = Switch.create(key='foo', status=SELECTIVE)
+        switch.add_condition(
+            manager=self.operator,
+            condition_set='switchboard.builtins.IPAddressConditionSet',
+            field_name='ip_address',
+            condition='192.168.1.1',
+        )
+        Switch.create(key='foo:bar', status=INHERIT)
+        self.calls = []
+
+    def teardown(self):
+        Switch.drop()
+
+    def record(self, sender, **kwargs):
+        self.calls.append((sender, kwargs))
+
+    def test_switch_checked(self):
+        req = Request.blank('/')
+        req.remote_addr = '192.168.1.1'
+        with switch_checked.connected_to(self.record):
+            assert_true(self.operator.is_active('foo:bar', req))
+        # The parent is checked, and reported, first.
+        assert_equals([sender for sender, _ in self.calls], ['foo', 'foo:bar'])
+        sender, kwargs = self.calls[1]
+        assert_true(kwargs['result'])
+        assert_true(kwargs['duration'] >= 0)
+
+    def test_switch_checked_many(self):
+        with switch_checked.connected_to(self.record):
+            self.operator.are_active(['foo', 'missing'])
+        assert_equals(sorted(sender for sender, _ in self.calls),
+                      ['foo', 'missing'])
+
+    def test_result_cache_checked(self):
+        self.operator.result_cache = {}
+        try:
+            with result_cache_checked.connected_to(self.record):
+                self.operator.is_active('foo')
+                self.operator.is_active('foo')
+        finally:
+            self.operator.result_cache = None
+        assert_equals(self.calls, [('foo', dict(hit=False)),
+                                   ('foo', dict(hit=True))])
+
+    def test_condition_set_checked(self):
+        req = Request.blank('/')
+        req.remote_addr = '10.0.0.1'
+        with condition_set_checked.connected_to(self.record):
+            assert_false(self.operator.is_active('foo', req))
+        assert_equals(len(self.calls), 1)
+        sender, kwargs = self.calls[0]
+        assert_equals(sender, 'ip')
+        assert_equals(kwargs['key'], 'foo')
+        assert_equals(kwargs['result'], None)
+
+    @patch('switchboard.manager.time.time')
+    def test_disconnected(self, time):
+        self.operator.is_active('foo')
+        assert_false(time.called)
+
 
 class TestManagerResultCacheDecorator(object):
 
@@ -802,43 +1323,61 @@ class TestManagerResultCacheDecorator(object):
         self.cached_is_active_func = self.with_result_cache(is_active_func)
 
     def test_decorator_nocache(self):
-        operator_self = Mock(result_cache=None)
+        operator_self = Mock(context={}, result_cache=None)
         result = self.cached_is_active_func(operator_self, 'mykey')
         assert_true(result)
         assert_equals(operator_self.result_cache, None)
 
     def test_decorator_simple(self):
-        operator_self = Mock(result_cache={})
+        operator_self = Mock(context={}, result_cache={})
         result = self.cached_is_active_func(operator_self, 'mykey')
         assert_true(result)
         assert_equals(operator_self.result_cache, {
-            (('mykey',), ()): True
+            (('mykey',), (), ()): True
         })
 
     def test_decorator_uses_cache(self):
         # Put False in cache, to ensure only the cache is used, not
         # is_active_func.
-        operator_self = Mock(result_cache={
-            (('mykey',), ()): False
+        operator_self = Mock(context={}, result_cache={
+            (('mykey',), (), ()): False
         })
         result = self.cached_is_active_func(operator_self, 'mykey')
         assert_false(result)
         assert_equals(operator_self.result_cache, {
-            (('mykey',), ()): False
+            (('mykey',), (), ()): False
         })
 
     def test_decorator_with_params(self):
-        operator_self = Mock(result_cache={})
+        operator_self = Mock(context={}, result_cache={})
         result = self.cached_is_active_func(operator_self, 'mykey',
                                             'someval', a=1, b=2)
         assert_true(result)
         assert_equals(operator_self.result_cache, {
             (('mykey', 'someval'),
-             (('a', 1), ('b', 2))): True
+             (('a', 1), ('b', 2)), ()): True
         })
 
+    def test_decorator_context(self):
+        operator_self = Mock(context={'request': 'foo'}, result_cache={})
+        self.cached_is_active_func(operator_self, 'mykey')
+        operator_self.context['request'] = 'bar'
+        self.cached_is_active_func(operator_self, 'mykey')
+        assert_equals(operator_self.result_cache, {
+            (('mykey',), (), (('request', 'foo'),)): True,
+            (('mykey',), (), (('request', 'bar'),)): True,
+        })
+
+    def test_decorator_caches_none(self):
+        is_active_func = Mock(return_value=None)
+        cached_is_active_func = self.with_result_cache(is_active_func)
+        operator_self = Mock(context={}, result_cache={})
+        assert_equals(cached_is_active_func(operator_self, 'mykey'), None)
+        assert_equals(cached_is_active_func(operator_self, 'mykey'), None)
+        assert_equals(is_active_func.call_count, 1)
+
     def test_decorator_uncachable_params(self):
-        operator_self = Mock(result_cache={})
+        operator_self = Mock(context={}, result_cache={})
         # A dict isn't hashable, can't be cached.
         result = self.cached_is_active_func(operator_self, 'mykey', {})
         assert_true(result)
@@ -7,10 +7,11 @@ switchboard.tests.test_manager
 """
 
 from mock import Mock, patch
-from nose.tools import assert_true
+from nose.tools import assert_equals, assert_true
 from webob import Request
 
 from .. import operator
+from ..cache import ResultCache
 from ..middleware import SwitchboardMiddleware
 
 
@@ -38,3 +39,31 @@ class TestSwitchboardMiddleware(object):
         req = Request.blank('/')
         self.middleware.request_finished(req)
         assert_true(send.called)
+
+    @patch('switchboard.middleware.Request.get_response')
+    def test_result_cache(self, get_response):
+        caches = []
+
+        def get_response_side_effect(app):
+            caches.append(operator.result_cache)
+            return Mock()
+        get_response.side_effect = get_response_side_effect
+        self.middleware({}, Mock())
+        self.middleware({}, Mock())
+        assert_true(isinstance(caches[0], ResultCache))
+        assert_true(caches[0] is not caches[1])
+        assert_equals(operator.result_cache, None)
+
+    @patch('switchboard.middleware.Request.get_response')
+    def test_field_values(self, get_response):
+        values = []
+
+        def get_response_side_effect(app):
+            values.append(operator.field_values)
+            return Mock()
+        get_response.side_effect = get_response_side_effect
+        self.middleware({}, Mock())
+        self.middleware({}, Mock())
+        assert_equals(values, [{}, {}])
+        assert_true(values[0] is not values[1])
+        assert_equals(operator.field_values, None)
@@ -6,8 +6,11 @@ switchboard.tests.test_models
 :license: Apache License 2.0, see LICENSE for more details.
 """
 import copy
+import datetime
+import fnmatch
 import pickle
 
+import datastore.core
 from nose.tools import (
     assert_equals,
     assert_true,
@@ -19,13 +22,22 @@ from mock import Mock, patch
 from ..builtins import IPAddressConditionSet
 from ..manager import SwitchManager
 from ..models import (
+    CompiledSwitch,
+    FrozenSwitch,
     Model,
     Switch,
     INHERIT, GLOBAL, SELECTIVE, DISABLED,
     INCLUDE, EXCLUDE,
-    _key
+    CHANGE_LOG_SIZE,
+    MAX_CHANGES,
+    SCAN_BATCH_SIZE,
+    VERSION_KEY,
+    _change_key,
+    _key,
+    switch_defaults,
 )
 from ..settings import settings
+from ..signals import datastore_read
 
 
 default_datastore = Model.ds
@@ -40,6 +52,7 @@ def reset_datastore():
         pass
     finally:
         Model.ds = default_datastore
+        Model.ds.delete(VERSION_KEY)
 
 
 class TestModel(object):
@@ -184,6 +197,24 @@ class TestModel(object):
         assert_true(post_delete.called)
         assert_equals(instance.key, post_delete.call_args[0][0].key)
 
+    @patch('switchboard.models.Model.post_delete.send')
+    @patch('switchboard.models.Model.pre_delete.send')
+    def test_remove_many(self, pre_delete, post_delete):
+        Model.create(key='a')
+        Model.create(key='b')
+        Model.create(key='c')
+        version = Model.get_version()
+        with patch('switchboard.models.Model.bump_version') as bump_version:
+            keys = Model.remove_many(['a', 'missing', 'b'])
+        assert_equals(keys, ['a', 'b'])
+        bump_version.assert_called_once_with(['a', 'b'])
+        assert_equals([m.key for m in Model.all()], ['c'])
+        assert_equals([c[0][0].key for c in pre_delete.call_args_list],
+                      ['a', 'b'])
+        assert_equals(post_delete.call_count, 2)
+        assert_equals(Model.remove_many(['missing']), [])
+        assert_equals(Model.get_version(), version)
+
     def test_all(self):
         assert_equals(len(Model.all()), 0)
         Model.create(key='0')
@@ -199,35 +230,155 @@ class TestModel(object):
             assert_true(key in actual_keys,
                         '{0} not among returned keys'.format(key))
 
-    def test_queryless_all_redis(self):
+    def test_iterall(self):
+        Model.create(key='0')
+        Model.create(key='test:child')
+        models = Model.iterall()
+        assert_false(isinstance(models, list))
+        assert_equals(sorted(model.key for model in models),
+                      ['0', 'test:child'])
+
+    def test_iterkeys(self):
+        Model.create(key='0')
+        Model.create(key='test:child')
+        with patch('switchboard.models.Model.__init__') as init:
+            keys = sorted(Model.iterkeys())
+            assert_false(init.called)
+        assert_equals(keys, ['0', 'test:child'])
+
+    def redis_datastore(self, raw_data):
         class MockDatastore(object):
             pass
-        raw_data = {
-            'a': dict(key='a'),
-            'b': dict(key='b'),
-            'test:child': dict(key='test:child'),
-        }
         data = dict()
         for k, v in raw_data.iteritems():
-            data[_key(k)] = pickle.dumps(v)
+            data[str(_key(k))] = pickle.dumps(v)
+        # Unrelated keys sharing the Redis database.
+        data['/other/a'] = pickle.dumps(dict(key='other'))
         redis = Mock()
-        redis.keys.return_value = data.keys()
-        redis.get = lambda k: data[k]
+        redis.scan_iter.side_effect = lambda match, count: (
+            k for k in data.keys() if fnmatch.fnmatchcase(k, match)
+        )
+        redis.mget.side_effect = lambda keys: [data.get(k) for k in keys]
         ds = MockDatastore()
         ds.query = Mock()
         ds.query.side_effect = NotImplementedError
         ds.child_datastore = MockDatastore()
         ds.child_datastore.serializer = pickle
         ds._redis = redis
-        ds.get = lambda k: pickle.dumps(redis.get(k))
-        Model.ds = ds
+        return ds
+
+    def test_queryless_all_redis(self):
+        raw_data = {
+            'a': dict(key='a'),
+            'b': dict(key='b'),
+            'test:child': dict(key='test:child'),
+        }
+        Model.ds = self.redis_datastore(raw_data)
         models = Model.all()
-        expected_keys = data.keys()
-        actual_keys = [_key(model.key) for model in models]
-        assert_equals(len(expected_keys), len(actual_keys))
-        for key in expected_keys:
-            assert_true(key in actual_keys,
-                        '{0} not among returned keys'.format(key))
+        actual_keys = sorted(model.key for model in models)
+        assert_equals(actual_keys, sorted(raw_data.keys()))
+        assert_false(Model.ds._redis.keys.called)
+        Model.ds._redis.scan_iter.assert_called_with(
+            match='/switchboard/*', count=SCAN_BATCH_SIZE)
+
+    def test_iterkeys_redis(self):
+        raw_data = {
+            'a': dict(key='a'),
+            'test:child': dict(key='test:child'),
+        }
+        Model.ds = self.redis_datastore(raw_data)
+        assert_equals(sorted(Model.iterkeys()), ['a', 'test:child'])
+        assert_false(Model.ds._redis.mget.called)
+
+    @patch('switchboard.models.SCAN_BATCH_SIZE', 2)
+    def test_queryless_all_redis_batches(self):
+        raw_data = dict((str(n), dict(key=str(n))) for n in range(5))
+        Model.ds = self.redis_datastore(raw_data)
+        results = Model._queryless_all()
+        assert_false(Model.ds._redis.mget.called)
+        assert_equals(sorted(r['key'] for r in results),
+                      sorted(raw_data.keys()))
+        batches = [c[0][0] for c in Model.ds._redis.mget.call_args_list]
+        assert_equals([len(b) for b in batches], [2, 2, 1])
+
+    def test_queryless_all_redis_removed_key(self):
+        Model.ds = self.redis_datastore({'a': dict(key='a')})
+        mget = Model.ds._redis.mget.side_effect
+        Model.ds._redis.mget.side_effect = lambda keys: mget(keys) + [None]
+        assert_equals([m.key for m in Model.all()], ['a'])
+
+    def test_get_many(self):
+        Model.create(key='a', foo='bar')
+        Model.create(key='b:c', foo='baz')
+        models = Model.get_many(['a', 'b:c', 'missing'])
+        assert_equals(sorted(models.keys()), ['a', 'b:c'])
+        assert_equals(models['a'].foo, 'bar')
+        assert_equals(models['b:c'].foo, 'baz')
+        assert_equals(Model.get_many([]), {})
+
+    def test_datastore_read(self):
+        Model.create(key='a', foo='bar')
+        calls = []
+
+        def record(model, keys):
+            calls.append((model, keys))
+        with datastore_read.connected_to(record):
+            Model.get('a')
+            Model.get_many(['a', 'b'])
+            Model.get_many([])
+            Model.all()
+        assert_equals(calls, [(Model, ['a']), (Model, ['a', 'b']),
+                              (Model, None)])
+
+    def test_get_many_redis(self):
+        data = {
+            str(_key('a')): pickle.dumps(dict(key='a')),
+            str(_key('b:c')): pickle.dumps(dict(key='b:c')),
+        }
+        redis = Mock()
+        redis.mget.side_effect = lambda keys: [data.get(k) for k in keys]
+        Model.ds = Mock(_redis=redis)
+        Model.ds.child_datastore.serializer = pickle
+        models = Model.get_many(['a', 'b:c', 'missing'])
+        assert_equals(sorted(models.keys()), ['a', 'b:c'])
+        assert_equals(redis.mget.call_count, 1)
+        assert_false(Model.ds.get.called)
+
+    @patch('switchboard.models.Model.post_save.send')
+    @patch('switchboard.models.Model.pre_save.send')
+    def test_save_many(self, pre_save, post_save):
+        Model.create(key='a', foo='bar')
+        pre_save.reset_mock()
+        post_save.reset_mock()
+        version = Model.get_version()
+        existing = Model(key='a', foo='baz')
+        new = Model(foo='qux')
+        keys = Model.save_many([existing, new])
+        assert_equals(keys, ['a', new.key])
+        assert_equals(Model.get('a').foo, 'baz')
+        assert_equals(Model.get(new.key).foo, 'qux')
+        assert_true(Model.get_version() > version)
+        assert_equals(pre_save.call_count, 2)
+        assert_equals(pre_save.call_args_list[0][0][0].foo, 'bar')
+        assert_equals(pre_save.call_args_list[1][0][0], None)
+        assert_equals(post_save.call_count, 2)
+
+    def test_save_many_redis(self):
+        redis = Mock()
+        redis.mget.return_value = [None, None]
+        Model.ds = Mock(_redis=redis)
+        Model.ds.get.return_value = None
+        Model.ds.child_datastore.serializer = pickle
+        redis.incr.return_value = 7
+        Model.save_many([Model(key='a'), Model(key='b')])
+        pipeline = redis.pipeline.return_value
+        assert_equals(pipeline.set.call_count, 2)
+        pipeline.set.assert_any_call(str(_key('a')),
+                                     pickle.dumps(dict(key='a')))
+        assert_true(pipeline.execute.called)
+        # Only the change log is written through the datastore.
+        assert_equals([c[0][0] for c in Model.ds.put.call_args_list],
+                      [_change_key(7)])
 
     @raises(NotImplementedError)
     def test_queryless_all_unsupported(self):
@@ -247,6 +398,117 @@ class TestModel(object):
         Model.drop()
         assert_equals(Model.count(), 0)
 
+    def test_version(self):
+        assert_equals(Model.get_version(), None)
+        Model.create(key='0')
+        first = Model.get_version()
+        assert_true(first > 0)
+        Model.create(key='0', foo='bar')
+        second = Model.get_version()
+        assert_true(second > first)
+        Model.remove('0')
+        assert_true(Model.get_version() > second)
+
+    @patch('time.time')
+    def test_bump_version_consecutive(self, time):
+        # The first version comes from the clock, the next ones don't.
+        time.return_value = 5
+        assert_equals(Model.bump_version(), 5000000)
+        time.return_value = 10
+        assert_equals(Model.bump_version(), 5000001)
+
+    def test_version_redis(self):
+        redis = Mock()
+        redis.get.return_value = '41'
+        redis.incr.return_value = 42
+        Model.ds = Mock(_redis=redis)
+        Model.ds.get.return_value = None
+        assert_equals(Model.get_version(), 41)
+        assert_equals(Model.bump_version(['a']), 42)
+        assert_true(redis.setnx.called)
+        redis.incr.assert_called_with(str(VERSION_KEY))
+        Model.ds.put.assert_called_with(
+            _change_key(42), dict(version=42, previous=41, keys=['a']))
+
+    def test_get_changes(self):
+        first = Model.bump_version(['a'])
+        second = Model.bump_version(['b', 'c'])
+        third = Model.bump_version(['a'])
+        assert_equals(Model.get_changes(third, third), set())
+        assert_equals(Model.get_changes(second, third), set(['a']))
+        assert_equals(Model.get_changes(first, third), set(['a', 'b', 'c']))
+        assert_equals(Model.get_changes(None, third), None)
+
+    def test_get_changes_unknown_version(self):
+        version = Model.bump_version(['a'])
+        assert_equals(Model.get_changes(version + 1, version), None)
+
+    def test_get_changes_overwritten(self):
+        first = Model.bump_version(['a'])
+        second = Model.bump_version(['b'])
+        third = Model.bump_version(['c'])
+        # A later version landed in the same slot.
+        Model.ds.put(_change_key(second),
+                     dict(version=second + CHANGE_LOG_SIZE, previous=None,
+                          keys=[]))
+        assert_equals(Model.get_changes(second, third), set(['c']))
+        assert_equals(Model.get_changes(first, third), None)
+
+    def test_get_changes_beyond_log(self):
+        version = Model.bump_version(['a'])
+        with patch.object(Model.ds, 'get') as get:
+            assert_equals(
+                Model.get_changes(version - MAX_CHANGES - 1, version), None)
+            assert_false(get.called)
+
+    def test_get_changes_redis(self):
+        redis = Mock()
+        Model.ds = Mock(_redis=redis)
+        Model.ds.child_datastore.serializer = pickle
+        redis.mget.return_value = [
+            pickle.dumps(dict(version=v, previous=v - 1, keys=[str(v)]))
+            for v in (41, 42)]
+        assert_equals(Model.get_changes(40, 42), set(['41', '42']))
+        redis.mget.assert_called_once_with([str(_change_key(41)),
+                                            str(_change_key(42))])
+        assert_false(Model.ds.get.called)
+
+    def test_get_changes_racing_writers(self):
+        since = Model.bump_version(['a'])
+        # Two writers without an atomic increment got the same version.
+        with patch.object(Model, '_next_version', return_value=since + 1):
+            Model.bump_version(['b'])
+            Model.bump_version(['c'])
+        assert_equals(Model.get_changes(since, since + 1), None)
+
+    def test_slots_are_consecutive(self):
+        since = Model.bump_version()
+        for key in xrange(MAX_CHANGES):
+            Model.bump_version([str(key)])
+        assert_equals(len(Model.get_changes(since, Model.get_version())),
+                      MAX_CHANGES)
+
+    def test_writes_logged(self):
+        since = Model.bump_version()
+        Model.create(key='a')
+        Model.save_many([Model(key='b'), Model(key='c')])
+        Model.remove('a')
+        assert_equals(Model.get_changes(since, Model.get_version()),
+                      set(['a', 'b', 'c']))
+
+    def test_feed(self):
+        Model.feed = Mock()
+        try:
+            version = Model.bump_version(['a'])
+        finally:
+            feed, Model.feed = Model.feed, None
+        feed.publish.assert_called_with(
+            dict(version=version, previous=version - 1, keys=['a']))
+
+    def test_version_not_a_model(self):
+        Model.create(key='0')
+        assert_equals([m.key for m in Model.all()], ['0'])
+
     def test_count(self):
         assert_equals(Model.count(), 0)
         Model.create(key='0')
@@ -258,6 +520,18 @@ class TestModel(object):
         Model.remove('0')
         assert_equals(Model.count(), 0)
 
+    def test_count_keys_only(self):
+        Model.create(key='0')
+        Model.create(key='test:child')
+        with patch('switchboard.models.Model._all_records') as all_records:
+            assert_equals(Model.count(), 2)
+        assert_false(all_records.called)
+
+    def test_count_queried(self):
+        Model.ds = datastore.serialize.shim(datastore.DictDatastore(), pickle)
+        Model.create(key='0')
+        assert_equals(Model.count(), 1)
+
 
 class TestSwitch(object):
     def setup(self):
@@ -279,6 +553,45 @@ class TestSwitch(object):
     def teardown(self):
         reset_datastore()
 
+    def test_switch_defaults(self):
+        settings.SWITCHBOARD_SWITCH_DEFAULTS = {
+            'active_by_default': dict(is_active=True, label='active'),
+            'invalid': 1,
+        }
+        index = switch_defaults()
+        assert_equals(index, {
+            'active_by_default': dict(status=GLOBAL, label='active',
+                                      description=None),
+        })
+        assert_true(switch_defaults() is index)
+        settings.SWITCHBOARD_SWITCH_DEFAULTS = {}
+        assert_equals(switch_defaults(), {})
+
+    def test_from_data(self):
+        settings.SWITCHBOARD_SWITCH_DEFAULTS = {
+            'test': dict(is_active=True, label='active'),
+        }
+        data = Switch(key='test', status=DISABLED).__dict__
+        with patch('switchboard.models.switch_defaults') as defaults:
+            switch = Switch.from_data(data)
+            assert_false(defaults.called)
+        assert_equals(switch.__dict__, data)
+        assert_false(switch.__dict__ is data)
+        assert_equals(switch.status, DISABLED)
+
+    def test_from_data_incomplete(self):
+        settings.SWITCHBOARD_SWITCH_DEFAULTS = {
+            'test': dict(is_active=True, label='active'),
+        }
+        switch = Switch.from_data(dict(key='test'))
+        assert_equals(switch.status, GLOBAL)
+        assert_equals(switch.label, 'active')
+
+    @patch('switchboard.models.datetime')
+    def test_construct_with_dates(self, datetime_):
+        Switch(key='test', date_created=1, date_modified=2)
+        assert_false(datetime_.utcnow.called)
+
     def test_construct_with_defaults(self):
         settings.SWITCHBOARD_SWITCH_DEFAULTS = {
             'active_by_default': dict(is_active=True, label='active'),
@@ -498,6 +811,53 @@ class TestSwitch(object):
             assert_true(value in values)
             assert_true(field.name in fields)
 
+    def test_compile(self):
+        compiled = self.switch.compile(self.manager)
+        assert_true(isinstance(compiled, CompiledSwitch))
+        assert_equals(compiled.value, self.switch.value)
+        assert_equals(len(compiled.conditions), 1)
+        condition = compiled.conditions[0]
+        assert_equals(condition.condition_set, self.condition_set)
+        assert_equals(sorted(name for name, _, _ in condition.fields),
+                      ['ip_address', 'percent'])
+
+    def test_compile_passes_key(self):
+        with patch.object(self.condition_set, 'compile') as compile_:
+            self.switch.compile(self.manager)
+        assert_equals(compile_.call_args[0][1], self.switch.key)
+
+    def test_compile_unregistered_namespace(self):
+        self.switch.value['foobar'] = {'foo': [[INCLUDE, 'bar']]}
+        compiled = self.switch.compile(self.manager)
+        assert_equals(len(compiled.conditions), 1)
+
+    def test_compiled_is_current(self):
+        compiled = self.switch.compile(self.manager)
+        assert_true(compiled.is_current(self.switch))
+        self.switch.add_condition(
+            manager=self.manager,
+            condition_set=self.condition_set.get_id(),
+            field_name='ip_address',
+            condition='10.0.0.2',
+            commit=False,
+        )
+        assert_false(compiled.is_current(self.switch))
+
+    def test_conditions_not_changed_in_place(self):
+        namespace = self.condition_set.get_namespace()
+        value = self.switch.value
+        original = copy.deepcopy(value)
+        self.switch.add_condition(self.manager, self.condition_set.get_id(),
+                                  'ip_address', '10.0.0.2', commit=False)
+        self.switch.remove_condition(self.manager,
+                                     self.condition_set.get_id(),
+                                     'ip_address', '10.0.0.2', commit=False)
+        self.switch.clear_conditions(self.manager,
+                                     self.condition_set.get_id(),
+                                     commit=False)
+        assert_equals(value, original)
+        assert_false(namespace in self.switch.value)
+
     def test_get_status_label(self):
         self.switch.status = DISABLED
         assert_equals(self.switch.get_status_label(),
@@ -546,3 +906,78 @@ class TestSwitch(object):
                 }
             ]
         })
+
+
+class TestFrozenSwitch(object):
+    def setup(self):
+        self.condition_set = IPAddressConditionSet()
+        self.manager = SwitchManager(auto_create=True)
+        self.manager.register(self.condition_set)
+        self.switch = Switch.create(key='test', status=SELECTIVE,
+                                    label='Test')
+        self.switch.add_condition(
+            manager=self.manager,
+            condition_set=self.condition_set.get_id(),
+            field_name='ip_address',
+            condition='10.1.1.1',
+        )
+
+    def teardown(self):
+        reset_datastore()
+
+    def test_from_data(self):
+        frozen = FrozenSwitch.from_data(Switch.ds.get(_key('test')))
+        assert_equals(frozen.key, 'test')
+        assert_equals(frozen.status, SELECTIVE)
+        assert_equals(frozen.label, 'Test')
+        assert_equals(frozen.value, self.switch.value)
+        assert_equals(frozen.date_created, self.switch.date_created)
+        assert_equals(frozen.get_status_label(), 'Active for conditions')
+        assert_false(hasattr(frozen, '__dict__'))
+
+    def test_from_data_defaults(self):
+        settings.SWITCHBOARD_SWITCH_DEFAULTS = {
+            'active_by_default': dict(is_active=True, label='active'),
+        }
+        frozen = FrozenSwitch.from_data(dict(key='active_by_default'))
+        assert_equals(frozen.status, GLOBAL)
+        assert_equals(frozen.label, 'active')
+
+    @raises(AttributeError)
+    def test_read_only(self):
+        frozen = FrozenSwitch.from_data(Switch.ds.get(_key('test')))
+        frozen.status = GLOBAL
+
+    def test_timestamps(self):
+        frozen = FrozenSwitch('test', {}, GLOBAL, date_created=0,
+                              date_modified=86400.5)
+        assert_equals(frozen.date_created, datetime.datetime(1970, 1, 1))
+        assert_equals(frozen.date_modified,
+                      datetime.datetime(1970, 1, 2, 0, 0, 0, 500000))
+
+    def test_compile(self):
+        frozen = FrozenSwitch.from_data(Switch.ds.get(_key('test')))
+        compiled = frozen.compile(self.manager)
+        assert_true(compiled.is_current(self.switch))
+
+    def test_compiled_is_current_by_identity(self):
+        data = Switch.ds.get(_key('test'))
+        frozen = FrozenSwitch.from_data(data)
+        compiled = frozen.compile(self.manager)
+        assert_true(compiled.value is frozen.value)
+        assert_true(compiled.is_current(frozen))
+        # Another record with the same conditions is compared by value.
+        other = FrozenSwitch.from_data(data)
+        assert_true(compiled.is_current(other))
+        data['value'] = {}
+        assert_false(compiled.is_current(FrozenSwitch.from_data(data)))
+
+    def test_iterall(self):
+        switches = list(Switch.iterall(frozen=True))
+        assert_equals([type(s) for s in switches], [FrozenSwitch])
+
+    def test_get_many(self):
+        switches = Switch.get_many(['test'], frozen=True)
+        assert_true(isinstance(switches['test'], FrozenSwitch))
+        assert_true(isinstance(Model.get_many(['test'], frozen=True)['test'],
+                               Model))
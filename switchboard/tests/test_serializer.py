@@ -0,0 +1,163 @@
+"""
+switchboard.tests.test_serializer
+~~~~~~~~~~~~~~~
+
+:copyright: (c) 2015 Kyle Adams.
+:license: Apache License 2.0, see LICENSE for more details.
+"""
+import datetime
+import pickle
+
+import datastore.core
+from nose.tools import (
+    assert_equals,
+    assert_true,
+    assert_false,
+    raises,
+)
+
+from .. import serializer
+from ..models import (
+    FrozenSwitch,
+    Switch,
+    VERSION_KEY,
+    INCLUDE, EXCLUDE, SELECTIVE,
+    _change_key,
+    _key,
+)
+from ..serializer import Serializer, migrate
+
+
+def switch_data():
+    return dict(
+        key='foo',
+        value={
+            'ip_address': {
+                'ip_address': [[INCLUDE, '1.1.1.1'], [EXCLUDE, '2.2.2.2']],
+            },
+        },
+        label='Foo',
+        description='The foo switch',
+        status=SELECTIVE,
+        date_created=datetime.datetime(2015, 3, 1, 12, 30, 15, 123456),
+        date_modified=datetime.datetime(2016, 11, 7, 8, 0, 0, 999999),
+    )
+
+
+class TestSerializer(object):
+
+    def setup(self):
+        self.serializer = Serializer(codec='j')
+
+    def test_switch_roundtrip(self):
+        data = switch_data()
+        stored = self.serializer.dumps(data)
+        assert_true(stored.startswith('SB1j'))
+        switch = Switch.from_data(self.serializer.loads(stored))
+        for name, value in data.iteritems():
+            assert_equals(getattr(switch, name), value)
+
+    def test_switch_dates_as_timestamps(self):
+        loaded = self.serializer.loads(self.serializer.dumps(switch_data()))
+        assert_true(isinstance(loaded['date_created'], float))
+        frozen = FrozenSwitch.from_data(loaded)
+        assert_equals(frozen.date_created, switch_data()['date_created'])
+
+    def test_switch_smaller_than_pickle(self):
+        data = switch_data()
+        assert_true(len(self.serializer.dumps(data)) < len(pickle.dumps(data)))
+
+    def test_switch_without_dates(self):
+        data = switch_data()
+        data['date_created'] = data['date_modified'] = None
+        loaded = self.serializer.loads(self.serializer.dumps(data))
+        assert_equals(loaded['date_created'], None)
+        assert_equals(loaded['date_modified'], None)
+
+    def test_other_values(self):
+        for value in (1234567890123456, dict(version=2, previous=1,
+                                             keys=['a']), 'text'):
+            stored = self.serializer.dumps(value)
+            assert_equals(self.serializer.loads(stored), value)
+
+    def test_incomplete_switch(self):
+        # Records with missing attributes are kept as they are.
+        data = dict(key='foo', value={}, extra='bar')
+        stored = self.serializer.dumps(data)
+        assert_equals(self.serializer.loads(stored), data)
+
+    def test_switch_extra_attributes(self):
+        data = switch_data()
+        data['owner'] = 'ops'
+        data['date_reviewed'] = datetime.datetime(2016, 1, 2, 3, 4, 5, 6)
+        loaded = self.serializer.loads(self.serializer.dumps(data))
+        assert_equals(loaded['owner'], 'ops')
+        assert_equals(loaded['date_reviewed'], data['date_reviewed'])
+        switch = Switch.from_data(loaded)
+        assert_equals(switch.date_created, data['date_created'])
+
+    def test_datetime_values(self):
+        value = dict(when=datetime.datetime(2015, 3, 1, 12, 30, 15, 123456),
+                     dates=[datetime.datetime(1969, 12, 31, 23, 59, 59)])
+        stored = self.serializer.dumps(value)
+        assert_equals(self.serializer.loads(stored), value)
+
+    @raises(TypeError)
+    def test_unserializable_value(self):
+        self.serializer.dumps(object())
+
+    @raises(ValueError)
+    def test_legacy_refused(self):
+        self.serializer.loads(pickle.dumps({}))
+
+    def test_legacy_pickle(self):
+        data = dict(key='foo', value={})
+        reader = Serializer(codec='j', legacy=pickle)
+        assert_equals(reader.loads(pickle.dumps(data)), data)
+        assert_equals(reader.loads(pickle.dumps(data, 2)), data)
+
+    @raises(ValueError)
+    def test_unsupported_version(self):
+        self.serializer.loads('SB9j[0,1]')
+
+    @raises(ValueError)
+    def test_unknown_codec(self):
+        Serializer(codec='x')
+
+    def test_module_interface(self):
+        stored = serializer.dumps(switch_data())
+        assert_equals(serializer.loads(stored)['key'], 'foo')
+
+
+class TestMigrate(object):
+
+    def setup(self):
+        self.original_ds = Switch.ds
+        self.child = datastore.DictDatastore()
+        Switch.ds = datastore.serialize.shim(self.child, pickle)
+        Switch.create(**switch_data())
+        Switch.create(key='bar')
+
+    def teardown(self):
+        Switch.ds = self.original_ds
+
+    def test_migrate(self):
+        Switch.ds = datastore.serialize.shim(self.child, Serializer(codec='j'))
+        assert_equals(migrate(), 2)
+        assert_true(self.child.get(_key('foo')).startswith('SB1j'))
+        assert_true(self.child.get(VERSION_KEY).startswith('SB1j'))
+        version = Switch.get_version()
+        change = Switch.ds.get(_change_key(version))
+        assert_equals(change['version'], version)
+        assert_equals(Switch.get('foo').date_created,
+                      switch_data()['date_created'])
+        # Nothing pickled is left behind.
+        assert_equals(sorted(s.key for s in Switch.all()), ['bar', 'foo'])
+        assert_false(Switch.get('bar').value)
+
+    @raises(ValueError)
+    def test_legacy_refused_after_migrate(self):
+        Switch.ds = datastore.serialize.shim(self.child, Serializer(codec='j'))
+        migrate()
+        self.child.put(_key('baz'), pickle.dumps(dict(key='baz')))
+        Switch.ds.get(_key('baz'))